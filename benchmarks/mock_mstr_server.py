@@ -0,0 +1,280 @@
+import re
+import json
+import time
+import base64
+import random
+import threading
+from urllib.parse import urlparse, parse_qs
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+
+AUTH_TOKEN = "mock-auth-token"
+
+
+class MockMstrServer(object):
+    """
+    In-process mock of the MicroStrategy Library REST endpoints used by the plugin.
+    Every answer is delayed by `latency` seconds, chunk uploads fail with a 503 at the given `error_rate`,
+    bodies larger than `max_payload_size` bytes are refused with a 413, and a publication takes `publish_delay` seconds.
+    At most `max_concurrent_chunks` chunk uploads are processed at the same time, each for `latency` more seconds:
+    the next ones wait for a slot, and are throttled with a 429 once as many are already waiting.
+    The shared reports tree has `folder_fanout` subfolders per folder, down to `folder_depth` levels.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, max_payload_size=None, publish_delay=0.0, decode_chunks=False, seed=None, folder_fanout=5, folder_depth=4,
+                 max_concurrent_chunks=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_payload_size = max_payload_size
+        self.publish_delay = publish_delay
+        self.decode_chunks = decode_chunks
+        self.folder_fanout = folder_fanout
+        self.folder_depth = folder_depth
+        self.max_concurrent_chunks = max_concurrent_chunks
+        self.chunk_slots = threading.Semaphore(max_concurrent_chunks) if max_concurrent_chunks else None
+        self.waiting_chunks = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.datasets = {}
+        self.upload_sessions = {}
+        self.statistics = {}
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MockMstrRequestHandler)
+        self.server.mock = self
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-mstr-server")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/MicroStrategyLibrary/api".format(self.server.server_port)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.statistics[name] = self.statistics.get(name, 0) + value
+
+    def should_fail(self):
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def start_chunk(self):
+        if not self.chunk_slots:
+            return True
+        with self.lock:
+            if self.waiting_chunks >= self.max_concurrent_chunks:
+                return False
+            self.waiting_chunks += 1
+            self.statistics["peak_waiting_chunks"] = max(self.statistics.get("peak_waiting_chunks", 0), self.waiting_chunks)
+        self.chunk_slots.acquire()
+        with self.lock:
+            self.waiting_chunks -= 1
+        time.sleep(self.latency)
+        return True
+
+    def end_chunk(self):
+        if self.chunk_slots:
+            self.chunk_slots.release()
+
+    def create_dataset(self, dataset):
+        with self.lock:
+            dataset_id = "D{}".format(len(self.datasets) + 1)
+            self.datasets[dataset_id] = dataset
+        return dataset_id
+
+    def find_datasets(self, name):
+        with self.lock:
+            return [{"id": dataset_id, "name": dataset.get("name")} for dataset_id, dataset in self.datasets.items() if dataset.get("name") == name]
+
+    def open_upload_session(self, dataset_id):
+        with self.lock:
+            upload_session_id = "S{}".format(len(self.upload_sessions) + 1)
+            self.upload_sessions[upload_session_id] = {"dataset_id": dataset_id, "chunks": set(), "rows": 0, "published": None}
+        return upload_session_id
+
+    def add_chunk(self, upload_session_id, chunk):
+        rows_count = 0
+        if self.decode_chunks:
+            rows_count = len(json.loads(base64.b64decode(chunk["data"]).decode("utf-8")))
+        with self.lock:
+            upload_session = self.upload_sessions.get(upload_session_id)
+            if upload_session is None:
+                return False
+            upload_session["chunks"].add((chunk.get("tableName"), chunk.get("index")))
+            upload_session["rows"] += rows_count
+        return True
+
+    def publish(self, upload_session_id):
+        with self.lock:
+            upload_session = self.upload_sessions.get(upload_session_id)
+            if upload_session is None:
+                return False
+            upload_session["published"] = time.time() + self.publish_delay
+        return True
+
+    def get_publish_status(self, upload_session_id):
+        with self.lock:
+            upload_session = self.upload_sessions.get(upload_session_id) or {}
+            published = upload_session.get("published")
+        if published is None or published > time.time():
+            return {"status": 0}
+        return {"status": 1}
+
+    def get_received_rows(self):
+        with self.lock:
+            return sum(upload_session["rows"] for upload_session in self.upload_sessions.values())
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MockMstrRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def read_body(self):
+        body_size = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(body_size)
+        self.mock.increment("bytes_received", body_size)
+        return body
+
+    def reply(self, status_code, json_body=None, headers=None):
+        body = json.dumps(json_body).encode("utf-8") if json_body is not None else b""
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for header_name, header_value in (headers or {}).items():
+            self.send_header(header_name, header_value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, method):
+        body = self.read_body()
+        path = self.path.split("?")[0]
+        path = path[path.find("/api/") + 4:]
+        self.mock.increment("requests")
+        self.mock.increment("{} {}".format(method, re.sub(r"/[A-Z][0-9]+", "/{id}", path)))
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+        if self.mock.max_payload_size and len(body) > self.mock.max_payload_size:
+            self.mock.increment("refused_payloads")
+            return self.reply(413, {"message": "Payload of {} bytes is too large".format(len(body))})
+        if path != "/auth/login" and self.headers.get("X-MSTR-AuthToken") != AUTH_TOKEN:
+            return self.reply(401, {"message": "Invalid auth token"})
+        route = ROUTES.get(method, [])
+        for path_pattern, handler in route:
+            match = re.match(path_pattern + "$", path)
+            if match:
+                return handler(self, body, *match.groups())
+        return self.reply(404, {"message": "Unknown endpoint {} {}".format(method, path)})
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_PATCH(self):
+        self.handle_request("PATCH")
+
+    def login(self, body):
+        return self.reply(204, headers={"X-MSTR-AuthToken": AUTH_TOKEN})
+
+    def logout(self, body):
+        return self.reply(204)
+
+    def extend_session(self, body):
+        return self.reply(204)
+
+    def get_projects(self, body):
+        return self.reply(200, [{"id": "P1", "name": "Benchmark project"}])
+
+    def search(self, body):
+        dataset_name = parse_qs(urlparse(self.path).query).get("name", [""])[0]
+        return self.reply(200, {"result": self.mock.find_datasets(dataset_name)})
+
+    def get_folder(self, body, folder_id=None):
+        folder_id = folder_id or "F"
+        if folder_id.count(".") >= self.mock.folder_depth:
+            return self.reply(200, [])
+        subfolders = [
+            {"id": "{}.{}".format(folder_id, index), "name": "Folder {}.{}".format(folder_id[1:], index).replace(" .", " "), "type": 8}
+            for index in range(self.mock.folder_fanout)
+        ]
+        return self.reply(200, subfolders + [{"id": "{}.R".format(folder_id), "name": "A report", "type": 3}])
+
+    def create_dataset(self, body):
+        return self.reply(200, {"datasetId": self.mock.create_dataset(json.loads(body.decode("utf-8")))})
+
+    def update_table(self, body, dataset_id, table_name):
+        return self.reply(200, {})
+
+    def open_upload_session(self, body, dataset_id):
+        return self.reply(200, {"uploadSessionId": self.mock.open_upload_session(dataset_id)})
+
+    def push_chunk(self, body, dataset_id, upload_session_id):
+        if self.mock.should_fail():
+            self.mock.increment("injected_errors")
+            return self.reply(503, {"message": "Injected error"}, headers={"Retry-After": "0"})
+        if not self.mock.start_chunk():
+            self.mock.increment("throttled_chunks")
+            return self.reply(429, {"message": "Too many concurrent uploads"}, headers={"Retry-After": "1"})
+        try:
+            if not self.mock.add_chunk(upload_session_id, json.loads(body.decode("utf-8"))):
+                return self.reply(404, {"message": "Unknown upload session"})
+            return self.reply(200, {})
+        finally:
+            self.mock.end_chunk()
+
+    def publish(self, body, dataset_id, upload_session_id):
+        if not self.mock.publish(upload_session_id):
+            return self.reply(404, {"message": "Unknown upload session"})
+        return self.reply(200, {})
+
+    def get_publish_status(self, body, dataset_id, upload_session_id):
+        return self.reply(200, self.mock.get_publish_status(upload_session_id))
+
+
+ROUTES = {
+    "GET": [
+        (r"/projects", MockMstrRequestHandler.get_projects),
+        (r"/searches/results", MockMstrRequestHandler.search),
+        (r"/folders/preDefined/7", MockMstrRequestHandler.get_folder),
+        (r"/folders/(F[^/]*)", MockMstrRequestHandler.get_folder),
+        (r"/datasets/([^/]+)/uploadSessions/([^/]+)/publishStatus", MockMstrRequestHandler.get_publish_status),
+    ],
+    "POST": [
+        (r"/auth/login", MockMstrRequestHandler.login),
+        (r"/auth/logout", MockMstrRequestHandler.logout),
+        (r"/datasets", MockMstrRequestHandler.create_dataset),
+        (r"/datasets/([^/]+)/uploadSessions", MockMstrRequestHandler.open_upload_session),
+        (r"/datasets/([^/]+)/uploadSessions/([^/]+)/publish", MockMstrRequestHandler.publish),
+    ],
+    "PUT": [
+        (r"/sessions", MockMstrRequestHandler.extend_session),
+        (r"/datasets/([^/]+)/uploadSessions/([^/]+)", MockMstrRequestHandler.push_chunk),
+    ],
+    "PATCH": [
+        (r"/datasets/([^/]+)/tables/([^/]+)", MockMstrRequestHandler.update_table),
+    ],
+}
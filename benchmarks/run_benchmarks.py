@@ -0,0 +1,221 @@
+"""
+End to end benchmarks of the MicroStrategy exporter against an in-process mock of the Library REST API.
+
+    python benchmarks/run_benchmarks.py [--rows 100000] [--schemas narrow,wide] [--latency 0.005] [--output results.json]
+
+Each configuration runs CustomExporter.open / write_row / close over synthetic rows, with a fresh plugin state
+directory, and reports throughput and memory. Compare the JSON output of two versions to spot regressions.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIRECTORY = os.path.dirname(BENCHMARKS_DIRECTORY)
+sys.path.insert(0, os.path.join(PLUGIN_DIRECTORY, "python-lib"))
+sys.path.insert(0, os.path.join(PLUGIN_DIRECTORY, "python-exporters", "microstrategy"))
+
+from mock_mstr_server import MockMstrServer  # noqa: E402
+
+
+SCHEMAS = {
+    "narrow": [("id", "bigint"), ("amount", "double"), ("label", "string")],
+    "wide": [("id", "bigint")] + [("metric_{}".format(index), "double") for index in range(100)] + [("attribute_{}".format(index), "string") for index in range(99)],
+    "date_heavy": [("id", "bigint")] + [("date_{}".format(index), "date") for index in range(10)] + [("amount", "double")],
+    "string_heavy": [("id", "bigint")] + [("text_{}".format(index), "string") for index in range(20)],
+}
+DATAFRAME_CHUNK_ROWS = 10000
+
+
+def install_dataiku_shim():
+    # Outside of DSS, the exporter only needs the base Exporter class and the schema helper
+    try:
+        import dataiku
+        return dataiku
+    except ImportError:
+        pass
+    import types
+    dataiku_shim = types.ModuleType("dataiku")
+    dataiku_exporter = types.ModuleType("dataiku.exporter")
+
+    class Dataset(object):
+        @staticmethod
+        def get_dataframe_schema_st(columns):
+            return [column["name"] for column in columns], None, []
+
+    class Exporter(object):
+        pass
+
+    dataiku_shim.Dataset = Dataset
+    dataiku_shim.exporter = dataiku_exporter
+    dataiku_exporter.Exporter = Exporter
+    sys.modules["dataiku"] = dataiku_shim
+    sys.modules["dataiku.exporter"] = dataiku_exporter
+    return dataiku_shim
+
+
+def generate_rows(columns, rows_count, seed=0):
+    generator = random.Random(seed)
+    start_date = datetime(2020, 1, 1)
+    words = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliett"]
+    for row_index in range(rows_count):
+        row = []
+        for column_name, column_type in columns:
+            if column_name == "id":
+                row.append(row_index)
+            elif column_type == "double":
+                row.append(round(generator.random() * 10000, 2))
+            elif column_type == "date":
+                row.append((start_date + timedelta(seconds=generator.randrange(0, 3 * 365 * 86400))).strftime("%Y-%m-%dT%H:%M:%S.000Z"))
+            else:
+                row.append(" ".join(generator.choice(words) for word_index in range(generator.randrange(1, 6))))
+        yield tuple(row)
+
+
+def run_configuration(schema_name, rows_count, arguments):
+    import exporter
+    columns = SCHEMAS[schema_name]
+    rows = list(generate_rows(columns, rows_count))
+    if arguments.dataframes:
+        import pandas
+        columns_names = [column_name for column_name, column_type in columns]
+        dataframes = [
+            pandas.DataFrame.from_records(rows[chunk_start:chunk_start + DATAFRAME_CHUNK_ROWS], columns=columns_names)
+            for chunk_start in range(0, rows_count, DATAFRAME_CHUNK_ROWS)
+        ]
+    state_directory = tempfile.mkdtemp(prefix="mstr-benchmark-")
+    os.environ["MSTR_PLUGIN_STATE_DIR"] = state_directory
+    reset_plugin_singletons()
+    mock_server = MockMstrServer(
+        latency=arguments.latency,
+        error_rate=arguments.error_rate,
+        max_payload_size=arguments.max_payload_size,
+        publish_delay=arguments.publish_delay,
+        decode_chunks=arguments.verify,
+        seed=0,
+        max_concurrent_chunks=arguments.server_capacity
+    ).start()
+    config = {
+        "microstrategy_api": {"username": "benchmark", "password": "benchmark", "override_url": mock_server.url},
+        "microstrategy_project": {"project_name": "Benchmark project"},
+        "dataset_name": "benchmark {}".format(schema_name),
+        "max_concurrent_uploads": arguments.concurrency,
+        "chunk_target_size_mb": arguments.chunk_size_mb,
+        "memory_budget_mb": arguments.memory_budget_mb,
+        "adaptive_concurrency": not arguments.fixed_concurrency,
+    }
+    schema = {"columns": [{"name": column_name, "type": column_type} for column_name, column_type in columns]}
+    if arguments.trace_memory:
+        tracemalloc.start()
+    try:
+        start_time = time.perf_counter()
+        custom_exporter = exporter.CustomExporter(config, {})
+        custom_exporter.open(schema)
+        if arguments.dataframes:
+            for dataframe in dataframes:
+                custom_exporter.write_dataframe(dataframe)
+        else:
+            for row in rows:
+                custom_exporter.write_row(row)
+        custom_exporter.close()
+        duration = time.perf_counter() - start_time
+        traced_peak = tracemalloc.get_traced_memory()[1] if arguments.trace_memory else None
+    finally:
+        if arguments.trace_memory:
+            tracemalloc.stop()
+        mock_server.stop()
+        shutil.rmtree(state_directory, ignore_errors=True)
+    summary = custom_exporter.metrics.get_summary(http_statistics=custom_exporter.transport.statistics)
+    if arguments.verify and mock_server.get_received_rows() != rows_count:
+        raise Exception("Mock server received {} rows instead of {}".format(mock_server.get_received_rows(), rows_count))
+    return {
+        "schema": schema_name,
+        "columns": len(columns),
+        "rows": rows_count,
+        "seconds": round(duration, 3),
+        "rows_per_second": round(rows_count / duration, 1),
+        "megabytes_per_second": round(summary["bytes_sent"] / duration / 1024 / 1024, 2),
+        "bytes_sent": summary["bytes_sent"],
+        "chunks": summary["counters"].get("chunks", 0),
+        "retries": summary["http"].get("retries", 0),
+        "throttled_requests": summary["http"].get("throttled_requests", 0),
+        "concurrency_limit": summary["http"].get("concurrency_limit"),
+        "lowest_concurrency_limit": summary["http"].get("lowest_concurrency_limit"),
+        "peak_rss_mb": summary["peak_memory_mb"],
+        "peak_reserved_mb": summary["counters"].get("peak_reserved_mb"),
+        "spilled_chunks": summary["counters"].get("spilled_chunks", 0),
+        "traced_peak_mb": round(traced_peak / 1024.0 / 1024.0, 1) if traced_peak is not None else None,
+        "phases": summary["phases"],
+        "server": mock_server.statistics,
+    }
+
+
+def reset_plugin_singletons():
+    # Tokens and metadata are cached per process, each configuration starts cold
+    import mstr_auth
+    import mstr_cache
+    mstr_auth.token_manager = None
+    mstr_cache.metadata_cache = None
+
+
+def print_results(results):
+    header = "{:<14} {:>8} {:>9} {:>9} {:>12} {:>8} {:>7} {:>8} {:>10}".format(
+        "schema", "columns", "rows", "seconds", "rows/s", "MB/s", "chunks", "retries", "peak MB"
+    )
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print("{:<14} {:>8} {:>9} {:>9.2f} {:>12.0f} {:>8.2f} {:>7} {:>8} {:>10}".format(
+            result["schema"], result["columns"], result["rows"], result["seconds"], result["rows_per_second"],
+            result["megabytes_per_second"], result["chunks"], result["retries"],
+            result["traced_peak_mb"] if result["traced_peak_mb"] is not None else result["peak_rss_mb"]
+        ))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the MicroStrategy exporter against a mock server")
+    parser.add_argument("--rows", type=int, default=50000, help="rows exported per configuration")
+    parser.add_argument("--schemas", default=",".join(SCHEMAS), help="comma separated list among {}".format(", ".join(SCHEMAS)))
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent chunk uploads")
+    parser.add_argument("--chunk-size-mb", type=float, default=10, help="target chunk payload size")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added by the mock server to every answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of chunk uploads failing with a 503")
+    parser.add_argument("--max-payload-size", type=int, default=None, help="bodies larger than this many bytes are refused")
+    parser.add_argument("--server-capacity", type=int, default=None, help="concurrent chunk uploads above which the mock server answers 429")
+    parser.add_argument("--fixed-concurrency", action="store_true", help="disable the adaptive concurrency of the chunk uploads")
+    parser.add_argument("--publish-delay", type=float, default=0.0, help="seconds before a publication completes")
+    parser.add_argument("--memory-budget-mb", type=float, default=None, help="memory budget of the exporter")
+    parser.add_argument("--dataframes", action="store_true", help="send the rows by DataFrame chunks through write_dataframe instead of write_row")
+    parser.add_argument("--verify", action="store_true", help="decode every chunk on the mock server and check the row count")
+    parser.add_argument("--trace-memory", action="store_true", help="report the Python allocation peak of each configuration (slower)")
+    parser.add_argument("--output", help="write the detailed results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show the exporter logs")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    install_dataiku_shim()
+    # Configured before the plugin modules are imported, so that their own basicConfig call keeps this level
+    logging.basicConfig(level=logging.INFO if arguments.verbose else logging.WARNING, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+    results = []
+    for schema_name in arguments.schemas.split(","):
+        if schema_name not in SCHEMAS:
+            raise ValueError("Unknown schema '{}', choose among {}".format(schema_name, ", ".join(SCHEMAS)))
+        results.append(run_configuration(schema_name, arguments.rows, arguments))
+    print_results(results)
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump({"arguments": vars(arguments), "python": sys.version, "results": results}, output_file, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
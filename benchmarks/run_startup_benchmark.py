@@ -0,0 +1,152 @@
+"""
+Startup benchmark of the parameters UI callbacks (resource/browse_folder.py) against an in-process mock of the Library REST API.
+
+    python benchmarks/run_startup_benchmark.py [--runs 10] [--latency 0.05] [--output results.json]
+
+Measures, for the project and folder dropdowns:
+- the import of the callback module in a new process
+- a callback in a new process with an empty plugin state directory (login and metadata requests)
+- a callback in a new process once tokens and metadata are cached on disk
+- repeated callbacks in the same process
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIRECTORY = os.path.dirname(BENCHMARKS_DIRECTORY)
+LIBRARY_DIRECTORIES = [os.path.join(PLUGIN_DIRECTORY, "python-lib"), os.path.join(PLUGIN_DIRECTORY, "resource")]
+
+from mock_mstr_server import MockMstrServer  # noqa: E402
+
+
+CALLBACK_PARAMETERS = ["selected_project_id", "selected_folder_id"]
+HEAVY_MODULES = ["pandas", "numpy", "dateutil"]
+
+
+def build_callback_config(server_url):
+    return {
+        "microstrategy_api": {"username": "benchmark", "password": "benchmark", "override_url": server_url},
+        "microstrategy_project": {},
+        "selected_project_id": "P1",
+        "selected_folder_id": "{}",
+        "destination": "shared_reports"
+    }
+
+
+def run_child(parameter_name, server_url):
+    # Runs in a new process: one import and one callback, timed separately
+    sys.path[:0] = LIBRARY_DIRECTORIES
+    import_start = time.perf_counter()
+    import browse_folder
+    import_duration = time.perf_counter() - import_start
+    logging.getLogger().setLevel(logging.WARNING)
+    callback_start = time.perf_counter()
+    browse_folder.do({"parameterName": parameter_name}, build_callback_config(server_url), {}, [])
+    callback_duration = time.perf_counter() - callback_start
+    print(json.dumps({
+        "import_ms": import_duration * 1000,
+        "callback_ms": callback_duration * 1000,
+        "heavy_modules": [module_name for module_name in HEAVY_MODULES if module_name in sys.modules]
+    }))
+
+
+def run_in_new_process(parameter_name, server_url, state_directory):
+    environment = dict(os.environ, MSTR_PLUGIN_STATE_DIR=state_directory)
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), "--child", parameter_name, "--url", server_url],
+        env=environment
+    )
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def run_in_same_process(parameter_name, server_url, runs):
+    sys.path[:0] = LIBRARY_DIRECTORIES
+    import browse_folder
+    logging.getLogger().setLevel(logging.WARNING)
+    config = build_callback_config(server_url)
+    durations = []
+    for run_index in range(runs):
+        callback_start = time.perf_counter()
+        browse_folder.do({"parameterName": parameter_name}, config, {}, [])
+        durations.append((time.perf_counter() - callback_start) * 1000)
+    # The folders indexed in the background need the mock server until they are done
+    import mstr_folders
+    for indexing_thread in list(mstr_folders.indexing_threads.values()):
+        indexing_thread.join()
+    return durations
+
+
+def run_parameter(parameter_name, mock_server, runs):
+    cold_results = []
+    warm_results = []
+    for run_index in range(runs):
+        state_directory = tempfile.mkdtemp(prefix="mstr-startup-benchmark-")
+        try:
+            cold_results.append(run_in_new_process(parameter_name, mock_server.url, state_directory))
+            warm_results.append(run_in_new_process(parameter_name, mock_server.url, state_directory))
+        finally:
+            shutil.rmtree(state_directory, ignore_errors=True)
+    # The first call of the process fills the caches, the next ones show the reuse of the client and its caches
+    same_process_durations = run_in_same_process(parameter_name, mock_server.url, runs + 1)
+    return {
+        "parameter": parameter_name,
+        "import_ms": round(statistics.median(result["import_ms"] for result in cold_results), 1),
+        "new_process_empty_state_ms": round(statistics.median(result["callback_ms"] for result in cold_results), 1),
+        "new_process_cached_state_ms": round(statistics.median(result["callback_ms"] for result in warm_results), 1),
+        "same_process_ms": round(statistics.median(same_process_durations[1:]), 1),
+        "heavy_modules": sorted(set(module_name for result in cold_results for module_name in result["heavy_modules"]))
+    }
+
+
+def print_results(results):
+    header = "{:<22} {:>10} {:>14} {:>15} {:>13}  {}".format("parameter", "import ms", "empty state ms", "cached state ms", "same proc ms", "heavy modules")
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print("{:<22} {:>10.1f} {:>14.1f} {:>15.1f} {:>13.1f}  {}".format(
+            result["parameter"], result["import_ms"], result["new_process_empty_state_ms"], result["new_process_cached_state_ms"],
+            result["same_process_ms"], ", ".join(result["heavy_modules"]) or "-"
+        ))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the parameters UI callbacks against a mock server")
+    parser.add_argument("--runs", type=int, default=5, help="new processes started per measure")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added by the mock server to every answer")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    if arguments.child:
+        run_child(arguments.child, arguments.url)
+        return
+    logging.getLogger().setLevel(logging.WARNING)
+    mock_server = MockMstrServer(latency=arguments.latency, seed=0).start()
+    # Plugin state of the callbacks run in this process
+    state_directory = tempfile.mkdtemp(prefix="mstr-startup-benchmark-")
+    os.environ["MSTR_PLUGIN_STATE_DIR"] = state_directory
+    try:
+        results = [run_parameter(parameter_name, mock_server, arguments.runs) for parameter_name in CALLBACK_PARAMETERS]
+    finally:
+        mock_server.stop()
+        shutil.rmtree(state_directory, ignore_errors=True)
+    print_results(results)
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump({"arguments": vars(arguments), "python": sys.version, "results": results}, output_file, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import logging
+import pandas
+import dataiku
+from dataiku.customrecipe import get_input_names_for_role, get_output_names_for_role, get_recipe_config, get_plugin_config
+from mstr_session import MstrSession, get_base_url
+from mstr_uploader import get_chunk_sizer
+from mstr_config import get_cube_name, get_ui_browse_results, get_max_concurrent_uploads, build_transport
+from mstr_publish import DEFAULT_PUBLISH_TIMEOUT
+from mstr_pipeline import bulk_load, DEFAULT_ENCODE_WORKERS
+from mstr_metrics import ExportMetrics
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+DEFAULT_READ_CHUNK_ROWS = 50000
+
+
+logger.info("Starting MicroStrategy bulk load recipe v1.4.0")
+config = get_recipe_config()
+plugin_config = get_plugin_config()
+base_url = get_base_url(config, plugin_config)
+project_name = config["microstrategy_project"].get("project_name", None)
+username = config["microstrategy_api"].get("username", None)
+password = config["microstrategy_api"].get("password", '')
+if not (username and base_url):
+    raise ValueError("username and base_url must be filled")
+dataset_name = get_cube_name(config)
+metrics = ExportMetrics()
+transport = build_transport(config, metrics=metrics)
+session = MstrSession(base_url, username, password, generate_verbose_logs=config.get("generate_verbose_logs", False), transport=transport)
+project_id, folder_id = get_ui_browse_results(config)
+if not project_id:
+    project_id = session.get_project_id(project_name)
+
+input_dataset = dataiku.Dataset(get_input_names_for_role("input_dataset")[0])
+columns = input_dataset.read_schema()
+# DSS types are kept, so that integer columns with empty cells are not read as floats
+chunks = input_dataset.iter_dataframes(chunksize=config.get("read_chunk_rows") or DEFAULT_READ_CHUNK_ROWS, infer_with_pandas=False)
+bulk_load(
+    session,
+    project_id,
+    dataset_name,
+    [column.get("name") for column in columns],
+    [column.get("type") for column in columns],
+    chunks,
+    folder_id=folder_id,
+    encode_workers=config.get("encode_workers") or DEFAULT_ENCODE_WORKERS,
+    upload_workers=get_max_concurrent_uploads(config),
+    chunk_sizer=get_chunk_sizer(config),
+    metrics=metrics,
+    wait_for_publish=config.get("wait_for_publish", True),
+    publish_timeout=config.get("publish_timeout") or DEFAULT_PUBLISH_TIMEOUT
+)
+# No logout, the session token is kept for the next exports
+session.auth.release()
+transport.close()
+summary = metrics.log_summary(http_statistics=transport.statistics, file_path=config.get("metrics_file"))
+
+output_names = get_output_names_for_role("export_summary")
+if output_names:
+    summary_rows = [[dataset_name, phase, phase_times["seconds"], phase_times["count"]] for phase, phase_times in sorted(summary["phases"].items())]
+    dataiku.Dataset(output_names[0]).write_with_schema(pandas.DataFrame(summary_rows, columns=["cube", "phase", "seconds", "count"]))
@@ -0,0 +1,85 @@
+import logging
+import pandas
+import dataiku
+from dataiku.customrecipe import get_input_names_for_role, get_output_names_for_role, get_recipe_config, get_plugin_config
+from mstr_session import MstrSession, get_base_url
+from mstr_uploader import get_chunk_sizer
+from mstr_config import get_cube_name, get_ui_browse_results, get_max_concurrent_uploads, build_transport
+from mstr_publish import DEFAULT_PUBLISH_TIMEOUT
+from mstr_orchestrator import CubeRefreshOrchestrator, CubeRefresh, DEFAULT_MAX_CONCURRENT_CUBES, DEFAULT_MAX_CONCURRENT_PUBLISHES
+from mstr_metrics import ExportMetrics
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+DEFAULT_READ_CHUNK_ROWS = 50000
+
+
+def build_chunks_reader(input_dataset, chunk_rows):
+    # The dataset is only read when its cube's turn comes
+    def read_chunks():
+        # DSS types are kept, so that integer columns with empty cells are not read as floats
+        return input_dataset.iter_dataframes(chunksize=chunk_rows, infer_with_pandas=False)
+    return read_chunks
+
+
+logger.info("Starting MicroStrategy multi-cube refresh recipe v1.4.0")
+config = get_recipe_config()
+plugin_config = get_plugin_config()
+base_url = get_base_url(config, plugin_config)
+project_name = config["microstrategy_project"].get("project_name", None)
+username = config["microstrategy_api"].get("username", None)
+password = config["microstrategy_api"].get("password", '')
+if not (username and base_url):
+    raise ValueError("username and base_url must be filled")
+max_concurrent_cubes = config.get("max_concurrent_cubes") or DEFAULT_MAX_CONCURRENT_CUBES
+max_concurrent_uploads = get_max_concurrent_uploads(config)
+max_concurrent_publishes = config.get("max_concurrent_publishes") or DEFAULT_MAX_CONCURRENT_PUBLISHES
+metrics = ExportMetrics()
+# Room for every upload worker, publication and cube being opened, plus the project lookup
+transport = build_transport(config, metrics=metrics, pool_size=max_concurrent_uploads + max_concurrent_publishes + max_concurrent_cubes + 2)
+generate_verbose_logs = config.get("generate_verbose_logs", False)
+session = MstrSession(base_url, username, password, generate_verbose_logs=generate_verbose_logs, transport=transport)
+project_id, folder_id = get_ui_browse_results(config)
+if not project_id:
+    project_id = session.get_project_id(project_name)
+
+orchestrator = CubeRefreshOrchestrator(
+    lambda: MstrSession(base_url, username, password, generate_verbose_logs=generate_verbose_logs, transport=transport),
+    project_id,
+    folder_id=folder_id,
+    max_concurrent_cubes=max_concurrent_cubes,
+    max_concurrent_uploads=max_concurrent_uploads,
+    max_concurrent_publishes=max_concurrent_publishes,
+    wait_for_publish=config.get("wait_for_publish", True),
+    publish_timeout=config.get("publish_timeout") or DEFAULT_PUBLISH_TIMEOUT,
+    metrics=metrics
+)
+cube_names = config.get("cube_names") or {}
+read_chunk_rows = config.get("read_chunk_rows") or DEFAULT_READ_CHUNK_ROWS
+for input_name in get_input_names_for_role("input_datasets"):
+    input_dataset = dataiku.Dataset(input_name)
+    short_name = input_name.split(".")[-1]
+    columns = input_dataset.read_schema()
+    orchestrator.add_cube(CubeRefresh(
+        get_cube_name({"dataset_name": cube_names.get(input_name) or cube_names.get(short_name) or short_name}),
+        [column.get("name") for column in columns],
+        [column.get("type") for column in columns],
+        build_chunks_reader(input_dataset, read_chunk_rows),
+        input_name=short_name,
+        chunk_sizer=get_chunk_sizer(config)
+    ))
+
+orchestrator.run()
+reports = orchestrator.log_summary()
+# No logout, the session token is kept for the next exports
+session.auth.release()
+transport.close()
+metrics.log_summary(http_statistics=transport.statistics, file_path=config.get("metrics_file"))
+
+output_names = get_output_names_for_role("refresh_summary")
+if output_names:
+    dataiku.Dataset(output_names[0]).write_with_schema(pandas.DataFrame(reports))
+orchestrator.raise_on_failure()
@@ -0,0 +1,71 @@
+import logging
+import pandas
+import dataiku
+from dataiku.customrecipe import get_input_names_for_role, get_output_names_for_role, get_recipe_config, get_plugin_config
+from mstr_session import MstrSession, get_base_url
+from mstr_uploader import get_chunk_sizer
+from mstr_config import get_cube_name, get_ui_browse_results, get_max_concurrent_uploads, build_transport
+from mstr_publish import DEFAULT_PUBLISH_TIMEOUT
+from mstr_cube_export import MultiTableExport
+from mstr_metrics import ExportMetrics
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+logger.info("Starting MicroStrategy multi-table export recipe v1.4.0")
+config = get_recipe_config()
+plugin_config = get_plugin_config()
+base_url = get_base_url(config, plugin_config)
+project_name = config["microstrategy_project"].get("project_name", None)
+username = config["microstrategy_api"].get("username", None)
+password = config["microstrategy_api"].get("password", '')
+if not (username and base_url):
+    raise ValueError("username and base_url must be filled")
+dataset_name = get_cube_name(config)
+metrics = ExportMetrics()
+transport = build_transport(config, metrics=metrics)
+session = MstrSession(base_url, username, password, generate_verbose_logs=config.get("generate_verbose_logs", False), transport=transport)
+project_id, folder_id = get_ui_browse_results(config)
+if not project_id:
+    project_id = session.get_project_id(project_name)
+
+multi_table_export = MultiTableExport(
+    session,
+    project_id,
+    dataset_name,
+    folder_id=folder_id,
+    max_concurrent_uploads=get_max_concurrent_uploads(config),
+    wait_for_publish=config.get("wait_for_publish", True),
+    publish_timeout=config.get("publish_timeout") or DEFAULT_PUBLISH_TIMEOUT,
+    metrics=metrics
+)
+rows_iterators = {}
+for input_name in get_input_names_for_role("input_datasets"):
+    input_dataset = dataiku.Dataset(input_name)
+    table_name = input_name.split(".")[-1]
+    columns = input_dataset.read_schema()
+    multi_table_export.add_table(
+        table_name,
+        [column.get("name") for column in columns],
+        [column.get("type") for column in columns],
+        get_chunk_sizer(config)
+    )
+    rows_iterators[table_name] = input_dataset.iter_tuples()
+
+multi_table_export.open()
+multi_table_export.export_tables(rows_iterators)
+rows_counts = multi_table_export.close()
+# No logout, the session token is kept for the next exports
+session.auth.release()
+transport.close()
+metrics.log_summary(http_statistics=transport.statistics, file_path=config.get("metrics_file"))
+
+output_names = get_output_names_for_role("export_summary")
+if output_names:
+    summary = pandas.DataFrame(
+        [[dataset_name, table_name, rows_count] for table_name, rows_count in rows_counts.items()],
+        columns=["cube", "table", "rows"]
+    )
+    dataiku.Dataset(output_names[0]).write_with_schema(summary)
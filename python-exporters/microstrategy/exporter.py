@@ -1,6 +1,19 @@
+import time
+import pandas
 import logging
-from numpy import isnan
+from collections import deque
 from mstr_session import MstrSession, get_base_url
+from mstr_uploader import ChunkUploader, get_chunk_sizer
+from mstr_incremental import IncrementalExport, EXPORT_MODE_FULL, confirm_pending_state, discard_pending_state
+from mstr_checkpoint import UploadCheckpoint, CHUNK_REGISTERED, CHUNK_WRITTEN, CHUNK_ACKNOWLEDGED
+from mstr_encoding import build_dataframe
+from mstr_state import build_state_key
+from mstr_publish import PublishMonitor, PendingPublication, DEFAULT_PUBLISH_TIMEOUT
+from mstr_metrics import ExportMetrics
+from mstr_target import TargetFingerprint
+from mstr_memory import MemoryBudget
+from mstr_fanout import FanOutSession, FanOutTarget
+from mstr_config import get_cube_name, get_ui_browse_results, get_max_concurrent_uploads, build_transport
 
 import dataiku
 from dataiku.exporter import Exporter
@@ -28,22 +41,46 @@ class CustomExporter(Exporter):
         :param config: the dict of the configuration of the object
         :param plugin_config: contains the plugin settings
         """
+        self.metrics = ExportMetrics()
+        self.metrics_file = config.get("metrics_file")
+        self.read_start = None
         self.row_buffer = []
-        self.buffer_size = 5000
-        logger.info("Starting MicroStrategy exporter v1.3.0")
+        self.dataframe_buffer = None
+        self.chunk_sizer = get_chunk_sizer(config)
+        logger.info("Starting MicroStrategy exporter v1.4.0")
         # Plugin settings
         self.base_url = get_base_url(config, plugin_config)
         self.project_name = config["microstrategy_project"].get("project_name", None)
         self.project_id = ""  # the project id, obtained through a later request
-        self.dataset_name = str(config.get("dataset_name", None)).replace(" (created by Dataiku DSS)", "") + " (created by Dataiku DSS)"
+        self.dataset_name = get_cube_name(config)
         self.dataset_id = ""  # the dataset id, obtained at creation or on update
         self.table_name = "dss_data"
         self.username = config["microstrategy_api"].get("username", None)
         self.password = config["microstrategy_api"].get("password", '')
         generate_verbose_logs = config.get("generate_verbose_logs", False)
+        self.max_concurrent_uploads = get_max_concurrent_uploads(config)
+        memory_budget_mb = config.get("memory_budget_mb")
+        self.memory_budget = MemoryBudget(memory_budget_mb, self.max_concurrent_uploads, metrics=self.metrics) if memory_budget_mb else None
+        # With a memory budget, the first row sets the size of the first chunk
+        self.chunk_rows_limit = 1 if self.memory_budget else self.chunk_sizer.chunk_rows
         self.upload_session_id = None
-        self.session = MstrSession(self.base_url, self.username, self.password, generate_verbose_logs=generate_verbose_logs)
-        self.project_id, self.folder_id = self.get_ui_browse_results(config)
+        self.uploader = None
+        self.export_mode = config.get("export_mode") or EXPORT_MODE_FULL
+        self.watermark_column = config.get("watermark_column")
+        self.incremental_export = None
+        self.resumable_export = config.get("resumable_export", False)
+        self.checkpoint = None
+        self.resume_plan = deque()
+        self.acknowledged_chunks = 0
+        self.wait_for_publish = config.get("wait_for_publish", True)
+        self.publish_timeout = config.get("publish_timeout") or DEFAULT_PUBLISH_TIMEOUT
+        self.publish_monitor = None
+        fan_out_targets = [target_config for target_config in config.get("fan_out_targets") or [] if target_config.get("project_name")]
+        # Every target dataset has its own upload workers
+        self.transport = build_transport(config, metrics=self.metrics, max_concurrent_uploads=self.max_concurrent_uploads * (1 + len(fan_out_targets)))
+        self.session = MstrSession(self.base_url, self.username, self.password, generate_verbose_logs=generate_verbose_logs, transport=self.transport)
+        self.project_id, self.folder_id = get_ui_browse_results(config)
+        self.fan_out = self.build_fan_out(config, fan_out_targets, generate_verbose_logs)
 
         if not (self.username and self.base_url):
             logger.error('Connection params: {}'.format(
@@ -55,17 +92,23 @@ class CustomExporter(Exporter):
             )
             raise ValueError("username and base_url must be filled")
 
-    def get_ui_browse_results(self, config):
-        import json
-        folder_id = None
-        project_id = config.get("selected_project_id", None)
-        selected_folder_id = json.loads(config.get("selected_folder_id", "{}"))
-        folder_ids = selected_folder_id.get("ids")
-        if folder_ids:
-            folder_id = folder_ids[-1]
-        if config.get("destination", "my_reports") == "my_reports":
-            folder_id = None
-        return project_id, folder_id
+    def build_fan_out(self, config, fan_out_targets, generate_verbose_logs):
+        # Additional cubes receiving the same chunks, encoded once for all of them
+        targets = []
+        for target_config in fan_out_targets:
+            # Sessions share the transport, and the session token of the user
+            target_session = MstrSession(self.base_url, self.username, self.password, generate_verbose_logs=generate_verbose_logs, transport=self.transport)
+            targets.append(FanOutTarget(
+                target_session,
+                target_config.get("project_name"),
+                get_cube_name(target_config) if target_config.get("dataset_name") else self.dataset_name,
+                folder_id=target_config.get("folder_id")
+            ))
+        if not targets:
+            return None
+        if self.export_mode != EXPORT_MODE_FULL or self.resumable_export:
+            raise ValueError("Additional target datasets can only be used with a full, non resumable export")
+        return FanOutSession(self.session, targets, self.max_concurrent_uploads)
 
     def open(self, schema):
         self.dss_columns_types = get_dss_columns_types(schema)
@@ -80,9 +123,80 @@ class CustomExporter(Exporter):
         if not self.project_id:
             self.project_id = self.session.get_project_id(self.project_name)
 
-        # Search for objects of type 3 (datasets/cubes) with the right name
-        logger.info("Searching for existing '{}' dataset in project '{}'.".format(self.dataset_name, self.project_id))
-        self.dataset_id = self.session.get_dataset_id(self.project_id, self.dataset_name, folder_id=self.folder_id)
+        self.target_key_parts = [self.base_url, self.username, self.project_id, self.folder_id, self.dataset_name]
+        self.schema_fingerprint = build_state_key(self.table_name, self.schema, self.dss_columns_types)
+        self.pending_publication = PendingPublication(self.target_key_parts)
+        self.resolve_pending_publication()
+        self.target_fingerprint = TargetFingerprint(self.target_key_parts, self.schema_fingerprint)
+        cached_dataset_id = self.target_fingerprint.get_known_dataset_id() or self.session.get_cached_dataset_id(self.project_id, self.dataset_name, folder_id=self.folder_id)
+        with self.metrics.timer("open"):
+            try:
+                self.open_dataset(schema)
+            except Exception as error_message:
+                if not cached_dataset_id:
+                    raise
+                # The cube may have been deleted or moved since its id was cached
+                logger.warning("Could not use cached dataset id {} ({}), searching again".format(cached_dataset_id, error_message))
+                self.target_fingerprint.forget()
+                self.session.invalidate_dataset_id(self.project_id, self.dataset_name, folder_id=self.folder_id)
+                self.open_dataset(schema)
+            if self.fan_out:
+                self.fan_out.open_targets(self.table_name, self.schema, self.dss_columns_types)
+        self.read_start = time.perf_counter()
+
+    def resolve_pending_publication(self):
+        # The previous export did not wait for its publication: its state is only used once the publication is confirmed
+        pending = self.pending_publication.load()
+        if not pending:
+            return
+        logger.info("Checking the publication of the previous export, upload session {}".format(pending.get("upload_session_id")))
+        publish_monitor = PublishMonitor(
+            self.session, timeout=self.publish_timeout,
+            project_id=pending.get("project_id"), dataset_id=pending.get("dataset_id"), upload_session_id=pending.get("upload_session_id")
+        )
+        try:
+            publish_monitor.follow().wait()
+        except Exception as error_message:
+            logger.warning("The publication of the previous export was not confirmed ({}), its rows will be sent again".format(error_message))
+            discard_pending_state(self.target_key_parts)
+            self.pending_publication.forget()
+            return
+        self.commit_published_state(pending.get("dataset_id"), pending.get("schema_fingerprint"), pending.get("resumable_export"))
+
+    def commit_published_state(self, dataset_id, schema_fingerprint, resumable_export):
+        confirm_pending_state(self.target_key_parts)
+        TargetFingerprint(self.target_key_parts, schema_fingerprint).save(dataset_id)
+        if resumable_export:
+            UploadCheckpoint(self.target_key_parts, schema_fingerprint).clear()
+        self.pending_publication.forget()
+
+    def on_publish_finished(self, publish_monitor):
+        # Publication followed in the background, after close returned
+        if publish_monitor.is_completed():
+            logger.info("Dataset {} published in {:.1f}s".format(self.dataset_id, publish_monitor.publish_duration))
+            self.commit_published_state(self.dataset_id, self.schema_fingerprint, self.resumable_export)
+        else:
+            logger.warning("Publication of dataset {} not confirmed: {}".format(self.dataset_id, publish_monitor.error))
+        self.transport.close()
+
+    def open_dataset(self, schema):
+        # Same cube and same schema as the last export: no search, and no schema replacement needed
+        self.dataset_id = self.target_fingerprint.get_known_dataset_id()
+        is_schema_unchanged = self.dataset_id is not None
+        if is_schema_unchanged:
+            logger.info("Exporting to dataset {} with an unchanged schema".format(self.dataset_id))
+        else:
+            # Search for objects of type 3 (datasets/cubes) with the right name
+            logger.info("Searching for existing '{}' dataset in project '{}'.".format(self.dataset_name, self.project_id))
+            self.dataset_id = self.session.get_dataset_id(self.project_id, self.dataset_name, folder_id=self.folder_id)
+
+        self.incremental_export = IncrementalExport(
+            self.export_mode,
+            self.target_key_parts,
+            self.schema,
+            self.dss_columns_types,
+            watermark_column=self.watermark_column
+        )
 
         # No result, create a new dataset
         if not self.dataset_id:
@@ -95,38 +209,217 @@ class CustomExporter(Exporter):
                 self.dss_columns_types,
                 self.folder_id
             )
+            self.incremental_export.force_full_export()
+
+        update_policy = self.incremental_export.get_update_policy()
+        if self.resumable_export:
+            self.checkpoint = UploadCheckpoint(self.target_key_parts, self.schema_fingerprint)
+            manifest = self.checkpoint.get_resumable_manifest(self.dataset_id)
+            if manifest:
+                self.resume_upload_session(manifest, schema)
+                return
+
+        if update_policy == 'replace' and not is_schema_unchanged:
+            # Replace data (drop existing) by sending the empty dataframe, with correct schema
+            self.session.update_dataset([], self.project_id, self.dataset_id, self.table_name, self.schema, self.dss_columns_types, update_policy='replace')
+        elif self.incremental_export.is_incremental:
+            logger.info("Incremental export, using the '{}' update policy".format(update_policy))
+        else:
+            logger.info("Full export to the unchanged schema, using the '{}' update policy".format(update_policy))
+        self.upload_session_id = self.session.open_upload_session(self.project_id, self.dataset_id, self.table_name, schema, self.dss_columns_types, update_policy=update_policy, can_raise=True)
+        if self.checkpoint:
+            self.checkpoint.start(self.project_id, self.dataset_id, self.upload_session_id, update_policy)
+        self.uploader = self.build_uploader()
+
+    def build_uploader(self):
+        return ChunkUploader(
+            self.fan_out or self.session,
+            max_workers=self.max_concurrent_uploads,
+            chunk_sizer=self.chunk_sizer,
+            rows_filter=self.incremental_export.filter_rows if self.incremental_export.rows_filter is not None else None,
+            checkpoint=self.checkpoint,
+            metrics=self.metrics,
+            memory_budget=self.memory_budget
+        )
+
+    def resume_upload_session(self, manifest, schema):
+        chunks = self.checkpoint.get_chunks()
+        next_index = chunks[-1][0] + 1
+        self.upload_session_id = self.session.resume_upload_session(
+            manifest.get("upload_session_id"), self.project_id, self.dataset_id, self.table_name, schema, self.dss_columns_types, next_index
+        )
+        if not self.is_upload_session_alive(chunks):
+            logger.info("Checkpointed upload session is no longer available, opening a new one")
+            self.upload_session_id = self.session.open_upload_session(
+                self.project_id, self.dataset_id, self.table_name, schema, self.dss_columns_types,
+                update_policy=manifest.get("update_policy"), can_raise=True, next_index=next_index
+            )
+            self.checkpoint.set_upload_session_id(self.upload_session_id)
+            chunks = self.checkpoint.get_chunks()
+        self.uploader = self.build_uploader()
+        resent_chunks = 0
+        for index, rows_count, status in chunks:
+            if status == CHUNK_WRITTEN:
+                self.uploader.resend_chunk(index)
+                resent_chunks += 1
+        self.acknowledged_chunks = len([chunk for chunk in chunks if chunk[2] == CHUNK_ACKNOWLEDGED])
+        logger.info("Resuming export: {} chunks already sent, {} re-sent from checkpoint, {} to encode again".format(
+            self.acknowledged_chunks,
+            resent_chunks,
+            len([chunk for chunk in chunks if chunk[2] == CHUNK_REGISTERED])
+        ))
+        # Input rows are replayed along the checkpointed chunk boundaries
+        self.resume_plan = deque(chunks)
+        self.advance_resume_plan()
+
+    def is_upload_session_alive(self, chunks):
+        # Pushing an acknowledged chunk again with the same index is harmless, and proves the session still exists
+        acknowledged_indexes = [index for index, rows_count, status in chunks if status == CHUNK_ACKNOWLEDGED]
+        if not acknowledged_indexes:
+            return False
+        try:
+            with self.checkpoint.open_chunk_file(acknowledged_indexes[-1], mode="rb") as body:
+                self.session.upload_session_push_body(body, acknowledged_indexes[-1])
+        except Exception as error_message:
+            logger.warning("Could not reuse upload session: {}".format(error_message))
+            return False
+        return True
 
-        # Replace data (drop existing) by sending the empty dataframe, with correct schema
-        self.session.update_dataset([], self.project_id, self.dataset_id, self.table_name, self.schema, self.dss_columns_types, update_policy='replace')
-        self.upload_session_id = self.session.open_upload_session(self.project_id, self.dataset_id, self.table_name, schema, self.dss_columns_types, update_policy='replace', can_raise=True)
+    def advance_resume_plan(self):
+        while self.resume_plan and len(self.row_buffer) >= self.resume_plan[0][1]:
+            index, rows_count, status = self.resume_plan.popleft()
+            rows = self.row_buffer[:rows_count]
+            self.row_buffer = self.row_buffer[rows_count:]
+            if status == CHUNK_REGISTERED:
+                self.flush_data(rows, index=index)
+            elif self.incremental_export.rows_filter is not None:
+                # Already uploaded, but the incremental state still needs to see these rows
+                self.incremental_export.filter_rows(build_dataframe(rows, self.schema))
 
     def write_row(self, row):
-        row_dict = {}
-        for (column_name, cell_value, dtype) in zip(self.schema, row, self.dss_columns_types):
-            if (type(cell_value) == float and isnan(cell_value)):
-                cell_value = None
-            row_dict[column_name] = cell_value
-        self.row_buffer.append(row_dict)
-
-        if len(self.row_buffer) > self.buffer_size:
-            logger.info("Sending {} rows to MicroStrategy.".format(self.buffer_size))
+        # Rows are kept as they come, cells are converted column by column when a chunk is encoded
+        self.row_buffer.append(row)
+
+        if self.resume_plan:
+            self.advance_resume_plan()
+            return
+
+        if len(self.row_buffer) >= self.chunk_rows_limit:
+            # The limit follows the chunk sizer, and the memory budget for rows like this one
+            self.chunk_rows_limit = self.get_chunk_rows_limit([row])
+            if len(self.row_buffer) >= self.chunk_rows_limit:
+                logger.info("Sending {} rows to MicroStrategy.".format(len(self.row_buffer)))
+                self.flush_data(self.row_buffer)
+                self.row_buffer = []
+                # The first chunk sets the size of the next ones
+                self.chunk_rows_limit = self.get_chunk_rows_limit([row])
+
+    def get_chunk_rows_limit(self, rows):
+        if self.memory_budget is None:
+            return self.chunk_sizer.chunk_rows
+        return min(self.chunk_sizer.chunk_rows, self.memory_budget.get_max_rows(rows))
+
+    def write_dataframe(self, dataframe):
+        """
+        Batch alternative to write_row, for callers reading the input by DataFrame chunks
+        (for instance dataiku.Dataset.iter_dataframes). Columns are converted and encoded as a whole,
+        without building a Python object per row. The DataFrame columns must follow the exported schema.
+        """
+        if self.resume_plan:
+            for row in dataframe.itertuples(index=False, name=None):
+                self.write_row(row)
+            return
+        if self.row_buffer:
             self.flush_data(self.row_buffer)
             self.row_buffer = []
+        if self.dataframe_buffer is not None:
+            dataframe = pandas.concat([self.dataframe_buffer, dataframe], ignore_index=True)
+            self.dataframe_buffer = None
+        if not len(dataframe):
+            return
+        chunk_rows = self.get_chunk_rows_limit(dataframe)
+        chunk_start = 0
+        while len(dataframe) - chunk_start >= chunk_rows:
+            chunk_end = chunk_start + chunk_rows
+            logger.info("Sending {} rows to MicroStrategy.".format(chunk_end - chunk_start))
+            self.flush_data(dataframe.iloc[chunk_start:chunk_end])
+            chunk_start = chunk_end
+            # The first chunk sets the size of the next ones
+            chunk_rows = self.get_chunk_rows_limit(dataframe)
+        if chunk_start < len(dataframe):
+            self.dataframe_buffer = dataframe.iloc[chunk_start:]
 
     def close(self):
-        logger.info("Sending {} final rows to MicroStrategy.".format(len(self.row_buffer)))
-        self.flush_data(self.row_buffer)
-        logger.info("Logging out.")
-        self.session.publish_upload_session()
-        self.session.upload_session_publish_status()
-        response = self.session.get(url=self.base_url+"/auth/logout")
-        logger.info("Logout returned status {}".format(response.status_code))
-
-    def flush_data(self, rows):
+        if self.read_start is not None:
+            # Time spent reading and buffering input rows, excluding the waits for a free upload slot
+            self.metrics.add_time("read_and_buffer", time.perf_counter() - self.read_start - self.metrics.get_time("backpressure"))
+        self.advance_resume_plan()
+        if self.resume_plan:
+            self.uploader.abort()
+            raise Exception("The input dataset has fewer rows than the checkpointed export, it must have changed since. Disable the resumable export to start over.")
+        if self.dataframe_buffer is not None:
+            logger.info("Sending {} final rows to MicroStrategy.".format(len(self.dataframe_buffer)))
+            self.flush_data(self.dataframe_buffer)
+            self.dataframe_buffer = None
+        if self.row_buffer:
+            logger.info("Sending {} final rows to MicroStrategy.".format(len(self.row_buffer)))
+            self.flush_data(self.row_buffer)
+            self.row_buffer = []
+        if not self.uploader.pushed_chunks and not self.acknowledged_chunks:
+            # No input row, or none left by the incremental filter: the upload session still gets one chunk to publish
+            self.uploader.push_empty_chunk()
+        logger.info("Waiting for all chunks to be uploaded.")
+        try:
+            with self.metrics.timer("wait_uploads"):
+                self.uploader.wait()
+        except Exception as error_message:
+            logger.exception("Dataset update issue: {}".format(error_message))
+            raise error_message
+        with self.metrics.timer("publish_request"):
+            self.publish_monitor = PublishMonitor(self.session, timeout=self.publish_timeout).publish()
+            if self.fan_out:
+                self.fan_out.publish_targets(timeout=self.publish_timeout)
+        if self.wait_for_publish:
+            # Server side publication is polled in the background while the local state is summarized
+            self.publish_monitor.start()
+        self.incremental_export.log_summary()
+        if self.wait_for_publish:
+            self.publish_monitor.wait()
+            self.metrics.add_time("publish", self.publish_monitor.publish_duration)
+            if self.fan_out:
+                self.fan_out.wait_for_targets()
+            self.incremental_export.commit()
+            self.target_fingerprint.save(self.dataset_id)
+            if self.checkpoint:
+                self.checkpoint.clear()
+        else:
+            # The state is committed once the publication is seen completed, by this monitor or by the next export
+            self.incremental_export.commit(pending=True)
+            if self.checkpoint:
+                self.checkpoint.close_log()
+            self.pending_publication.save(self.publish_monitor, schema_fingerprint=self.schema_fingerprint, resumable_export=self.resumable_export)
+            self.publish_monitor.start()
+            self.publish_monitor.add_done_callback(self.on_publish_finished)
+            logger.info("Publication started, not waiting for it to complete.")
+        # No logout, the session token is kept for the next exports
+        self.session.auth.release()
+        if self.wait_for_publish:
+            self.transport.close()
+        if self.memory_budget:
+            self.memory_budget.log_summary()
+        self.metrics.log_summary(http_statistics=self.transport.statistics, file_path=self.metrics_file)
+        if self.fan_out:
+            self.fan_out.close()
+            self.fan_out.log_summary()
+            self.fan_out.raise_on_failure()
+
+    def flush_data(self, rows, index=None):
+        self.metrics.increment("rows", len(rows))
         try:
-            self.session.upload_session_push_rows(rows)
+            self.uploader.push_rows(rows, index=index)
         except Exception as error_message:
             logger.exception("Dataset update issue: {}".format(error_message))
+            self.uploader.abort()
             raise error_message
 
 
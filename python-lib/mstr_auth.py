@@ -1,20 +1,61 @@
+import os
+import hmac
+import time
+import hashlib
 import requests
 import logging
+import threading
+from mstr_transport import get_shared_transport
+from mstr_state import get_state_directory, build_state_key, load_json_state, save_json_state
 
 
 logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
 logger = logging.getLogger()
 
 
+# Under this idle time, a cached token is trusted without asking the server
+TOKEN_TRUSTED_IDLE_TIME = 60
+# Library servers expire idle sessions after 30 minutes by default
+TOKEN_MAX_IDLE_TIME = 25 * 60
+TOKEN_MAX_AGE = 8 * 3600
+PASSWORD_VERIFIER_ITERATIONS = 100000
+
+
 class MstrAuth(requests.auth.AuthBase):
-    def __init__(self, server_url, username, password):
-        auth_token, cookies = request_auth_token(server_url, username, password)
+    def __init__(self, server_url, username, password, transport=None, token_manager=None):
+        self.server_url = server_url
+        self.username = username
+        self.password = password
+        self.transport = transport
+        self.token_manager = token_manager
+        self.lock = threading.Lock()
+        if token_manager:
+            self.set_token(*token_manager.get_token(server_url, username, password, transport=transport))
+        else:
+            self.set_token(*request_auth_token(server_url, username, password, transport=transport))
+
+    def set_token(self, auth_token, cookies):
         self.auth_token = auth_token
         self.cookies = cookies
         self.cookies_string = None
         if cookies:
             self.cookies_string = build_cookies_string(cookies)
 
+    def refresh(self, expired_auth_token=None):
+        with self.lock:
+            if expired_auth_token and expired_auth_token != self.auth_token:
+                # Another thread already replaced the expired token
+                return
+            if self.token_manager:
+                self.set_token(*self.token_manager.renew_token(self.server_url, self.username, self.password, self.auth_token, transport=self.transport))
+            else:
+                self.set_token(*request_auth_token(self.server_url, self.username, self.password, transport=self.transport))
+
+    def release(self):
+        # The token stays alive on the server, for the next export or UI callback to reuse it
+        if self.token_manager:
+            self.token_manager.touch(self.server_url, self.username, self.password)
+
     def __call__(self, request):
         request.headers["X-MSTR-AuthToken"] = self.auth_token
         if self.cookies_string:
@@ -30,7 +71,8 @@ def build_cookies_string(cookies_dictionary):
     return ";".join(coockies)
 
 
-def request_auth_token(server_url, username, password):
+def request_auth_token(server_url, username, password, transport=None):
+    transport = transport or get_shared_transport()
     url = "{}/auth/login".format(server_url)
     data = {
         "username": username,
@@ -38,7 +80,7 @@ def request_auth_token(server_url, username, password):
         "loginMode": 1
     }
     logger.info("Requesting auth token to {}".format(server_url))
-    response = requests.post(url=url, data=data)
+    response = transport.post(url, data=data, phase="auth")
     status_code = response.status_code
     if status_code >= 400:
         error_message = "Error {} while requesting auth token to {}".format(status_code, server_url)
@@ -50,3 +92,159 @@ def request_auth_token(server_url, username, password):
     if auth_token or cookies:
         logger.info("Auth token obtained from {}".format(server_url))
     return auth_token, cookies
+
+
+def logout(server_url, auth_token, cookies, transport=None):
+    transport = transport or get_shared_transport()
+    headers = {"X-MSTR-AuthToken": auth_token}
+    if cookies:
+        headers["Cookie"] = build_cookies_string(cookies)
+    try:
+        response = transport.post("{}/auth/logout".format(server_url), headers=headers, phase="auth")
+        logger.info("Logout returned status {}".format(response.status_code))
+    except Exception as error_message:
+        logger.warning("Logout failed: {}".format(error_message))
+
+
+def extend_session(server_url, auth_token, cookies, transport=None):
+    transport = transport or get_shared_transport()
+    headers = {"X-MSTR-AuthToken": auth_token}
+    if cookies:
+        headers["Cookie"] = build_cookies_string(cookies)
+    try:
+        response = transport.put("{}/sessions".format(server_url), headers=headers, phase="auth")
+    except Exception as error_message:
+        logger.warning("Could not extend session: {}".format(error_message))
+        return False
+    return response.status_code < 400
+
+
+class TokenManager(object):
+    """
+    Reuses MicroStrategy session tokens across exporter runs and UI callbacks, instead of logging in every time.
+    Tokens and their cookies are kept per (server, user) in memory and in owner-only state files,
+    extended on the server when they have been idle for a while, and logged out only when they are retired:
+    too old, rejected by the server, replaced after a 401, or requested with another password.
+    The files never hold the password, only a salted PBKDF2 verifier of it.
+    """
+
+    def __init__(self, directory=None, trusted_idle_time=TOKEN_TRUSTED_IDLE_TIME, max_idle_time=TOKEN_MAX_IDLE_TIME, max_age=TOKEN_MAX_AGE):
+        self.directory = directory
+        self.trusted_idle_time = trusted_idle_time
+        self.max_idle_time = max_idle_time
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.verified_passwords = {}
+
+    def get_token(self, server_url, username, password, transport=None):
+        token_key = build_token_key(server_url, username)
+        with self.lock:
+            token = self.tokens.get(token_key) or self.load_token(token_key)
+            if token and self.is_password_verified(token_key, token, password) and self.is_token_usable(server_url, token, transport):
+                token["last_used"] = time.time()
+                self.store_token(token_key, token)
+                logger.info("Reusing auth token for {}".format(server_url))
+                return token["auth_token"], token["cookies"]
+            # The stored token is only replaced once the login succeeded, a wrong password leaves it to the other exports
+            auth_token, cookies = self.login(server_url, username, password, token_key, transport)
+            if token:
+                self.retire_token(server_url, token, transport)
+            return auth_token, cookies
+
+    def renew_token(self, server_url, username, password, expired_auth_token, transport=None):
+        token_key = build_token_key(server_url, username)
+        with self.lock:
+            token = self.tokens.get(token_key) or self.load_token(token_key)
+            if token and token["auth_token"] != expired_auth_token and self.is_password_verified(token_key, token, password):
+                # Already renewed by another session of this process
+                return token["auth_token"], token["cookies"]
+            return self.login(server_url, username, password, token_key, transport)
+
+    def touch(self, server_url, username, password):
+        token_key = build_token_key(server_url, username)
+        with self.lock:
+            token = self.tokens.get(token_key)
+            if token:
+                token["last_used"] = time.time()
+                self.store_token(token_key, token)
+
+    def is_token_usable(self, server_url, token, transport):
+        now = time.time()
+        if now - token.get("created", 0) > self.max_age:
+            return False
+        idle_time = now - token.get("last_used", 0)
+        if idle_time < self.trusted_idle_time:
+            return True
+        if idle_time > self.max_idle_time:
+            return False
+        return extend_session(server_url, token["auth_token"], token["cookies"], transport=transport)
+
+    def is_password_verified(self, token_key, token, password):
+        # A token obtained with another password is never handed out
+        password_verifier = token.get("password_verifier")
+        if not password_verifier or not token.get("password_salt"):
+            return False
+        if self.verified_passwords.get(token_key) == (password_verifier, password):
+            return True
+        is_verified = hmac.compare_digest(password_verifier, build_password_verifier(password, token["password_salt"]))
+        if is_verified:
+            self.verified_passwords[token_key] = (password_verifier, password)
+        return is_verified
+
+    def login(self, server_url, username, password, token_key, transport):
+        auth_token, cookies = request_auth_token(server_url, username, password, transport=transport)
+        now = time.time()
+        password_salt = os.urandom(16).hex()
+        password_verifier = build_password_verifier(password, password_salt)
+        self.verified_passwords[token_key] = (password_verifier, password)
+        self.store_token(token_key, {
+            "auth_token": auth_token,
+            "cookies": cookies,
+            "created": now,
+            "last_used": now,
+            "password_salt": password_salt,
+            "password_verifier": password_verifier
+        })
+        return auth_token, cookies
+
+    def retire_token(self, server_url, token, transport):
+        logger.info("Retiring auth token for {}".format(server_url))
+        logout(server_url, token["auth_token"], token["cookies"], transport=transport)
+
+    def load_token(self, token_key):
+        if not self.directory:
+            return None
+        token = load_json_state(self.get_token_path(token_key))
+        if token:
+            self.tokens[token_key] = token
+        return token
+
+    def store_token(self, token_key, token):
+        self.tokens[token_key] = token
+        if self.directory:
+            try:
+                save_json_state(self.get_token_path(token_key), token)
+            except Exception as error_message:
+                logger.warning("Could not store auth token: {}".format(error_message))
+
+    def get_token_path(self, token_key):
+        return os.path.join(self.directory, "{}.json".format(token_key))
+
+
+def build_token_key(server_url, username):
+    return build_state_key(server_url.strip("/"), username or "")
+
+
+def build_password_verifier(password, password_salt):
+    return hashlib.pbkdf2_hmac("sha256", (password or "").encode("utf-8"), bytes.fromhex(password_salt), PASSWORD_VERIFIER_ITERATIONS).hex()
+
+
+token_manager = None
+
+
+def get_token_manager():
+    global token_manager
+    if token_manager is None:
+        token_manager = TokenManager(directory=get_state_directory("tokens"))
+    return token_manager
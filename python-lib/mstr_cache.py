@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from mstr_state import get_state_directory, load_json_state, save_json_state
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+DEFAULT_CACHE_TTL = 600
+DEFAULT_CACHE_MAX_ENTRIES = 2000
+METADATA_CACHE_FILE_NAME = "metadata_cache.json"
+
+
+class MetadataCache(object):
+    """
+    TTL and LRU bounded cache for MicroStrategy metadata (projects, folders, dataset ids).
+    Keys are lists of strings, starting with the server URL and the user name so that
+    users never see each other's results. When a file path is given, entries are shared
+    with the other processes through a state file, merged on every save.
+    """
+
+    def __init__(self, file_path=None, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_CACHE_MAX_ENTRIES):
+        self.file_path = file_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        if file_path:
+            self.entries = self.load_entries()
+
+    def get(self, key_parts, default=None):
+        key = build_cache_key(key_parts)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            expiry, value = entry
+            if expiry < time.time():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key_parts, value, ttl=None):
+        key = build_cache_key(key_parts)
+        with self.lock:
+            self.entries[key] = (time.time() + (ttl or self.ttl), value)
+            self.entries.move_to_end(key)
+            self.evict()
+        self.save()
+
+    def invalidate(self, key_parts):
+        # Removes the entry for these key parts, and every entry whose key starts with them
+        key_prefix = build_cache_key(key_parts)
+        with self.lock:
+            invalidated_keys = [key for key in self.entries if key == key_prefix or key.startswith(key_prefix + "|")]
+            for key in invalidated_keys:
+                del self.entries[key]
+        if invalidated_keys:
+            self.save(removed_keys=invalidated_keys)
+        return len(invalidated_keys) > 0
+
+    def evict(self):
+        now = time.time()
+        for key in [key for key, (expiry, value) in self.entries.items() if expiry < now]:
+            del self.entries[key]
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def load_entries(self):
+        stored_entries = load_json_state(self.file_path, default=[])
+        entries = OrderedDict()
+        now = time.time()
+        try:
+            for key, expiry, value in stored_entries:
+                if expiry >= now:
+                    entries[key] = (expiry, value)
+        except Exception as error_message:
+            logger.warning("Ignoring invalid metadata cache file: {}".format(error_message))
+        return entries
+
+    def save(self, removed_keys=None):
+        if not self.file_path:
+            return
+        with self.lock:
+            try:
+                merged_entries = self.load_entries()
+                for key in removed_keys or []:
+                    merged_entries.pop(key, None)
+                for key, (expiry, value) in self.entries.items():
+                    stored_entry = merged_entries.pop(key, None)
+                    merged_entries[key] = (expiry, value) if stored_entry is None or stored_entry[0] <= expiry else stored_entry
+                self.entries = merged_entries
+                self.evict()
+                save_json_state(self.file_path, [[key, expiry, value] for key, (expiry, value) in self.entries.items()])
+            except Exception as error_message:
+                logger.warning("Could not save the metadata cache: {}".format(error_message))
+
+
+def build_cache_key(key_parts):
+    return "|".join(json.dumps(key_part) if not isinstance(key_part, str) else key_part for key_part in key_parts)
+
+
+metadata_cache = None
+
+
+def get_metadata_cache():
+    global metadata_cache
+    if metadata_cache is None:
+        metadata_cache = MetadataCache(file_path=os.path.join(get_state_directory(), METADATA_CACHE_FILE_NAME))
+    return metadata_cache
@@ -0,0 +1,171 @@
+import os
+import json
+import shutil
+import logging
+import threading
+from mstr_state import get_state_directory, build_state_key, load_json_state, save_json_state, write_state_file, delete_state_file
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+CHUNK_REGISTERED = "registered"
+CHUNK_WRITTEN = "written"
+CHUNK_ACKNOWLEDGED = "acknowledged"
+
+
+class UploadCheckpoint(object):
+    """
+    On-disk record of an upload session in progress: the session itself, the row count of every chunk
+    in index order, and the encoded body of each chunk once it is written.
+    Chunk status changes are appended to a log next to the manifest, rather than rewriting the whole manifest.
+    The body of an acknowledged chunk is deleted, except for the last one, which is pushed again to check that
+    the upload session is still alive.
+    A restarted export replays the same chunk boundaries, re-sends the chunks that were never acknowledged
+    and only encodes the rows of chunks whose body was lost.
+    """
+
+    def __init__(self, target_key_parts, schema_fingerprint):
+        self.state_key = build_state_key(*target_key_parts)
+        self.checkpoint_directory = get_state_directory("checkpoints", self.state_key)
+        self.manifest_path = os.path.join(self.checkpoint_directory, "manifest.json")
+        self.log_path = os.path.join(self.checkpoint_directory, "chunks.log")
+        self.schema_fingerprint = schema_fingerprint
+        self.lock = threading.Lock()
+        self.log_file = None
+        self.skipped_rows = 0
+        self.manifest = self.load_manifest()
+        self.last_acknowledged_index = self.get_last_acknowledged_index()
+
+    def load_manifest(self):
+        manifest = load_json_state(self.manifest_path, default={})
+        if not manifest or not os.path.isfile(self.log_path):
+            return manifest
+        chunks = manifest.setdefault("chunks", {})
+        with open(self.log_path, "r") as log_file:
+            for line in log_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # An interrupted export can leave its last line incomplete
+                    break
+                chunk = chunks.setdefault(str(entry["index"]), {"rows": None})
+                if entry.get("rows") is not None:
+                    chunk["rows"] = entry["rows"]
+                chunk["status"] = entry["status"]
+        return manifest
+
+    def get_last_acknowledged_index(self):
+        acknowledged_indexes = [int(index) for index, chunk in self.manifest.get("chunks", {}).items() if chunk["status"] == CHUNK_ACKNOWLEDGED]
+        return max(acknowledged_indexes) if acknowledged_indexes else None
+
+    def get_resumable_manifest(self, dataset_id):
+        if not self.manifest.get("chunks"):
+            return None
+        if self.manifest.get("schema_fingerprint") != self.schema_fingerprint:
+            logger.info("Schema changed since the checkpointed export, starting over")
+            return None
+        if self.manifest.get("dataset_id") != dataset_id:
+            logger.info("Target dataset changed since the checkpointed export, starting over")
+            return None
+        return self.manifest
+
+    def start(self, project_id, dataset_id, upload_session_id, update_policy):
+        self.clear()
+        self.checkpoint_directory = get_state_directory("checkpoints", self.state_key)
+        with self.lock:
+            self.manifest = {
+                "schema_fingerprint": self.schema_fingerprint,
+                "project_id": project_id,
+                "dataset_id": dataset_id,
+                "upload_session_id": upload_session_id,
+                "update_policy": update_policy,
+                "chunks": {}
+            }
+            self.last_acknowledged_index = None
+            self.save()
+
+    def set_upload_session_id(self, upload_session_id):
+        # The chunks acknowledged by the lost session are sent again, from their body if it was kept
+        with self.lock:
+            self.manifest["upload_session_id"] = upload_session_id
+            for index, chunk in self.manifest["chunks"].items():
+                if chunk["status"] == CHUNK_ACKNOWLEDGED:
+                    chunk["status"] = CHUNK_WRITTEN if os.path.isfile(self.get_chunk_path(index)) else CHUNK_REGISTERED
+            self.last_acknowledged_index = None
+            self.save()
+
+    def get_chunks(self):
+        # Chunks in index order, as a list of (index, rows_count, status)
+        with self.lock:
+            chunks = self.manifest.get("chunks", {})
+            return sorted((int(index), chunk["rows"], chunk["status"]) for index, chunk in chunks.items())
+
+    def skip_rows(self, rows_count):
+        # Input rows of a chunk left empty by the incremental filter, counted with the next registered chunk
+        # so that a resumed export replays the input along the same boundaries
+        with self.lock:
+            self.skipped_rows += rows_count
+
+    def register_chunk(self, index, rows_count):
+        with self.lock:
+            rows_count += self.skipped_rows
+            self.skipped_rows = 0
+        self.set_chunk(index, rows_count, CHUNK_REGISTERED)
+
+    def set_chunk_written(self, index):
+        self.set_chunk(index, None, CHUNK_WRITTEN)
+
+    def acknowledge_chunk(self, index):
+        self.set_chunk(index, None, CHUNK_ACKNOWLEDGED)
+
+    def set_chunk(self, index, rows_count, status):
+        with self.lock:
+            chunk = self.manifest["chunks"].setdefault(str(index), {"rows": rows_count})
+            chunk["status"] = status
+            self.append_log(index, rows_count, status)
+            if status == CHUNK_ACKNOWLEDGED:
+                self.delete_acknowledged_body(index)
+
+    def append_log(self, index, rows_count, status):
+        if self.log_file is None:
+            self.log_file = os.fdopen(os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600), "a")
+        entry = {"index": index, "status": status}
+        if rows_count is not None:
+            entry["rows"] = rows_count
+        self.log_file.write(json.dumps(entry) + "\n")
+        self.log_file.flush()
+
+    def delete_acknowledged_body(self, index):
+        if self.last_acknowledged_index is None or index > self.last_acknowledged_index:
+            index, self.last_acknowledged_index = self.last_acknowledged_index, index
+        if index is not None:
+            delete_state_file(self.get_chunk_path(index))
+
+    def get_chunk_path(self, index):
+        return os.path.join(self.checkpoint_directory, "chunk-{}.json".format(index))
+
+    def open_chunk_file(self, index, mode="w+b"):
+        return open(self.get_chunk_path(index), mode)
+
+    def save(self):
+        # Writes the manifest without its chunks, and a log holding the current status of each chunk
+        self.close_log()
+        save_json_state(self.manifest_path, dict((key, value) for key, value in self.manifest.items() if key != "chunks"))
+        log_lines = []
+        for index, chunk in sorted(self.manifest.get("chunks", {}).items(), key=lambda item: int(item[0])):
+            log_lines.append(json.dumps({"index": int(index), "rows": chunk["rows"], "status": chunk["status"]}) + "\n")
+        write_state_file(self.log_path, "".join(log_lines).encode("utf-8"))
+
+    def close_log(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+    def clear(self):
+        with self.lock:
+            self.close_log()
+            self.manifest = {}
+            if os.path.isdir(self.checkpoint_directory):
+                shutil.rmtree(self.checkpoint_directory)
@@ -0,0 +1,288 @@
+import logging
+import requests
+import threading
+import mstr_json
+from mstr_auth import MstrAuth, get_token_manager
+from mstr_transport import MstrTransport, get_shared_transport
+from mstr_cache import get_metadata_cache
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+SEARCH_PATTERN_EXACT = 2
+OBJECT_TYPE_CUBE_DATASET = 3
+
+shared_clients = {}
+shared_clients_lock = threading.Lock()
+
+
+class MstrResponseError(Exception):
+    def __init__(self, message, status_code=None):
+        super(MstrResponseError, self).__init__(message)
+        self.status_code = status_code
+
+
+class MstrClient(object):
+    """
+    Authenticated requests and metadata lookups: projects, folders and dataset search.
+    Kept free of the data encoding dependencies (pandas, numpy, dateutil), so that the parameters UI callbacks load fast.
+    MstrSession adds the dataset creation and upload sessions.
+    """
+
+    def __init__(self, server_url, username, password, generate_verbose_logs=False, transport=None, metadata_cache=None, token_manager=None):
+        if not server_url:
+            raise Exception("No valid URL to the for Microstrategy server has been selected")
+        self.server_url = parse_server_url(server_url)
+        self.username = username
+        self.password = password
+        self.auth = None
+        self.requests_verify = False
+        self.generate_verbose_logs = generate_verbose_logs
+        self.transport = transport or MstrTransport()
+        self.metadata_cache = metadata_cache or get_metadata_cache()
+        self.auth = MstrAuth(server_url, username, password, transport=self.transport, token_manager=token_manager or get_token_manager())
+
+    def get(self, url=None, headers=None, params=None, timeout=None):
+        headers = headers or {}
+        response = self.transport.get(url, headers=headers, params=params, verify=self.requests_verify, auth=self.auth, timeout=timeout)
+        return response
+
+    def post(self, url=None, headers=None, params=None, json=None, timeout=None):
+        headers = headers or {}
+        data = self.serialize_json_body(headers, json)
+        response = self.transport.post(url, data=data, headers=headers, params=params, verify=self.requests_verify, auth=self.auth, timeout=timeout)
+        return response
+
+    def patch(self, url=None, headers=None, json=None, timeout=None):
+        headers = headers or {}
+        data = self.serialize_json_body(headers, json)
+        response = self.transport.patch(url, headers=headers, data=data, verify=self.requests_verify, auth=self.auth, timeout=timeout)
+        return response
+
+    def put(self, url=None, headers=None, json=None, data=None, timeout=None, concurrency_limited=False):
+        headers = headers or {}
+        if json is not None:
+            data = self.serialize_json_body(headers, json)
+        response = self.transport.put(
+            url, headers=headers, data=data, verify=self.requests_verify, auth=self.auth, timeout=timeout, concurrency_limited=concurrency_limited
+        )
+        return response
+
+    def serialize_json_body(self, headers, json):
+        if json is None:
+            return None
+        headers["Content-Type"] = "application/json"
+        return mstr_json.dumps(json)
+
+    def get_project_list(self):
+        cache_key = self.build_cache_key("projects")
+        projects_list = self.metadata_cache.get(cache_key)
+        if projects_list is not None:
+            return projects_list
+        url = "{}/projects".format(self.server_url)
+        response = self.get(url=url)
+        assert_response_ok(response, generate_verbose_logs=self.generate_verbose_logs)
+        projects_list = safe_json_extract(response, default=[])
+        self.metadata_cache.set(cache_key, projects_list)
+        return projects_list
+
+    def get_dataset_id(self, project_id, searched_dataset_name, folder_id=None):
+        cache_key = self.build_dataset_id_cache_key(project_id, searched_dataset_name, folder_id)
+        dataset_id = self.metadata_cache.get(cache_key)
+        if dataset_id:
+            logger.info("Dataset id {} found in cache".format(dataset_id))
+            return dataset_id
+        match_found = False
+
+        url = "{}/searches/results".format(self.server_url)
+        params = {
+            "name": "{}".format(searched_dataset_name),
+            "pattern": SEARCH_PATTERN_EXACT,
+            "type": OBJECT_TYPE_CUBE_DATASET
+        }
+        if folder_id:
+            params["root"] = folder_id
+            params["getAncestors"] = True
+        response = self.get(
+            url=url,
+            headers=self.build_headers(project_id),
+            params=params
+        )
+        assert_response_ok(response, context="searching for dataset '{}'".format(searched_dataset_name), generate_verbose_logs=self.generate_verbose_logs)
+
+        search_results = safe_json_extract(response)
+        datasets = search_results.get("result", [])
+        logger.info("Found {} datasets".format(len(datasets)))
+        for dataset in datasets:
+            dataset_name = dataset.get("name")
+            if dataset_name == searched_dataset_name:
+                if folder_id:
+                    ancestor_id = self.get_ancestor_id(dataset)
+                    if ancestor_id != folder_id:
+                        continue
+                dataset_id = dataset.get("id")
+                if match_found:
+                    raise Exception("Found more than one dataset named {} on your MicroStrategy instance".format(searched_dataset_name))
+                else:
+                    match_found = True
+
+        if dataset_id:
+            self.metadata_cache.set(cache_key, dataset_id)
+        return dataset_id
+
+    def run_on_dataset(self, project_id, dataset_name, action, folder_id=None):
+        """
+        Calls action(dataset_id) with the id of the cube named dataset_name, or None if there is no such cube.
+        A cached id that the server no longer knows (cube deleted or moved) is dropped, and the cube is searched again.
+        """
+        cached_dataset_id = self.get_cached_dataset_id(project_id, dataset_name, folder_id=folder_id)
+        try:
+            return action(self.get_dataset_id(project_id, dataset_name, folder_id=folder_id))
+        except MstrResponseError as error_message:
+            if not cached_dataset_id or error_message.status_code != 404:
+                raise
+            logger.warning("Could not use cached dataset id {} ({}), searching again".format(cached_dataset_id, error_message))
+            self.invalidate_dataset_id(project_id, dataset_name, folder_id=folder_id)
+            return action(self.get_dataset_id(project_id, dataset_name, folder_id=folder_id))
+
+    def get_cached_dataset_id(self, project_id, dataset_name, folder_id=None):
+        return self.metadata_cache.get(self.build_dataset_id_cache_key(project_id, dataset_name, folder_id))
+
+    def invalidate_dataset_id(self, project_id, dataset_name=None, folder_id=None):
+        if dataset_name is None:
+            return self.metadata_cache.invalidate(self.build_cache_key("dataset_id", project_id))
+        return self.metadata_cache.invalidate(self.build_dataset_id_cache_key(project_id, dataset_name, folder_id))
+
+    def build_dataset_id_cache_key(self, project_id, dataset_name, folder_id):
+        return self.build_cache_key("dataset_id", project_id, folder_id or "", dataset_name)
+
+    def build_cache_key(self, *key_parts):
+        return [self.server_url, self.username] + list(key_parts)
+
+    def get_ancestor_id(self, dataset):
+        ancestor_id = None
+        ancestors = dataset.get("ancestors", [])
+        if ancestors:
+            ancestor = ancestors[-1]
+            ancestor_id = ancestor.get("id")
+        return ancestor_id
+
+    def get_projects(self):
+        cache_key = self.build_cache_key("projects")
+        search_result = self.metadata_cache.get(cache_key)
+        if search_result is not None:
+            return search_result
+        url = "{}/projects".format(self.server_url)
+        response = self.get(
+            url=url
+        )
+        search_result = safe_json_extract(response)
+        if response.status_code < 400 and isinstance(search_result, list):
+            self.metadata_cache.set(cache_key, search_result)
+        return search_result
+
+    def get_project_id(self, project_name):
+        projects_list = self.get_project_list()
+        project_id = None
+        for project in projects_list:
+            if project["name"] == project_name:
+                project_id = project["id"]
+                return project_id
+
+        if not project_id:
+            raise ValueError("Project '{}' could not be found on this server.".format(project_name))
+
+    def get_shared_folders(self, project_id, use_cache=True):
+        if not project_id:
+            return []
+        url = "{}/folders/preDefined/7".format(self.server_url)
+        return self.get_cached_folder_content(url, project_id, self.build_cache_key("folders", project_id, "shared"), use_cache=use_cache)
+
+    def get_folder(self, project_id, parent_folder_id, use_cache=True):
+        if not project_id:
+            return []
+        url = "{}/folders/{}".format(self.server_url, parent_folder_id)
+        return self.get_cached_folder_content(url, project_id, self.build_cache_key("folders", project_id, parent_folder_id), use_cache=use_cache)
+
+    def get_cached_folder_content(self, url, project_id, cache_key, use_cache=True):
+        if use_cache:
+            search_result = self.metadata_cache.get(cache_key)
+            if search_result is not None:
+                return search_result
+        response = self.get(
+            url=url,
+            headers=self.build_headers(project_id)
+        )
+        search_result = safe_json_extract(response)
+        if use_cache and response.status_code < 400 and isinstance(search_result, list):
+            self.metadata_cache.set(cache_key, search_result)
+        return search_result
+
+    def build_headers(self, project_id, update_policy=None):
+        headers = {
+            "X-MSTR-ProjectID": project_id,
+        }
+        if update_policy:
+            headers["updatePolicy"] = update_policy
+        return headers
+
+
+def get_shared_client(server_url, username, password):
+    # One client per server and user in the process, reused by the successive UI callbacks
+    client_key = (parse_server_url(server_url or ""), username, password)
+    with shared_clients_lock:
+        client = shared_clients.get(client_key)
+        if client is None:
+            client = MstrClient(server_url, username, password, transport=get_shared_transport())
+            shared_clients[client_key] = client
+        return client
+
+
+def assert_response_ok(response, context=None, can_raise=True, generate_verbose_logs=False):
+    error_message = ""
+    status_code = None
+    error_context = " while {} ".format(context) if context else ""
+    if not isinstance(response, requests.models.Response):
+        error_message = "Did not return a valide response"
+    else:
+        status_code = response.status_code
+        if status_code >= 400:
+            error_message = "Error {}{}".format(status_code, error_context)
+            json_content = ""
+            message = ""
+            json_content = safe_json_extract(response, default={})
+            message = json_content.get("message")
+            content = response.content
+            if message:
+                error_message += ". " + message
+            elif json_content:
+                error_message += ". " + json_content
+            logger.error(error_message)
+            logger.error(content)
+    if error_message and can_raise:
+        if generate_verbose_logs:
+            logger.error("last requests url={}, body={}".format(response.request.url, response.request.body))
+        raise MstrResponseError(error_message, status_code=status_code)
+    return error_message
+
+
+def safe_json_extract(response, default=None):
+    json = default
+    try:
+        json = response.json()
+    except Exception as error_message:
+        logging.error("Error '{}' while decoding json".format(error_message))
+    return json
+
+
+def parse_server_url(raw_url):
+    return raw_url.strip("/")
+
+
+def get_base_url(config, plugin_config):
+    microstrategy_api = config.get("microstrategy_api", {})
+    override_url = microstrategy_api.get("override_url")
+    base_url = plugin_config.get("base_url", None)
+    return override_url or base_url
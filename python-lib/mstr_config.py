@@ -0,0 +1,50 @@
+import json
+from mstr_uploader import DEFAULT_MAX_CONCURRENT_UPLOADS
+from mstr_transport import MstrTransport, RetryPolicy, AdaptiveConcurrencyLimiter, DEFAULT_READ_TIMEOUT, DEFAULT_MAX_RETRIES
+
+
+DSS_CUBE_NAME_SUFFIX = " (created by Dataiku DSS)"
+
+
+def get_cube_name(config):
+    return str(config.get("dataset_name", None)).replace(DSS_CUBE_NAME_SUFFIX, "") + DSS_CUBE_NAME_SUFFIX
+
+
+def get_ui_browse_results(config):
+    folder_id = None
+    project_id = config.get("selected_project_id", None)
+    selected_folder_id = json.loads(config.get("selected_folder_id", "{}"))
+    folder_ids = selected_folder_id.get("ids")
+    if folder_ids:
+        folder_id = folder_ids[-1]
+    if config.get("destination", "my_reports") == "my_reports":
+        folder_id = None
+    return project_id, folder_id
+
+
+def get_max_concurrent_uploads(config):
+    return config.get("max_concurrent_uploads") or DEFAULT_MAX_CONCURRENT_UPLOADS
+
+
+def get_int_config(config, parameter_name, default_value):
+    value = config.get(parameter_name)
+    return default_value if value is None else int(value)
+
+
+def build_concurrency_limiter(config, max_concurrent_uploads):
+    # The configured number of concurrent uploads becomes a ceiling, lowered while the server is overloaded
+    if not config.get("adaptive_concurrency", True):
+        return None
+    return AdaptiveConcurrencyLimiter(max_concurrent_uploads)
+
+
+def build_transport(config, metrics=None, pool_size=None, max_concurrent_uploads=None):
+    # Room for every upload worker plus the metadata and publish calls
+    max_concurrent_uploads = max_concurrent_uploads or get_max_concurrent_uploads(config)
+    return MstrTransport(
+        pool_size=pool_size or max_concurrent_uploads + 2,
+        read_timeout=config.get("request_timeout") or DEFAULT_READ_TIMEOUT,
+        retry_policy=RetryPolicy(max_retries=get_int_config(config, "max_retries", DEFAULT_MAX_RETRIES)),
+        metrics=metrics,
+        concurrency_limiter=build_concurrency_limiter(config, max_concurrent_uploads)
+    )
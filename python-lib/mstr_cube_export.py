@@ -0,0 +1,110 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from mstr_session import UploadTable
+from mstr_uploader import ChunkUploader, DEFAULT_MAX_CONCURRENT_UPLOADS
+from mstr_publish import PublishMonitor, DEFAULT_PUBLISH_TIMEOUT
+from mstr_metrics import ExportMetrics
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+class MultiTableExport(object):
+    """
+    Exports several DSS datasets as the tables of a single cube, for instance a fact table and its dimensions.
+    All the tables share one upload session: their chunks are uploaded in parallel by the same pool of workers,
+    and the cube is published once every table is sent.
+    """
+
+    def __init__(self, session, project_id, dataset_name, folder_id=None, max_concurrent_uploads=DEFAULT_MAX_CONCURRENT_UPLOADS,
+                 wait_for_publish=True, publish_timeout=DEFAULT_PUBLISH_TIMEOUT, metrics=None):
+        self.session = session
+        self.metrics = metrics or ExportMetrics()
+        self.project_id = project_id
+        self.dataset_name = dataset_name
+        self.folder_id = folder_id
+        self.max_concurrent_uploads = max_concurrent_uploads
+        self.wait_for_publish = wait_for_publish
+        self.publish_timeout = publish_timeout
+        self.upload_tables = []
+        self.chunk_sizers = {}
+        self.rows_counts = {}
+        self.dataset_id = None
+        self.upload_session_id = None
+        self.uploader = None
+
+    def add_table(self, table_name, columns_names, dss_columns_types, chunk_sizer):
+        if table_name in self.chunk_sizers:
+            raise ValueError("Table '{}' is exported twice to the same cube".format(table_name))
+        self.upload_tables.append(UploadTable(table_name, columns_names, dss_columns_types))
+        # Each table has its own row width, hence its own chunk size
+        self.chunk_sizers[table_name] = chunk_sizer
+        self.rows_counts[table_name] = 0
+
+    def open(self):
+        if not self.upload_tables:
+            raise ValueError("No table to export")
+        with self.metrics.timer("open"):
+            self.open_dataset()
+        self.uploader = ChunkUploader(self.session, max_workers=self.max_concurrent_uploads, metrics=self.metrics)
+
+    def open_dataset(self):
+        logger.info("Searching for existing '{}' dataset in project '{}'.".format(self.dataset_name, self.project_id))
+        self.session.run_on_dataset(self.project_id, self.dataset_name, self.replace_dataset_tables, folder_id=self.folder_id)
+
+    def replace_dataset_tables(self, dataset_id):
+        self.dataset_id = dataset_id
+        if not self.dataset_id:
+            logger.info("Creating dataset '{}' with tables {}".format(self.dataset_name, [upload_table.name for upload_table in self.upload_tables]))
+            self.dataset_id = self.session.create_multi_table_dataset(self.project_id, self.dataset_name, self.upload_tables, folder_id=self.folder_id)
+        for upload_table in self.upload_tables:
+            # Replace data (drop existing) by sending the empty dataframe, with correct schema
+            self.session.update_dataset(
+                [], self.project_id, self.dataset_id, upload_table.name, upload_table.columns_names, upload_table.dss_columns_types, update_policy='replace'
+            )
+        self.upload_session_id = self.session.open_multi_table_upload_session(self.project_id, self.dataset_id, self.upload_tables, update_policy='replace')
+
+    def export_tables(self, rows_iterators):
+        # One reader thread per table, the upload workers are shared
+        with ThreadPoolExecutor(max_workers=len(self.upload_tables)) as executor:
+            futures = [
+                executor.submit(self.export_table, upload_table.name, rows_iterators[upload_table.name]) for upload_table in self.upload_tables
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except Exception:
+                self.uploader.abort()
+                raise
+
+    def export_table(self, table_name, rows):
+        chunk_sizer = self.chunk_sizers[table_name]
+        row_buffer = []
+        for row in rows:
+            row_buffer.append(row)
+            if len(row_buffer) >= chunk_sizer.chunk_rows:
+                self.push_rows(table_name, row_buffer)
+                row_buffer = []
+        if row_buffer or not self.rows_counts[table_name]:
+            self.push_rows(table_name, row_buffer)
+        logger.info("All {} rows of table '{}' are queued for upload".format(self.rows_counts[table_name], table_name))
+
+    def push_rows(self, table_name, rows):
+        logger.info("Sending {} rows of table '{}' to MicroStrategy.".format(len(rows), table_name))
+        self.uploader.push_rows(rows, table_name=table_name, chunk_sizer=self.chunk_sizers[table_name])
+        self.rows_counts[table_name] += len(rows)
+        self.metrics.increment("rows", len(rows))
+
+    def close(self):
+        logger.info("Waiting for all chunks to be uploaded.")
+        with self.metrics.timer("wait_uploads"):
+            self.uploader.wait()
+        with self.metrics.timer("publish_request"):
+            publish_monitor = PublishMonitor(self.session, timeout=self.publish_timeout).publish()
+        if self.wait_for_publish:
+            publish_monitor.wait()
+            self.metrics.add_time("publish", publish_monitor.publish_duration)
+        else:
+            logger.info("Publication started, not waiting for it to complete.")
+        return self.rows_counts
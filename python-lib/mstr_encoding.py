@@ -0,0 +1,211 @@
+import io
+import re
+import json
+import numpy
+import pandas
+import threading
+import mstr_json
+from base64 import b64encode
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from dateutil.parser import parse
+from mstr_json import DSS_DATETIME_PATTERN, format_dss_datetime
+
+
+ENCODING_BATCH_ROWS = 1000
+DATE_CACHE_SIZE = 65536
+ISO_DATETIME_REGEX = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})"
+    r"(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,9}))?)?)?"
+    r"(Z|[+-]\d{2}:?\d{2})?$"
+)
+
+thread_buffers = threading.local()
+
+
+def encode_rows(rows, columns_names, columns_types):
+    dataframe = build_dataframe(rows, columns_names)
+    return encode_dataframe(dataframe, columns_types)
+
+
+def encode_dataframe(dataframe, columns_types):
+    columns = convert_dataframe_columns(dataframe, columns_types)
+    upload_rows = list(zip(*columns))
+    return encode_json_to_base64(upload_rows)
+
+
+def write_upload_chunk_body_from_dataframe(output, dataframe, columns_types, table_name, index):
+    # Streams the PUT body of an upload session chunk into output.
+    # Rows are serialized and base64 encoded batch by batch, so only the encoded body is ever held in full.
+    columns = convert_dataframe_columns(dataframe, columns_types)
+    rows_count = len(columns[0]) if columns else 0
+    output.write('{{"tableName":{},"index":{},"data":"'.format(json.dumps(table_name), int(index)).encode("utf-8"))
+    base64_writer = Base64Writer(output)
+    base64_writer.write(b"[")
+    for batch_start in range(0, rows_count, ENCODING_BATCH_ROWS):
+        if batch_start:
+            base64_writer.write(b",")
+        # Row tuples are only built for the current batch
+        batch_end = batch_start + ENCODING_BATCH_ROWS
+        batch = mstr_json.dumps(list(zip(*(column[batch_start:batch_end] for column in columns))))
+        base64_writer.write(memoryview(batch)[1:-1])
+    base64_writer.write(b"]")
+    base64_writer.close()
+    output.write(b'"}')
+    return output
+
+
+def get_body_buffer():
+    # One buffer per upload thread, rewound and overwritten for each chunk
+    body_buffer = getattr(thread_buffers, "body_buffer", None)
+    if body_buffer is None:
+        body_buffer = io.BytesIO()
+        thread_buffers.body_buffer = body_buffer
+    body_buffer.seek(0)
+    return body_buffer
+
+
+def finalize_body_buffer(body_buffer):
+    body_buffer.truncate()
+    body_size = body_buffer.tell()
+    body_buffer.seek(0)
+    return body_size
+
+
+class Base64Writer(object):
+    def __init__(self, output):
+        self.output = output
+        self.remainder = b""
+
+    def write(self, data):
+        if self.remainder:
+            data = self.remainder + bytes(data)
+        # base64 maps 3 bytes to 4 characters, the tail waits for the next write
+        aligned_length = len(data) - len(data) % 3
+        self.output.write(b64encode(data[:aligned_length]))
+        self.remainder = bytes(data[aligned_length:])
+
+    def close(self):
+        if self.remainder:
+            self.output.write(b64encode(self.remainder))
+            self.remainder = b""
+
+
+def convert_rows_to_data(rows, columns_types):
+    columns_names = list(dict.fromkeys(key for row in rows for key in row))
+    dataframe = build_dataframe([tuple(row.get(column_name) for column_name in columns_names) for row in rows], columns_names)
+    columns = convert_dataframe_columns(dataframe, columns_types)
+    output_rows = [dict(zip(columns_names, row)) for row in zip(*columns)]
+    return encode_json_to_base64(output_rows)
+
+
+def build_dataframe(rows, columns_names):
+    if isinstance(rows, pandas.DataFrame):
+        # Chunks of a batch export are already DataFrames, only their columns order is enforced
+        if list(rows.columns) == list(columns_names):
+            return rows
+        return rows.reindex(columns=columns_names)
+    # Object columns keep the values as given: an integer column with an empty cell would become float64 and round large ids
+    values = numpy.empty((len(rows), len(columns_names)), dtype=object)
+    if len(rows):
+        values[:] = rows
+    return pandas.DataFrame(values, columns=columns_names)
+
+
+def convert_dataframe_columns(dataframe, columns_types):
+    keep_arrays = mstr_json.get_json_backend().handles_numpy
+    columns = []
+    for column_index, column_type in enumerate(columns_types[:dataframe.shape[1]]):
+        values = convert_column(dataframe.iloc[:, column_index], column_type)
+        columns.append(values if keep_arrays else values.tolist())
+    return columns
+
+
+def convert_column(column, column_type):
+    if column_type == "string":
+        return convert_string_column(column)
+    elif column_type == "date":
+        return convert_date_column(column)
+    return convert_generic_column(column)
+
+
+def convert_string_column(column):
+    values = column.to_numpy(dtype=object)
+    if pandas.api.types.infer_dtype(values, skipna=False) == "string":
+        return values
+    values = values.copy()
+    values[pandas.isna(values)] = ""
+    if pandas.api.types.infer_dtype(values, skipna=False) != "string":
+        is_string = numpy.fromiter((type(value) == str for value in values), dtype=bool, count=len(values))
+        values[~is_string] = ""
+    return values
+
+
+def convert_date_column(column):
+    if pandas.api.types.is_datetime64_any_dtype(column):
+        if getattr(column.dt, "tz", None) is not None:
+            column = column.dt.tz_convert("UTC")
+        values = column.dt.strftime(DSS_DATETIME_PATTERN).to_numpy(dtype=object)
+        values[column.isna().to_numpy()] = None
+        return values
+    # Mixed content is converted once per distinct value, then spread back to the whole column
+    codes, uniques = pandas.factorize(column.to_numpy(dtype=object))
+    converted_uniques = numpy.array([convert_date_value(value) for value in uniques] + [None], dtype=object)
+    return converted_uniques[codes]
+
+
+def convert_date_value(value):
+    if isinstance(value, datetime):
+        return format_dss_datetime(value)
+    if isinstance(value, date):
+        return format_dss_datetime(datetime(value.year, value.month, value.day))
+    if isinstance(value, str):
+        return normalize_date_string(value)
+    return None
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def normalize_date_string(date_text):
+    match = ISO_DATETIME_REGEX.match(date_text.strip())
+    try:
+        if match:
+            parsed_date = build_iso_datetime(match)
+        else:
+            # Slow path for anything DSS does not usually emit
+            parsed_date = parse(date_text)
+    except Exception:
+        return None
+    return format_dss_datetime(parsed_date)
+
+
+def build_iso_datetime(match):
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    microsecond = int(fraction[:6].ljust(6, "0")) if fraction else 0
+    tzinfo = None
+    if offset == "Z":
+        tzinfo = timezone.utc
+    elif offset:
+        sign = -1 if offset[0] == "-" else 1
+        offset = offset[1:].replace(":", "")
+        tzinfo = timezone(sign * timedelta(hours=int(offset[:2]), minutes=int(offset[2:])))
+    return datetime(
+        int(year), int(month), int(day),
+        int(hour or 0), int(minute or 0), int(second or 0), microsecond,
+        tzinfo=tzinfo
+    )
+
+
+def convert_generic_column(column):
+    # Nullable extension dtypes (Int64, boolean) hold pandas.NA, which only the object path turns into None
+    if mstr_json.get_json_backend().handles_nan and column.dtype.kind in "biuf" and not pandas.api.types.is_extension_array_dtype(column.dtype):
+        return column.to_numpy()
+    values = column.to_numpy(dtype=object)
+    missing = pandas.isna(values)
+    if missing.any():
+        values = values.copy()
+        values[missing] = None
+    return values
+
+
+def encode_json_to_base64(rows):
+    return b64encode(mstr_json.dumps(rows)).decode("utf-8")
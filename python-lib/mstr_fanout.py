@@ -0,0 +1,208 @@
+import io
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from mstr_session import UploadTable
+from mstr_publish import PublishMonitor, DEFAULT_PUBLISH_TIMEOUT
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+TARGET_STATUS_OPEN = "open"
+TARGET_STATUS_PUBLISHING = "publishing"
+TARGET_STATUS_PUBLISHED = "published"
+TARGET_STATUS_FAILED = "failed"
+
+
+class FanOutTarget(object):
+    """
+    An additional cube receiving the same data as the main one, in another project or folder.
+    It has its own session and upload session, so that it is opened and published on its own.
+    """
+
+    def __init__(self, session, project_name, dataset_name, folder_id=None, project_id=None):
+        self.session = session
+        self.project_name = project_name
+        self.project_id = project_id
+        self.dataset_name = dataset_name
+        self.folder_id = folder_id or None
+        self.dataset_id = None
+        self.status = None
+        self.error = None
+        self.chunks = 0
+        self.chunks_lock = threading.Lock()
+        self.publish_monitor = None
+
+    def get_label(self):
+        return "'{}' in project '{}'".format(self.dataset_name, self.project_name or self.project_id)
+
+    def open(self, table_name, columns_names, dss_columns_types):
+        if not self.project_id:
+            self.project_id = self.session.get_project_id(self.project_name)
+        upload_table = UploadTable(table_name, columns_names, dss_columns_types)
+        self.session.run_on_dataset(self.project_id, self.dataset_name, lambda dataset_id: self.replace_dataset(dataset_id, upload_table), folder_id=self.folder_id)
+        self.status = TARGET_STATUS_OPEN
+
+    def replace_dataset(self, dataset_id, upload_table):
+        self.dataset_id = dataset_id
+        if not self.dataset_id:
+            logger.info("Creating dataset {}".format(self.get_label()))
+            self.dataset_id = self.session.create_multi_table_dataset(self.project_id, self.dataset_name, [upload_table], folder_id=self.folder_id)
+        self.session.update_dataset(
+            [], self.project_id, self.dataset_id, upload_table.name, upload_table.columns_names, upload_table.dss_columns_types, update_policy='replace'
+        )
+        self.session.open_multi_table_upload_session(self.project_id, self.dataset_id, [upload_table], update_policy='replace')
+
+    def push_body(self, body, index):
+        self.session.upload_session_push_body(body, index)
+        with self.chunks_lock:
+            self.chunks += 1
+
+    def publish(self, timeout):
+        self.publish_monitor = PublishMonitor(self.session, timeout=timeout).publish()
+        self.status = TARGET_STATUS_PUBLISHING
+
+    def fail(self, error):
+        if self.status != TARGET_STATUS_FAILED:
+            logger.error("Export to dataset {} failed: {}".format(self.get_label(), error))
+        self.status = TARGET_STATUS_FAILED
+        self.error = error
+
+    def is_active(self):
+        return self.status != TARGET_STATUS_FAILED
+
+    def get_report(self):
+        return {
+            "project": self.project_name or self.project_id,
+            "dataset": self.dataset_name,
+            "dataset_id": self.dataset_id,
+            "status": self.status,
+            "chunks": self.chunks,
+            "error": "{}".format(self.error) if self.error else None
+        }
+
+
+class FanOutSession(object):
+    """
+    Stands for the main session in the chunk uploader, so that each chunk is encoded once by the main session
+    and its body is pushed to the main upload session and to every additional target's upload session concurrently.
+    A failing additional target is left out of the next chunks and of the publication, without stopping the other ones.
+    """
+
+    def __init__(self, session, targets, max_workers):
+        self.session = session
+        self.targets = targets
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers * len(targets)))
+
+    def upload_session_next_index(self, table_name=None):
+        # The main session numbers the chunks, the body holds the same index for every target
+        return self.session.upload_session_next_index(table_name)
+
+    def build_upload_chunk_body(self, rows, index, output=None, table_name=None):
+        return self.session.build_upload_chunk_body(rows, index, output=output, table_name=table_name)
+
+    def upload_session_push_body(self, body, index, table_name=None):
+        # Each target streams the body through its own reader, without a copy of it in memory
+        readers = [(target, BodyReader(body)) for target in self.targets if target.is_active()]
+        futures = [(target, reader, self.executor.submit(target.push_body, reader, index)) for target, reader in readers]
+        try:
+            return self.session.upload_session_push_body(body, index, table_name=table_name)
+        finally:
+            for target, reader, future in futures:
+                try:
+                    future.result()
+                except Exception as error:
+                    target.fail(error)
+                finally:
+                    reader.close()
+
+    def open_targets(self, table_name, columns_names, dss_columns_types):
+        self.run_on_targets(lambda target: target.open(table_name, columns_names, dss_columns_types))
+
+    def publish_targets(self, timeout=DEFAULT_PUBLISH_TIMEOUT):
+        self.run_on_targets(lambda target: target.publish(timeout))
+
+    def wait_for_targets(self):
+        self.run_on_targets(lambda target: target.publish_monitor.wait())
+        for target in self.targets:
+            if target.is_active():
+                target.status = TARGET_STATUS_PUBLISHED
+
+    def run_on_targets(self, function):
+        futures = [(target, self.executor.submit(function, target)) for target in self.targets if target.is_active()]
+        for target, future in futures:
+            try:
+                future.result()
+            except Exception as error:
+                target.fail(error)
+
+    def log_summary(self):
+        reports = [target.get_report() for target in self.targets]
+        for report in reports:
+            logger.info("Fan-out target {}".format(report))
+        return reports
+
+    def raise_on_failure(self):
+        failed_targets = [target for target in self.targets if not target.is_active()]
+        if failed_targets:
+            raise Exception("Export failed for {} of {} additional datasets: {}".format(
+                len(failed_targets), len(self.targets), ", ".join("{} ({})".format(target.get_label(), target.error) for target in failed_targets)
+            ))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class BodyReader(object):
+    """
+    Read-only file over a chunk body, in memory or spilled to disk, with a position of its own,
+    so that several upload sessions stream the same body at once.
+    """
+
+    def __init__(self, body):
+        self.position = 0
+        self.buffer = None
+        self.file_descriptor = None
+        if isinstance(body, bytes):
+            self.buffer = memoryview(body)
+        elif isinstance(body, io.BytesIO):
+            self.buffer = body.getbuffer()
+        else:
+            body.flush()
+            self.file_descriptor = body.fileno()
+        self.size = len(self.buffer) if self.buffer is not None else os.fstat(self.file_descriptor).st_size
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        size = max(0, min(size, self.size - self.position))
+        if self.buffer is not None:
+            data = self.buffer[self.position:self.position + size].tobytes()
+        else:
+            # Positional reads leave the offset of the file, shared with the other readers, untouched
+            data = os.pread(self.file_descriptor, size, self.position)
+        self.position += len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        # An in-memory body can only be rewritten once every view on it is released
+        if self.buffer is not None:
+            self.buffer.release()
+            self.buffer = None
@@ -0,0 +1,208 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+OBJECT_TYPE_FOLDER = 8
+ROOT_FOLDER_ID = ""
+DEFAULT_INDEX_MAX_DEPTH = 4
+DEFAULT_INDEX_MAX_WORKERS = 8
+DEFAULT_INDEX_MAX_FOLDERS = 5000
+DEFAULT_INDEX_TIME_BUDGET = 30
+DEFAULT_SEARCH_LIMIT = 50
+DEFAULT_SEARCH_WAIT = 10
+
+# Cache key -> thread indexing that tree, so that the callbacks of one process never index the same tree twice
+indexing_threads = {}
+indexing_threads_lock = threading.Lock()
+
+
+class FolderTreeIndex(object):
+    """
+    Index of the shared reports folder tree of a project, so that every navigation step of the folder browser
+    is answered from memory. A requested folder is listed at once if it is not indexed yet, while a background
+    thread fetches the tree breadth first, one level at a time with concurrent requests, down to max_depth and
+    for at most time_budget seconds. Each indexed level is saved in the metadata cache, so that the next UI
+    callbacks start from it and resume the indexing where it stopped. The search covers the folders indexed so far.
+    """
+
+    def __init__(self, session, project_id, max_depth=DEFAULT_INDEX_MAX_DEPTH, max_workers=DEFAULT_INDEX_MAX_WORKERS, max_folders=DEFAULT_INDEX_MAX_FOLDERS,
+                 time_budget=DEFAULT_INDEX_TIME_BUDGET, background=True):
+        self.session = session
+        self.project_id = project_id
+        self.max_depth = max_depth
+        self.max_workers = max_workers
+        self.max_folders = max_folders
+        self.time_budget = time_budget
+        self.lock = threading.Lock()
+        self.cache_key = session.build_cache_key("folder_tree", project_id)
+        # Folder id -> {"name", "parent_id", "depth", "children"}, children is None until the folder is explored
+        self.folders = {ROOT_FOLDER_ID: {"name": "", "parent_id": None, "depth": 0, "children": None}}
+        self.reload()
+        if background:
+            self.start_indexing()
+        else:
+            self.build()
+
+    def start_indexing(self):
+        if not self.get_unexplored_level(set()):
+            return
+        thread_key = tuple(self.cache_key)
+        with indexing_threads_lock:
+            indexing_thread = indexing_threads.get(thread_key)
+            if indexing_thread and indexing_thread.is_alive():
+                return
+            indexing_thread = threading.Thread(target=self.build, name="mstr-folder-index")
+            indexing_thread.daemon = True
+            indexing_threads[thread_key] = indexing_thread
+            indexing_thread.start()
+
+    def wait(self, timeout=None):
+        indexing_thread = indexing_threads.get(tuple(self.cache_key))
+        if indexing_thread:
+            indexing_thread.join(timeout)
+        # The thread may belong to the index of another callback, which only shares its folders through the cache
+        self.reload()
+
+    def reload(self):
+        cached_folders = self.session.metadata_cache.get(self.cache_key)
+        if not cached_folders:
+            return
+        with self.lock:
+            for folder_id, cached_folder in cached_folders.items():
+                folder = self.folders.get(folder_id)
+                if folder is None or (folder["children"] is None and cached_folder["children"] is not None):
+                    self.folders[folder_id] = dict(cached_folder)
+
+    def build(self):
+        deadline = time.time() + self.time_budget
+        attempted_folder_ids = set()
+
+        def fetch_before_deadline(folder_id):
+            # Past the deadline, folders are left unexplored for the next callbacks
+            if time.time() > deadline:
+                return None
+            attempted_folder_ids.add(folder_id)
+            return self.fetch_subfolders(folder_id)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                level = self.get_unexplored_level(attempted_folder_ids)
+                while level and len(self.folders) < self.max_folders and time.time() <= deadline:
+                    contents = list(executor.map(fetch_before_deadline, level))
+                    with self.lock:
+                        for folder_id, subfolders in zip(level, contents):
+                            # The folder may have been opened by the user meanwhile
+                            if self.folders[folder_id]["children"] is None:
+                                self.add_subfolders(folder_id, subfolders)
+                    self.save()
+                    level = self.get_unexplored_level(attempted_folder_ids)
+        except Exception as error_message:
+            logger.warning("Could not index the folders of project {}: {}".format(self.project_id, error_message))
+            return
+        if level and time.time() > deadline:
+            logger.info("Stopped indexing the folders of project {} after {}s, at {} folders".format(self.project_id, self.time_budget, len(self.folders) - 1))
+        else:
+            logger.info("Indexed {} folders of project {}".format(len(self.folders) - 1, self.project_id))
+
+    def get_unexplored_level(self, excluded_folder_ids):
+        # Ids of the shallowest folders not explored yet, above max_depth
+        with self.lock:
+            unexplored_folders = [
+                (folder["depth"], folder_id) for folder_id, folder in self.folders.items()
+                if folder["children"] is None and folder["depth"] < self.max_depth and folder_id not in excluded_folder_ids
+            ]
+        if not unexplored_folders:
+            return []
+        level_depth = min(unexplored_folders)[0]
+        return [folder_id for depth, folder_id in unexplored_folders if depth == level_depth]
+
+    def fetch_subfolders(self, folder_id):
+        if folder_id == ROOT_FOLDER_ID:
+            content = self.session.get_shared_folders(self.project_id, use_cache=False)
+        else:
+            content = self.session.get_folder(self.project_id, folder_id, use_cache=False)
+        if not isinstance(content, list):
+            logger.warning("Could not list the content of folder '{}'".format(folder_id))
+            return None
+        return [item for item in content if item.get("type") == OBJECT_TYPE_FOLDER]
+
+    def add_subfolders(self, folder_id, subfolders):
+        # Called with the lock held
+        if subfolders is None:
+            return []
+        parent = self.folders[folder_id]
+        children = []
+        for subfolder in subfolders:
+            subfolder_id = "{}".format(subfolder.get("id"))
+            children.append(subfolder_id)
+            known_subfolder = self.folders.get(subfolder_id)
+            self.folders[subfolder_id] = {
+                "name": "{}".format(subfolder.get("name")),
+                "parent_id": folder_id,
+                "depth": parent["depth"] + 1,
+                "children": known_subfolder["children"] if known_subfolder else None
+            }
+        parent["children"] = children
+        return children
+
+    def save(self):
+        # A copy, so that the cache can be written while the indexing goes on
+        with self.lock:
+            folders = dict((folder_id, dict(folder)) for folder_id, folder in self.folders.items())
+        self.session.metadata_cache.set(self.cache_key, folders)
+
+    def get_subfolders(self, path_ids=None, path_names=None):
+        # Returns the (id, name) of the subfolders of the last folder of the path, exploring it first if it is deeper than the index
+        path_ids = path_ids or []
+        folder_id = path_ids[-1] if path_ids else ROOT_FOLDER_ID
+        with self.lock:
+            folder = self.folders.get(folder_id)
+            is_explored = folder is not None and folder["children"] is not None
+        if not is_explored:
+            subfolders = self.fetch_subfolders(folder_id)
+            with self.lock:
+                self.add_path(path_ids, path_names or [])
+                if self.folders[folder_id]["children"] is None:
+                    self.add_subfolders(folder_id, subfolders)
+            self.save()
+        with self.lock:
+            return [(subfolder_id, self.folders[subfolder_id]["name"]) for subfolder_id in self.folders[folder_id]["children"] or []]
+
+    def add_path(self, path_ids, path_names):
+        # Called with the lock held. Folders of a path the indexing has not reached yet
+        parent_id = ROOT_FOLDER_ID
+        for depth, folder_id in enumerate(path_ids, start=1):
+            if folder_id not in self.folders:
+                folder_name = path_names[depth - 1] if depth <= len(path_names) else ""
+                self.folders[folder_id] = {"name": folder_name, "parent_id": parent_id, "depth": depth, "children": None}
+            parent_id = folder_id
+
+    def get_path(self, folder_id):
+        # Returns the ids and names of the folders from the root to this one
+        path_ids = []
+        path_names = []
+        with self.lock:
+            while folder_id and folder_id in self.folders:
+                path_ids.insert(0, folder_id)
+                path_names.insert(0, self.folders[folder_id]["name"])
+                folder_id = self.folders[folder_id]["parent_id"]
+        return path_ids, path_names
+
+    def search(self, searched_text, limit=DEFAULT_SEARCH_LIMIT):
+        # Case insensitive match on the folder names, shallowest folders first
+        searched_text = searched_text.strip().lower()
+        if not searched_text:
+            return []
+        with self.lock:
+            matches = [
+                (folder["depth"], folder["name"].lower(), folder_id) for folder_id, folder in self.folders.items()
+                if folder_id != ROOT_FOLDER_ID and searched_text in folder["name"].lower()
+            ]
+        matches = [folder_id for depth, name, folder_id in sorted(matches)]
+        return [self.get_path(folder_id) for folder_id in matches[:limit]]
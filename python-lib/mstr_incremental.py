@@ -0,0 +1,237 @@
+import os
+import io
+import numpy
+import pandas
+import logging
+import threading
+from mstr_state import get_state_directory, build_state_key, load_json_state, save_json_state, write_state_file, delete_state_file
+from mstr_encoding import convert_date_column
+from mstr_json import DSS_DATETIME_PATTERN
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+EXPORT_MODE_FULL = "full"
+EXPORT_MODE_APPEND_WATERMARK = "append_watermark"
+EXPORT_MODE_UPSERT_CHANGED = "upsert_changed"
+NUMERIC_DSS_TYPES = ["int", "bigint", "smallint", "tinyint", "float", "double"]
+
+
+class IncrementalExport(object):
+    """
+    Keeps track of what was sent by the previous export to a given cube, so that the next one
+    only sends new rows (watermark column, ADD policy) or new and modified rows (row hashes, UPSERT policy).
+    Rows deleted from the input dataset are not removed from the cube, a full export is needed for that.
+    """
+
+    def __init__(self, export_mode, target_key_parts, columns_names, columns_types, watermark_column=None):
+        self.export_mode = export_mode or EXPORT_MODE_FULL
+        self.columns_names = list(columns_names)
+        self.columns_types = list(columns_types)
+        self.watermark_column = watermark_column
+        self.lock = threading.Lock()
+        self.target_key_parts = target_key_parts
+        self.state_path, self.hashes_path = get_state_paths(target_key_parts)
+        self.previous_state = load_json_state(self.state_path, default={})
+        self.is_incremental = False
+        self.rows_filter = None
+        if self.export_mode == EXPORT_MODE_APPEND_WATERMARK:
+            if watermark_column not in self.columns_names:
+                raise ValueError("Watermark column '{}' is not part of the exported dataset".format(watermark_column))
+            watermark_type = self.columns_types[self.columns_names.index(watermark_column)]
+            last_watermark = self.previous_state.get("watermark") if self.can_resume_from_state() else None
+            self.rows_filter = WatermarkFilter(watermark_column, watermark_type, last_watermark)
+            self.is_incremental = last_watermark is not None
+        elif self.export_mode == EXPORT_MODE_UPSERT_CHANGED:
+            previous_hashes = self.load_previous_hashes() if self.can_resume_from_state() else None
+            self.rows_filter = RowHashFilter(self.columns_types, previous_hashes)
+            self.is_incremental = previous_hashes is not None
+        if self.export_mode != EXPORT_MODE_FULL and not self.is_incremental:
+            logger.info("No usable state from a previous export, sending the full dataset")
+
+    def can_resume_from_state(self):
+        if self.previous_state.get("export_mode") != self.export_mode:
+            return False
+        if self.previous_state.get("columns_names") != self.columns_names:
+            logger.info("The schema changed since the last export")
+            return False
+        if self.previous_state.get("columns_types") != self.columns_types:
+            logger.info("The schema changed since the last export")
+            return False
+        return True
+
+    def force_full_export(self):
+        # The target cube was just created, nothing from the previous state exists on the server
+        if self.is_incremental:
+            logger.info("Target dataset was recreated, sending the full dataset")
+        self.is_incremental = False
+        if self.export_mode == EXPORT_MODE_APPEND_WATERMARK:
+            self.rows_filter = WatermarkFilter(self.watermark_column, self.rows_filter.column_type, None)
+        elif self.export_mode == EXPORT_MODE_UPSERT_CHANGED:
+            self.rows_filter = RowHashFilter(self.columns_types, None)
+
+    def get_update_policy(self):
+        if not self.is_incremental:
+            return "replace"
+        if self.export_mode == EXPORT_MODE_APPEND_WATERMARK:
+            return "add"
+        return "upsert"
+
+    def filter_rows(self, dataframe):
+        if self.rows_filter is None:
+            return dataframe
+        with self.lock:
+            return self.rows_filter.filter(dataframe)
+
+    def load_previous_hashes(self):
+        if not os.path.isfile(self.hashes_path):
+            return None
+        try:
+            return numpy.load(self.hashes_path)
+        except Exception as error_message:
+            logger.warning("Ignoring unreadable hashes file {}: {}".format(self.hashes_path, error_message))
+            return None
+
+    def commit(self, pending=False):
+        # To be called only once the upload session has been published. A pending state waits for confirm_pending_state
+        if self.export_mode == EXPORT_MODE_FULL:
+            return
+        state_path, hashes_path = get_state_paths(self.target_key_parts, pending=pending)
+        state = {
+            "export_mode": self.export_mode,
+            "columns_names": self.columns_names,
+            "columns_types": self.columns_types
+        }
+        if self.export_mode == EXPORT_MODE_APPEND_WATERMARK:
+            state["watermark"] = self.rows_filter.get_watermark()
+        else:
+            hashes_buffer = io.BytesIO()
+            numpy.save(hashes_buffer, self.rows_filter.get_hashes())
+            write_state_file(hashes_path, hashes_buffer.getvalue())
+        save_json_state(state_path, state)
+        logger.info("Incremental export state {}".format("saved until the publication is confirmed" if pending else "saved"))
+
+    def log_summary(self):
+        if self.rows_filter is not None:
+            logger.info("{} rows read, {} rows sent".format(self.rows_filter.rows_read, self.rows_filter.rows_kept))
+        if self.export_mode == EXPORT_MODE_APPEND_WATERMARK and self.rows_filter.rows_without_watermark:
+            logger.warning("{} rows were not sent, their '{}' watermark is empty or not a valid {}".format(
+                self.rows_filter.rows_without_watermark, self.watermark_column, self.rows_filter.column_type
+            ))
+
+
+class WatermarkFilter(object):
+    def __init__(self, column_name, column_type, last_watermark):
+        self.column_name = column_name
+        self.column_type = column_type
+        self.last_watermark = last_watermark
+        self.threshold = None
+        if last_watermark is not None:
+            self.threshold = self.convert(pandas.Series([last_watermark])).iloc[0]
+        self.max_value = self.threshold
+        self.rows_read = 0
+        self.rows_kept = 0
+        # Rows that cannot be placed against the watermark, only sent by full exports
+        self.rows_without_watermark = 0
+
+    def convert(self, column):
+        if self.column_type == "date":
+            # Dates are normalized as for the upload first, pandas would guess one layout for the whole column
+            normalized_dates = pandas.Series(convert_date_column(column), index=column.index)
+            return pandas.to_datetime(normalized_dates, format=DSS_DATETIME_PATTERN, errors="coerce", utc=True)
+        if self.column_type in NUMERIC_DSS_TYPES:
+            return pandas.to_numeric(column, errors="coerce")
+        return column.astype(str).astype(object).where(column.notna(), None)
+
+    def filter(self, dataframe):
+        values = self.convert(dataframe[self.column_name])
+        valid_values = values.dropna()
+        if len(valid_values):
+            chunk_max = valid_values.max()
+            if self.max_value is None or chunk_max > self.max_value:
+                self.max_value = chunk_max
+        self.rows_read += len(dataframe)
+        if self.threshold is None:
+            self.rows_kept += len(dataframe)
+            return dataframe
+        is_valid = values.notna().to_numpy(dtype=bool)
+        self.rows_without_watermark += int((~is_valid).sum())
+        mask = numpy.zeros(len(values), dtype=bool)
+        mask[is_valid] = (values[is_valid] > self.threshold).to_numpy(dtype=bool)
+        filtered_dataframe = dataframe[mask]
+        self.rows_kept += len(filtered_dataframe)
+        return filtered_dataframe
+
+    def get_watermark(self):
+        if self.max_value is None:
+            return self.last_watermark
+        if isinstance(self.max_value, pandas.Timestamp):
+            return self.max_value.isoformat()
+        if isinstance(self.max_value, numpy.generic):
+            return self.max_value.item()
+        return self.max_value
+
+
+class RowHashFilter(object):
+    def __init__(self, columns_types, previous_hashes=None):
+        self.columns_types = columns_types
+        self.previous_hashes = numpy.sort(previous_hashes) if previous_hashes is not None else None
+        self.hashes = []
+        self.rows_read = 0
+        self.rows_kept = 0
+
+    def filter(self, dataframe):
+        hashes = hash_rows(dataframe, self.columns_types)
+        self.hashes.append(hashes)
+        self.rows_read += len(dataframe)
+        if self.previous_hashes is None or not len(self.previous_hashes):
+            self.rows_kept += len(dataframe)
+            return dataframe
+        positions = numpy.searchsorted(self.previous_hashes, hashes)
+        positions[positions >= len(self.previous_hashes)] = 0
+        is_known = self.previous_hashes[positions] == hashes
+        filtered_dataframe = dataframe[~is_known]
+        self.rows_kept += len(filtered_dataframe)
+        return filtered_dataframe
+
+    def get_hashes(self):
+        if not self.hashes:
+            return numpy.array([], dtype=numpy.uint64)
+        return numpy.unique(numpy.concatenate(self.hashes))
+
+
+def hash_rows(dataframe, columns_types):
+    # Columns are normalized first, so that a value hashes the same whatever dtype pandas inferred for its chunk
+    normalized_columns = {}
+    for column_index, column_type in enumerate(columns_types[:dataframe.shape[1]]):
+        column = dataframe.iloc[:, column_index]
+        if column_type in NUMERIC_DSS_TYPES:
+            normalized_columns[column_index] = pandas.to_numeric(column, errors="coerce").astype("float64")
+        else:
+            normalized_columns[column_index] = column.astype(object).where(column.notna(), None).astype(str)
+    normalized_dataframe = pandas.DataFrame(normalized_columns)
+    return pandas.util.hash_pandas_object(normalized_dataframe, index=False).to_numpy()
+
+
+def get_state_paths(target_key_parts, pending=False):
+    state_key = build_state_key(*target_key_parts)
+    if pending:
+        state_key = "{}.pending".format(state_key)
+    state_directory = get_state_directory("incremental")
+    return os.path.join(state_directory, "{}.json".format(state_key)), os.path.join(state_directory, "{}.hashes.npy".format(state_key))
+
+
+def confirm_pending_state(target_key_parts):
+    for pending_path, state_path in zip(get_state_paths(target_key_parts, pending=True), get_state_paths(target_key_parts)):
+        try:
+            os.replace(pending_path, state_path)
+        except FileNotFoundError:
+            # Nothing pending for this file, or already confirmed by another thread
+            pass
+
+
+def discard_pending_state(target_key_parts):
+    for pending_path in get_state_paths(target_key_parts, pending=True):
+        delete_state_file(pending_path)
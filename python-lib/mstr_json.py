@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import logging
+from datetime import date, datetime, timezone
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+DSS_DATETIME_PATTERN = "%Y-%m-%dT%H:%M:%S.%fZ"
+JSON_BACKEND_ENVIRONMENT_VARIABLE = "MSTR_PLUGIN_JSON_BACKEND"
+
+
+class StdlibJsonBackend(object):
+    name = "json"
+    handles_nan = False
+    handles_numpy = False
+
+    def dumps(self, value):
+        return json.dumps(value, separators=(',', ':'), default=serialize_default).encode("utf-8")
+
+
+class OrjsonBackend(object):
+    name = "orjson"
+    # orjson writes NaN as null, so numeric columns can be sent without masking missing values first
+    handles_nan = True
+    # NumPy values are written natively (OPT_SERIALIZE_NUMPY), the columns do not need converting to Python objects
+    handles_numpy = True
+
+    def __init__(self):
+        self.options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, value):
+        return orjson.dumps(value, default=serialize_default, option=self.options)
+
+
+JSON_BACKENDS = {
+    StdlibJsonBackend.name: StdlibJsonBackend,
+    OrjsonBackend.name: OrjsonBackend
+}
+
+json_backend = None
+
+
+def get_json_backend():
+    if json_backend is None:
+        backend_name = os.environ.get(JSON_BACKEND_ENVIRONMENT_VARIABLE)
+        if not backend_name:
+            backend_name = OrjsonBackend.name if orjson else StdlibJsonBackend.name
+        set_json_backend(backend_name)
+    return json_backend
+
+
+def set_json_backend(backend_name):
+    global json_backend
+    if backend_name not in JSON_BACKENDS:
+        raise ValueError("Unknown JSON backend '{}', available backends are {}".format(backend_name, list(JSON_BACKENDS)))
+    if backend_name == OrjsonBackend.name and not orjson:
+        raise ValueError("The orjson package is not installed in the code environment")
+    json_backend = JSON_BACKENDS[backend_name]()
+    logger.info("Using the {} JSON serializer".format(json_backend.name))
+    return json_backend
+
+
+def dumps(value):
+    return get_json_backend().dumps(value)
+
+
+def serialize_default(value):
+    if isinstance(value, datetime):
+        return format_dss_datetime(value)
+    if isinstance(value, date):
+        return format_dss_datetime(datetime(value.year, value.month, value.day))
+    # numpy values can only come from an already imported numpy, the metadata calls do not need to load it
+    numpy = sys.modules.get("numpy")
+    if numpy is not None:
+        if isinstance(value, numpy.generic):
+            return value.item()
+        if isinstance(value, numpy.ndarray):
+            return value.tolist()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+
+def format_dss_datetime(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime(DSS_DATETIME_PATTERN)
@@ -0,0 +1,102 @@
+import sys
+import logging
+import tempfile
+import threading
+from mstr_state import get_state_directory
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+# Buffered rows, their DataFrame, the converted columns and the encoded body are alive together while a chunk is encoded
+ENCODING_MEMORY_FACTOR = 3
+SPILL_USAGE_RATIO = 0.5
+
+
+class MemoryBudget(object):
+    """
+    Caps the estimated memory held by the chunks of an export, from their buffered rows to their encoded body.
+    A share of the budget is kept for the chunk being buffered by the reader, which gets fewer rows when the rows are wide.
+    The chunks handed to the uploader share the rest: the reader waits for uploads to release memory before handing a new one.
+    Once encoded, a chunk only holds its body, which is staged in a temporary file when the budget is more than half used.
+    Sizes are estimated from a sample row of each chunk, the cap is approximate.
+    """
+
+    def __init__(self, budget_mb, max_workers, metrics=None):
+        self.budget = int(budget_mb * 1024 * 1024)
+        # One chunk buffered by the reader, and at least one per upload worker
+        self.chunk_budget = self.budget // (max(1, int(max_workers)) + 1)
+        self.upload_budget = self.budget - self.chunk_budget
+        self.metrics = metrics
+        self.reserved = 0
+        self.peak_reserved = 0
+        self.condition = threading.Condition()
+        logger.info("Memory budget of {} MB, up to {:.1f} MB per chunk".format(budget_mb, self.chunk_budget / 1024.0 / 1024.0))
+
+    def get_max_rows(self, rows):
+        # Number of rows like these that the reader can buffer for the next chunk
+        return max(1, int(self.chunk_budget // (ENCODING_MEMORY_FACTOR * estimate_row_memory(get_sample_row(rows)))))
+
+    def reserve(self, rows):
+        # Blocks until the chunk fits in the budget. A chunk always fits when nothing else is reserved, so that the export moves on
+        size = estimate_chunk_memory(rows)
+        with self.condition:
+            while self.reserved and self.reserved + size > self.upload_budget:
+                self.condition.wait()
+            self.reserved += size
+            self.peak_reserved = max(self.peak_reserved, self.reserved)
+        return MemoryReservation(self, size)
+
+    def release(self, size):
+        with self.condition:
+            self.reserved -= size
+            self.condition.notify_all()
+
+    def open_spill_file(self):
+        # Returns a temporary file for the next chunk body when memory is tight, None to encode it in memory
+        with self.condition:
+            if self.reserved <= SPILL_USAGE_RATIO * self.upload_budget:
+                return None
+        if self.metrics:
+            self.metrics.increment("spilled_chunks")
+        # In the plugin state directory rather than the default temporary directory, which can be in memory
+        return tempfile.TemporaryFile(dir=get_state_directory("spill"))
+
+    def log_summary(self):
+        peak_reserved_mb = round(self.peak_reserved / 1024.0 / 1024.0, 1)
+        if self.metrics:
+            self.metrics.set_counter("peak_reserved_mb", peak_reserved_mb)
+        logger.info("Peak memory reserved by chunks: {} MB of the {} MB budget".format(peak_reserved_mb, round(self.budget / 1024.0 / 1024.0, 1)))
+
+
+class MemoryReservation(object):
+    def __init__(self, memory_budget, size):
+        self.memory_budget = memory_budget
+        self.size = size
+
+    def shrink(self, size):
+        # Gives back the part of the reservation that is no longer needed, for instance once the rows are encoded
+        released_size = max(0, self.size - size)
+        self.size -= released_size
+        self.memory_budget.release(released_size)
+
+    def release(self):
+        self.shrink(0)
+
+
+def estimate_chunk_memory(rows):
+    # Extrapolated from the first row, of a list of rows or of a DataFrame
+    if not len(rows):
+        return 0
+    return ENCODING_MEMORY_FACTOR * estimate_row_memory(get_sample_row(rows)) * len(rows)
+
+
+def estimate_row_memory(row):
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+
+
+def get_sample_row(rows):
+    if isinstance(rows, list):
+        return rows[0]
+    return next(rows.itertuples(index=False, name=None))
@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+class ExportMetrics(object):
+    """
+    Thread safe timers and counters for the phases of an export: open, read and buffering, encoding, upload,
+    HTTP round trips, authentication, publication...
+    Phase times are cumulative, summed over all the threads, so that concurrent phases can add up to more than the export duration.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.counters = {}
+        self.chunk_latencies = []
+
+    @contextmanager
+    def timer(self, phase):
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - phase_start)
+
+    def add_time(self, phase, seconds, count=1):
+        with self.lock:
+            phase_times = self.phases.setdefault(phase, [0.0, 0])
+            phase_times[0] += seconds
+            phase_times[1] += count
+
+    def get_time(self, phase):
+        with self.lock:
+            return self.phases.get(phase, [0.0, 0])[0]
+
+    def increment(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def set_counter(self, counter, value):
+        with self.lock:
+            self.counters[counter] = value
+
+    def record_chunk(self, latency, body_size):
+        self.add_time("upload", latency)
+        with self.lock:
+            self.chunk_latencies.append(latency)
+            self.counters["chunks"] = self.counters.get("chunks", 0) + 1
+            self.counters["bytes_sent"] = self.counters.get("bytes_sent", 0) + body_size
+
+    def get_summary(self, http_statistics=None):
+        duration = time.time() - self.start_time
+        with self.lock:
+            counters = dict(self.counters)
+            phases = dict((phase, {"seconds": round(seconds, 3), "count": count}) for phase, (seconds, count) in self.phases.items())
+            chunk_latencies = sorted(self.chunk_latencies)
+        summary = {
+            "duration": round(duration, 3),
+            "rows": counters.get("rows", 0),
+            "rows_per_second": round(counters.get("rows", 0) / duration, 1) if duration > 0 else None,
+            "bytes_sent": counters.get("bytes_sent", 0),
+            "counters": counters,
+            "phases": phases,
+            "chunk_latency": get_latency_summary(chunk_latencies),
+            "http": dict(http_statistics or {}),
+            "peak_memory_mb": get_peak_memory_mb()
+        }
+        return summary
+
+    def log_summary(self, http_statistics=None, file_path=None):
+        summary = self.get_summary(http_statistics=http_statistics)
+        logger.info("Export metrics: {}".format(json.dumps(summary, sort_keys=True)))
+        if file_path:
+            append_summary(file_path, summary)
+        return summary
+
+
+def get_latency_summary(sorted_latencies):
+    if not sorted_latencies:
+        return {}
+    latency_summary = {"max": round(sorted_latencies[-1], 3)}
+    for percentile in LATENCY_PERCENTILES:
+        rank = max(0, int(round(percentile / 100.0 * len(sorted_latencies))) - 1)
+        latency_summary["p{}".format(percentile)] = round(sorted_latencies[rank], 3)
+    return latency_summary
+
+
+def get_peak_memory_mb():
+    if resource is None:
+        return None
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        peak_memory = peak_memory / 1024
+    return round(peak_memory / 1024.0, 1)
+
+
+def append_summary(file_path, summary):
+    # One JSON document per line, so that successive exports can be compared over time
+    try:
+        directory = os.path.dirname(os.path.abspath(file_path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(file_path, "a") as metrics_file:
+            metrics_file.write(json.dumps(summary, sort_keys=True) + "\n")
+    except Exception as error_message:
+        logger.warning("Could not write export metrics to {}: {}".format(file_path, error_message))
@@ -0,0 +1,209 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from mstr_metrics import ExportMetrics
+from mstr_publish import PublishMonitor, DEFAULT_PUBLISH_TIMEOUT
+from mstr_uploader import ChunkUploader, ChunkSizer, DEFAULT_MAX_CONCURRENT_UPLOADS
+from mstr_pipeline import open_replace_upload_session, concatenate_chunks, slice_chunk
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+DEFAULT_MAX_CONCURRENT_CUBES = 2
+DEFAULT_MAX_CONCURRENT_PUBLISHES = 2
+CUBE_STATUS_PENDING = "pending"
+CUBE_STATUS_UPLOADING = "uploading"
+CUBE_STATUS_PUBLISHING = "publishing"
+CUBE_STATUS_PUBLISHED = "published"
+CUBE_STATUS_FAILED = "failed"
+CUBE_PHASES = ["open", "upload", "publish_queue", "publish"]
+
+
+class CubeRefresh(object):
+    """
+    One input to cube mapping of a refresh, with its outcome and the time spent in each phase.
+    get_chunks is called when the cube's turn comes, and returns an iterable of DataFrames (or lists of rows).
+    """
+
+    def __init__(self, cube_name, columns_names, dss_columns_types, get_chunks, input_name=None, chunk_sizer=None):
+        self.cube_name = cube_name
+        self.input_name = input_name or cube_name
+        self.columns_names = columns_names
+        self.dss_columns_types = dss_columns_types
+        self.get_chunks = get_chunks
+        self.chunk_sizer = chunk_sizer or ChunkSizer()
+        self.dataset_id = None
+        self.status = CUBE_STATUS_PENDING
+        self.error = None
+        self.rows = 0
+        self.phases = {}
+        self.publish_queued = None
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def fail(self, error):
+        logger.error("Refresh of cube '{}' failed: {}".format(self.cube_name, error))
+        self.status = CUBE_STATUS_FAILED
+        self.error = error
+
+    def get_report(self):
+        report = {
+            "input": self.input_name,
+            "cube": self.cube_name,
+            "dataset_id": self.dataset_id,
+            "status": self.status,
+            "rows": self.rows,
+            "error": "{}".format(self.error) if self.error else None
+        }
+        for phase in CUBE_PHASES:
+            report["{}_seconds".format(phase)] = round(self.phases.get(phase, 0.0), 3)
+        return report
+
+
+class CubeRefreshOrchestrator(object):
+    """
+    Refreshes several cubes, each from its own input, under caps shared by all of them:
+    - max_concurrent_cubes cubes are read and uploaded at the same time
+    - max_concurrent_uploads chunks are encoded and sent at the same time, whatever their cube
+    - max_concurrent_publishes cubes are published at the same time
+    A cube whose upload is complete goes to the publication pool, and its slot is given to the next cube,
+    so that the server side publications overlap with the next uploads.
+    A failing cube does not stop the others, the outcome of each cube is in the report.
+    """
+
+    def __init__(self, build_session, project_id, folder_id=None, table_name="dss_data", max_concurrent_cubes=DEFAULT_MAX_CONCURRENT_CUBES,
+                 max_concurrent_uploads=DEFAULT_MAX_CONCURRENT_UPLOADS, max_concurrent_publishes=DEFAULT_MAX_CONCURRENT_PUBLISHES,
+                 wait_for_publish=True, publish_timeout=DEFAULT_PUBLISH_TIMEOUT, metrics=None):
+        # build_session returns a new MstrSession, each cube has its own upload session
+        self.build_session = build_session
+        self.project_id = project_id
+        self.folder_id = folder_id
+        self.table_name = table_name
+        self.max_concurrent_cubes = max(1, int(max_concurrent_cubes or 1))
+        self.max_concurrent_uploads = max(1, int(max_concurrent_uploads or 1))
+        self.max_concurrent_publishes = max(1, int(max_concurrent_publishes or 1))
+        self.wait_for_publish = wait_for_publish
+        self.publish_timeout = publish_timeout
+        self.metrics = metrics or ExportMetrics()
+        self.cubes = []
+        self.upload_executor = None
+        self.publish_executor = None
+        self.publish_futures = []
+        self.publish_futures_lock = threading.Lock()
+        self.duration = None
+
+    def add_cube(self, cube_refresh):
+        if cube_refresh.cube_name in [cube.cube_name for cube in self.cubes]:
+            raise ValueError("Cube '{}' is refreshed twice".format(cube_refresh.cube_name))
+        self.cubes.append(cube_refresh)
+
+    def run(self):
+        start_time = time.perf_counter()
+        logger.info("Refreshing {} cubes, {} at a time, with {} concurrent uploads and {} concurrent publications".format(
+            len(self.cubes), self.max_concurrent_cubes, self.max_concurrent_uploads, self.max_concurrent_publishes
+        ))
+        self.upload_executor = ThreadPoolExecutor(max_workers=self.max_concurrent_uploads)
+        self.publish_executor = ThreadPoolExecutor(max_workers=self.max_concurrent_publishes)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrent_cubes) as cube_executor:
+                for future in [cube_executor.submit(self.refresh_cube, cube) for cube in self.cubes]:
+                    future.result()
+            for future in self.publish_futures:
+                future.result()
+        finally:
+            self.upload_executor.shutdown(wait=True)
+            self.publish_executor.shutdown(wait=True)
+            self.duration = time.perf_counter() - start_time
+        return self.get_reports()
+
+    def refresh_cube(self, cube):
+        uploader = None
+        try:
+            session = self.build_session()
+            cube.status = CUBE_STATUS_UPLOADING
+            with self.cube_timer(cube, "open"):
+                cube.dataset_id = open_replace_upload_session(
+                    session, self.project_id, cube.cube_name, self.table_name, cube.columns_names, cube.dss_columns_types, folder_id=self.folder_id
+                )
+            uploader = ChunkUploader(session, max_workers=self.max_concurrent_uploads, chunk_sizer=cube.chunk_sizer, metrics=self.metrics, executor=self.upload_executor)
+            with self.cube_timer(cube, "upload"):
+                self.upload_chunks(cube, uploader)
+                uploader.wait()
+        except Exception as error:
+            cube.fail(error)
+            if uploader:
+                uploader.abort()
+            return
+        logger.info("All {} rows of cube '{}' are uploaded, queuing its publication".format(cube.rows, cube.cube_name))
+        cube.publish_queued = time.perf_counter()
+        with self.publish_futures_lock:
+            self.publish_futures.append(self.publish_executor.submit(self.publish_cube, cube, session))
+
+    def upload_chunks(self, cube, uploader):
+        # Input chunks are cut and merged along the adaptive chunk size of the cube
+        pending_chunk = None
+        for chunk in cube.get_chunks():
+            if pending_chunk is not None:
+                chunk = concatenate_chunks(pending_chunk, chunk)
+            chunk_start = 0
+            while len(chunk) - chunk_start >= cube.chunk_sizer.chunk_rows:
+                chunk_end = chunk_start + cube.chunk_sizer.chunk_rows
+                self.push_rows(cube, uploader, slice_chunk(chunk, chunk_start, chunk_end))
+                chunk_start = chunk_end
+            pending_chunk = slice_chunk(chunk, chunk_start, len(chunk)) if chunk_start < len(chunk) else None
+        if pending_chunk is not None or not cube.rows:
+            # An empty input still sends one empty chunk
+            self.push_rows(cube, uploader, pending_chunk if pending_chunk is not None else [])
+
+    def push_rows(self, cube, uploader, rows):
+        uploader.push_rows(rows)
+        cube.rows += len(rows)
+        self.metrics.increment("rows", len(rows))
+
+    def publish_cube(self, cube, session):
+        try:
+            cube.add_time("publish_queue", time.perf_counter() - cube.publish_queued)
+            cube.status = CUBE_STATUS_PUBLISHING
+            with self.cube_timer(cube, "publish"):
+                publish_monitor = PublishMonitor(session, timeout=self.publish_timeout).publish()
+                if self.wait_for_publish:
+                    publish_monitor.wait()
+                    cube.status = CUBE_STATUS_PUBLISHED
+        except Exception as error:
+            cube.fail(error)
+
+    @contextmanager
+    def cube_timer(self, cube, phase):
+        # Times a phase of a cube, and adds it to the phase totals of the whole refresh
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - phase_start
+            cube.add_time(phase, duration)
+            self.metrics.add_time("cube_{}".format(phase), duration)
+
+    def get_reports(self):
+        return [cube.get_report() for cube in self.cubes]
+
+    def log_summary(self):
+        reports = self.get_reports()
+        for report in reports:
+            logger.info("Cube refresh {}".format(report))
+        # Time the same refreshes would take one after the other
+        sequential_duration = sum(sum(cube.phases.get(phase, 0.0) for phase in CUBE_PHASES if phase != "publish_queue") for cube in self.cubes)
+        logger.info("Refreshed {} cubes in {:.1f}s, {:.1f}s one after the other".format(len(self.cubes), self.duration or 0.0, sequential_duration))
+        return reports
+
+    def raise_on_failure(self):
+        failed_cubes = [cube for cube in self.cubes if cube.status == CUBE_STATUS_FAILED]
+        if failed_cubes:
+            raise Exception("Refresh failed for {} of {} cubes: {}".format(
+                len(failed_cubes), len(self.cubes), ", ".join("'{}' ({})".format(cube.cube_name, cube.error) for cube in failed_cubes)
+            ))
+
@@ -0,0 +1,210 @@
+import io
+import time
+import queue
+import logging
+import threading
+from mstr_metrics import ExportMetrics
+from mstr_publish import PublishMonitor, DEFAULT_PUBLISH_TIMEOUT
+from mstr_uploader import ChunkSizer, DEFAULT_MAX_CONCURRENT_UPLOADS, slice_chunk
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+DEFAULT_ENCODE_WORKERS = 2
+QUEUE_POLL_INTERVAL = 0.1
+END_OF_STREAM = None
+
+
+class BulkLoadPipeline(object):
+    """
+    Three stage pipeline feeding an open upload session: the caller's thread reads the input by chunks,
+    a pool of encoders builds the chunk bodies, and a pool of uploaders sends them over the pooled connections.
+    The stages are linked by bounded queues, so that the slowest stage sets the pace while the others
+    wait for room, instead of the three stages adding up.
+    """
+
+    def __init__(self, session, encode_workers=DEFAULT_ENCODE_WORKERS, upload_workers=DEFAULT_MAX_CONCURRENT_UPLOADS, queue_size=None,
+                 chunk_sizer=None, metrics=None, table_name=None):
+        self.session = session
+        self.encode_workers = max(1, int(encode_workers or 1))
+        self.upload_workers = max(1, int(upload_workers or 1))
+        self.queue_size = queue_size or 2 * max(self.encode_workers, self.upload_workers)
+        self.chunk_sizer = chunk_sizer or ChunkSizer()
+        self.metrics = metrics or ExportMetrics()
+        self.table_name = table_name
+        self.encode_queue = queue.Queue(maxsize=self.queue_size)
+        self.upload_queue = queue.Queue(maxsize=self.queue_size)
+        self.stopped = threading.Event()
+        self.error = None
+        self.threads = []
+        self.remaining_encoders = self.encode_workers
+        self.remaining_encoders_lock = threading.Lock()
+
+    def run(self, chunks):
+        # chunks is an iterable of DataFrames (or lists of rows) following the upload session's columns
+        self.start_workers()
+        try:
+            chunks = iter(chunks)
+            pending_chunk = None
+            while not self.stopped.is_set():
+                with self.metrics.timer("read"):
+                    chunk = next(chunks, END_OF_STREAM)
+                if chunk is END_OF_STREAM:
+                    break
+                pending_chunk = self.split_chunk(chunk, pending_chunk)
+            if pending_chunk is not None or not self.metrics.counters.get("chunks_read"):
+                # An empty input still sends one empty chunk, as the exporter does
+                self.submit_chunk(pending_chunk if pending_chunk is not None else [])
+        except Exception as error:
+            self.fail(error)
+        finally:
+            for worker_index in range(self.encode_workers):
+                self.put(self.encode_queue, END_OF_STREAM)
+            for thread in self.threads:
+                thread.join()
+        if self.error:
+            raise self.error
+
+    def split_chunk(self, chunk, pending_chunk):
+        # Input chunks are cut and merged along the adaptive chunk size
+        if pending_chunk is not None:
+            chunk = concatenate_chunks(pending_chunk, chunk)
+        # The size of the first chunks comes from an encoded sample, before any of them is submitted
+        self.chunk_sizer.calibrate(chunk, lambda sample: self.session.build_upload_chunk_body(sample, 0, output=io.BytesIO(), table_name=self.table_name)[1])
+        chunk_start = 0
+        while len(chunk) - chunk_start >= self.chunk_sizer.chunk_rows and not self.stopped.is_set():
+            chunk_end = chunk_start + self.chunk_sizer.chunk_rows
+            self.submit_chunk(slice_chunk(chunk, chunk_start, chunk_end))
+            chunk_start = chunk_end
+        return slice_chunk(chunk, chunk_start, len(chunk)) if chunk_start < len(chunk) else None
+
+    def submit_chunk(self, chunk):
+        index = self.session.upload_session_next_index(self.table_name)
+        self.metrics.increment("rows", len(chunk))
+        self.metrics.increment("chunks_read")
+        with self.metrics.timer("backpressure"):
+            self.put(self.encode_queue, (index, chunk))
+
+    def start_workers(self):
+        for worker_index in range(self.encode_workers):
+            self.start_thread(self.encode, "mstr-encoder-{}".format(worker_index))
+        for worker_index in range(self.upload_workers):
+            self.start_thread(self.upload, "mstr-uploader-{}".format(worker_index))
+
+    def start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def encode(self):
+        try:
+            while True:
+                item = self.get(self.encode_queue)
+                if item is END_OF_STREAM:
+                    break
+                index, chunk = item
+                with self.metrics.timer("encode"):
+                    # Each body goes to another thread, the per thread reusable buffer cannot be used
+                    body, body_size = self.session.build_upload_chunk_body(chunk, index, output=io.BytesIO(), table_name=self.table_name)
+                self.chunk_sizer.record(len(chunk), body_size)
+                with self.metrics.timer("encode_backpressure"):
+                    self.put(self.upload_queue, (index, body, body_size))
+        except Exception as error:
+            self.fail(error)
+        finally:
+            with self.remaining_encoders_lock:
+                self.remaining_encoders -= 1
+                is_last_encoder = self.remaining_encoders == 0
+            if is_last_encoder:
+                for worker_index in range(self.upload_workers):
+                    self.put(self.upload_queue, END_OF_STREAM)
+
+    def upload(self):
+        try:
+            while True:
+                item = self.get(self.upload_queue)
+                if item is END_OF_STREAM:
+                    break
+                index, body, body_size = item
+                push_start = time.perf_counter()
+                self.session.upload_session_push_body(body, index, table_name=self.table_name)
+                self.metrics.record_chunk(time.perf_counter() - push_start, body_size)
+        except Exception as error:
+            self.fail(error)
+
+    def fail(self, error):
+        if self.error is None:
+            logger.error("Bulk load failed: {}".format(error))
+            self.error = error
+        self.stopped.set()
+
+    def put(self, target_queue, item):
+        # Blocks while the next stage is busy, gives up when any stage failed
+        while not self.stopped.is_set():
+            try:
+                target_queue.put(item, timeout=QUEUE_POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def get(self, source_queue):
+        # After a failure, every worker stops as if the input had ended
+        while not self.stopped.is_set():
+            try:
+                return source_queue.get(timeout=QUEUE_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+        return END_OF_STREAM
+
+
+def bulk_load(session, project_id, dataset_name, columns_names, dss_columns_types, chunks, folder_id=None, table_name="dss_data",
+              encode_workers=DEFAULT_ENCODE_WORKERS, upload_workers=DEFAULT_MAX_CONCURRENT_UPLOADS, chunk_sizer=None, metrics=None,
+              wait_for_publish=True, publish_timeout=DEFAULT_PUBLISH_TIMEOUT):
+    """
+    Replaces the content of a cube with the given chunks (DataFrames or lists of rows), creating the cube if needed.
+    Can be called from any Python code with an MstrSession, for instance a scenario step.
+    Returns the metrics of the load.
+    """
+    metrics = metrics or ExportMetrics()
+    with metrics.timer("open"):
+        open_replace_upload_session(session, project_id, dataset_name, table_name, columns_names, dss_columns_types, folder_id=folder_id)
+    pipeline = BulkLoadPipeline(
+        session,
+        encode_workers=encode_workers,
+        upload_workers=upload_workers,
+        chunk_sizer=chunk_sizer,
+        metrics=metrics,
+        table_name=table_name
+    )
+    pipeline.run(chunks)
+    with metrics.timer("publish_request"):
+        publish_monitor = PublishMonitor(session, timeout=publish_timeout).publish()
+    if wait_for_publish:
+        publish_monitor.wait()
+        metrics.add_time("publish", publish_monitor.publish_duration)
+    else:
+        logger.info("Publication started, not waiting for it to complete.")
+    return metrics
+
+
+def open_replace_upload_session(session, project_id, dataset_name, table_name, columns_names, dss_columns_types, folder_id=None):
+    # Finds or creates the cube, empties it and opens an upload session replacing its data. Returns the dataset id
+    def replace_dataset(dataset_id):
+        if not dataset_id:
+            logger.info("Creating dataset '{}'".format(dataset_name))
+            dataset_id = session.create_dataset(project_id, dataset_name, table_name, columns_names, dss_columns_types, folder_id)
+        session.update_dataset([], project_id, dataset_id, table_name, columns_names, dss_columns_types, update_policy='replace')
+        schema = {"columns": [{"name": column_name} for column_name in columns_names]}
+        session.open_upload_session(project_id, dataset_id, table_name, schema, dss_columns_types, update_policy='replace')
+        return dataset_id
+    return session.run_on_dataset(project_id, dataset_name, replace_dataset, folder_id=folder_id)
+
+
+def concatenate_chunks(first_chunk, second_chunk):
+    if isinstance(first_chunk, list):
+        return first_chunk + list(second_chunk)
+    import pandas
+    return pandas.concat([first_chunk, second_chunk], ignore_index=True)
@@ -0,0 +1,171 @@
+import os
+import time
+import logging
+import threading
+from mstr_state import get_state_directory, build_state_key, load_json_state, save_json_state, delete_state_file
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+PUBLISH_STATUS_COMPLETED = 1
+PUBLISH_STATUS_COMPLETED_LABELS = ["completed", "complete", "published", "success", "succeeded", "ready"]
+PUBLISH_STATUS_FAILED_LABELS = ["failed", "failure", "error", "cancelled", "canceled"]
+DEFAULT_PUBLISH_TIMEOUT = 3600
+DEFAULT_INITIAL_POLL_INTERVAL = 0.5
+DEFAULT_MAX_POLL_INTERVAL = 10
+POLL_INTERVAL_GROWTH = 1.5
+
+
+class PublishTimeout(Exception):
+    pass
+
+
+class PublishMonitor(object):
+    """
+    Follows the server side publication of an upload session, polling publishStatus with a growing
+    interval until the cube is published or the publication failed.
+    start() polls from a background thread so that the caller can do other work in the meantime,
+    wait() blocks until the outcome is known.
+    follow() replaces publish() for a publication requested earlier, by another export for instance.
+    """
+
+    def __init__(self, session, timeout=DEFAULT_PUBLISH_TIMEOUT, initial_poll_interval=DEFAULT_INITIAL_POLL_INTERVAL, max_poll_interval=DEFAULT_MAX_POLL_INTERVAL,
+                 project_id=None, dataset_id=None, upload_session_id=None):
+        self.session = session
+        self.project_id = project_id or session.upload_session_project_id
+        self.dataset_id = dataset_id or session.upload_session_dataset_id
+        self.upload_session_id = upload_session_id or session.upload_session_id
+        self.timeout = timeout or DEFAULT_PUBLISH_TIMEOUT
+        self.initial_poll_interval = initial_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.publish_start = None
+        self.publish_duration = None
+        self.status = None
+        self.error = None
+        self.thread = None
+        self.finished = threading.Event()
+        self.callbacks = []
+        self.callbacks_lock = threading.Lock()
+
+    def publish(self):
+        self.publish_start = time.time()
+        self.session.publish_upload_session()
+        return self
+
+    def follow(self):
+        self.publish_start = time.time()
+        return self
+
+    def start(self):
+        if self.publish_start is None:
+            self.publish()
+        self.thread = threading.Thread(target=self.run, name="mstr-publish-monitor")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def run(self):
+        try:
+            self.status = self.poll()
+        except Exception as error:
+            self.error = error
+        finally:
+            self.publish_duration = time.time() - self.publish_start
+            with self.callbacks_lock:
+                self.finished.set()
+                callbacks, self.callbacks = self.callbacks, []
+            for callback in callbacks:
+                self.run_callback(callback)
+
+    def add_done_callback(self, callback):
+        # The callback gets the monitor once the outcome is known, from the polling thread
+        with self.callbacks_lock:
+            if not self.finished.is_set():
+                self.callbacks.append(callback)
+                return
+        self.run_callback(callback)
+
+    def run_callback(self, callback):
+        try:
+            callback(self)
+        except Exception as error_message:
+            logger.warning("Publication callback failed: {}".format(error_message))
+
+    def poll(self):
+        poll_interval = self.initial_poll_interval
+        deadline = self.publish_start + self.timeout
+        while True:
+            status = self.session.get_publish_status(self.project_id, self.dataset_id, self.upload_session_id)
+            if is_publish_completed(status):
+                return status
+            if is_publish_failed(status):
+                raise Exception("Publication of dataset {} failed: {}".format(self.dataset_id, status))
+            remaining_time = deadline - time.time()
+            if remaining_time <= 0:
+                raise PublishTimeout("Publication of dataset {} did not complete within {}s, last status was {}".format(self.dataset_id, self.timeout, status))
+            time.sleep(min(poll_interval, remaining_time))
+            poll_interval = min(self.max_poll_interval, poll_interval * POLL_INTERVAL_GROWTH)
+
+    def done(self):
+        return self.finished.is_set()
+
+    def is_completed(self):
+        return self.done() and self.error is None
+
+    def wait(self):
+        if self.thread is None:
+            self.start()
+        self.finished.wait()
+        if self.error:
+            raise self.error
+        logger.info("Dataset {} published in {:.1f}s".format(self.dataset_id, self.publish_duration))
+        return self.status
+
+
+class PendingPublication(object):
+    """
+    Publication that an export requested without waiting for its outcome. The export state that is only valid
+    once the data is published (incremental state, checkpoint, target fingerprint) is committed when the
+    publication is seen completed: by the monitor of that export if its process is still running,
+    otherwise by the next export to the same target, before it reads that state.
+    """
+
+    def __init__(self, target_key_parts):
+        self.state_path = os.path.join(get_state_directory("publications"), "{}.json".format(build_state_key(*target_key_parts)))
+
+    def save(self, publish_monitor, **details):
+        details.update({
+            "project_id": publish_monitor.project_id,
+            "dataset_id": publish_monitor.dataset_id,
+            "upload_session_id": publish_monitor.upload_session_id,
+            "requested": publish_monitor.publish_start
+        })
+        save_json_state(self.state_path, details)
+
+    def load(self):
+        return load_json_state(self.state_path)
+
+    def forget(self):
+        delete_state_file(self.state_path)
+
+
+def get_status_value(status):
+    if isinstance(status, dict):
+        return status.get("status")
+    return status
+
+
+def is_publish_completed(status):
+    status_value = get_status_value(status)
+    if isinstance(status_value, str):
+        return status_value.lower() in PUBLISH_STATUS_COMPLETED_LABELS
+    return status_value == PUBLISH_STATUS_COMPLETED
+
+
+def is_publish_failed(status):
+    status_value = get_status_value(status)
+    if isinstance(status_value, str):
+        return status_value.lower() in PUBLISH_STATUS_FAILED_LABELS
+    return isinstance(status_value, int) and status_value < 0
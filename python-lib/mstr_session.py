@@ -1,58 +1,32 @@
 import logging
-import requests
-import json
-import pandas
-from base64 import b64encode
-from mstr_auth import MstrAuth
-from dateutil.parser import parse
+import threading
+from collections import OrderedDict
+from mstr_client import MstrClient, assert_response_ok, safe_json_extract, get_base_url  # noqa: F401
+from mstr_encoding import encode_rows, convert_rows_to_data, build_dataframe, write_upload_chunk_body_from_dataframe, get_body_buffer, finalize_body_buffer
 
 
 logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
 logger = logging.getLogger()
 
 
-SEARCH_PATTERN_EXACT = 2
-OBJECT_TYPE_CUBE_DATASET = 3
-DSS_DATETIME_PATTERN = "%Y-%m-%dT%H:%M:%S.%fZ"
+# Client errors that polling again may clear, any other one means the publication cannot be followed
+PUBLISH_STATUS_TRANSIENT_CLIENT_ERRORS = [408, 429]
 
 
-class MstrSession(object):
-    def __init__(self, server_url, username, password, generate_verbose_logs=False):
-        if not server_url:
-            raise Exception("No valid URL to the for Microstrategy server has been selected")
-        self.server_url = parse_server_url(server_url)
-        self.username = username
-        self.password = password
-        self.auth = None
-        self.requests_verify = False
-        self.generate_verbose_logs = generate_verbose_logs
-        self.auth = MstrAuth(server_url, username, password)
+class MstrSession(MstrClient):
+    """
+    Client able to create datasets and to send their data through upload sessions.
+    """
+
+    def __init__(self, server_url, username, password, generate_verbose_logs=False, transport=None, metadata_cache=None, token_manager=None):
+        super(MstrSession, self).__init__(
+            server_url, username, password, generate_verbose_logs=generate_verbose_logs, transport=transport, metadata_cache=metadata_cache, token_manager=token_manager
+        )
         self.upload_session_id = None
         self.upload_session_dataset_id = None
         self.upload_session_project_id = None
         self.upload_session_table_name = None
-        self.upload_session_column_headers = None
-        self.upload_session_index = None
-
-    def get(self, url=None, headers=None, params=None):
-        headers = headers or {}
-        response = requests.get(url=url, headers=headers, params=params, verify=self.requests_verify, auth=self.auth)
-        return response
-
-    def post(self, url=None, headers=None, params=None, json=None):
-        headers = headers or {}
-        response = requests.post(url=url, json=json, headers=headers, params=params, verify=self.requests_verify, auth=self.auth)
-        return response
-
-    def patch(self, url=None, headers=None, json=None):
-        headers = headers or {}
-        response = requests.patch(url=url, headers=headers, json=json, verify=self.requests_verify, auth=self.auth)
-        return response
-
-    def put(self, url=None, headers=None, json=None):
-        headers = headers or {}
-        response = requests.put(url=url, headers=headers, json=json, verify=self.requests_verify, auth=self.auth)
-        return response
+        self.upload_session_tables = OrderedDict()
 
     def update_dataset(self, rows, project_id, dataset_id, table_name, schema, dss_columns_types, update_policy='replace', can_raise=True):
         url = "{}/datasets/{}/tables/{}".format(self.server_url, dataset_id, table_name)
@@ -62,83 +36,89 @@ class MstrSession(object):
         assert_response_ok(response, generate_verbose_logs=self.generate_verbose_logs, can_raise=can_raise)
         return response
 
-    def open_upload_session(self, project_id, dataset_id, table_name, schema, dss_columns_types, update_policy='replace', can_raise=True):
+    def open_upload_session(self, project_id, dataset_id, table_name, schema, dss_columns_types, update_policy='replace', can_raise=True, next_index=1):
+        upload_table = UploadTable(table_name, get_columns_names(schema), dss_columns_types, next_index=next_index)
+        return self.open_multi_table_upload_session(project_id, dataset_id, [upload_table], update_policy=update_policy, can_raise=can_raise)
+
+    def open_multi_table_upload_session(self, project_id, dataset_id, upload_tables, update_policy='replace', can_raise=True):
         logger.info("Requesting upload session id")
         url = "{}/datasets/{}/uploadSessions".format(self.server_url, dataset_id)
         headers = self.build_headers(project_id, update_policy=update_policy)
-        json = self.build_upload_session_json(table_name, schema)
+        json = self.build_upload_session_json(upload_tables, update_policy=update_policy)
         response = self.post(url=url, headers=headers, json=json)
         assert_response_ok(response, generate_verbose_logs=self.generate_verbose_logs, can_raise=can_raise)
         json_response = safe_json_extract(response, {})
         upload_session_id = json_response.get("uploadSessionId")
         if upload_session_id:
             logger.info("upload session id obtained: {}".format(upload_session_id))
-            self.upload_session_id = upload_session_id
         elif can_raise:
             raise ValueError("Could not obtain an upload session id")
+        self.set_upload_session(upload_session_id, project_id, dataset_id, upload_tables)
+        return upload_session_id
+
+    def resume_upload_session(self, upload_session_id, project_id, dataset_id, table_name, schema, dss_columns_types, next_index):
+        logger.info("Resuming upload session {}".format(upload_session_id))
+        upload_table = UploadTable(table_name, get_columns_names(schema), dss_columns_types, next_index=next_index)
+        self.set_upload_session(upload_session_id, project_id, dataset_id, [upload_table])
+        return upload_session_id
+
+    def set_upload_session(self, upload_session_id, project_id, dataset_id, upload_tables):
+        self.upload_session_id = upload_session_id
         self.upload_session_dataset_id = dataset_id
         self.upload_session_project_id = project_id
-        self.upload_session_index = 1
-        self.upload_session_table_name = table_name
-        self.upload_session_dss_columns_types = dss_columns_types
-        return upload_session_id
+        self.upload_session_tables = OrderedDict((upload_table.name, upload_table) for upload_table in upload_tables)
+        # Calls without a table name target the first table
+        self.upload_session_table_name = upload_tables[0].name
 
-    def build_upload_session_json(self, table_name, schema):
-        columns = schema.get("columns", [])
-        column_headers = []
-        for column in columns:
-            column_name = column.get("name")
-            column_headers.append(column_name)
+    def get_upload_table(self, table_name=None):
+        return self.upload_session_tables[table_name or self.upload_session_table_name]
 
+    def build_upload_session_json(self, upload_tables, update_policy='replace'):
         json = {
             "tables": [
                 {
-                    "name": "{}".format(table_name),
-                    "updatePolicy": "REPLACE",
+                    "name": "{}".format(upload_table.name),
+                    "updatePolicy": update_policy.upper(),
                     "orientation": "ROW",
-                    "columnHeaders": column_headers
-                }
+                    "columnHeaders": upload_table.columns_names
+                } for upload_table in upload_tables
             ]
         }
-        self.upload_session_column_headers = column_headers
         return json
 
-    def upload_session_push_rows(self, rows):
-        encoded_rows = self.encode_rows(rows)
+    def upload_session_next_index(self, table_name=None):
+        return self.get_upload_table(table_name).reserve_index()
+
+    def upload_session_push_rows(self, rows, index=None, table_name=None):
+        if index is None:
+            index = self.upload_session_next_index(table_name)
+        body, body_size = self.build_upload_chunk_body(rows, index, table_name=table_name)
+        return self.upload_session_push_body(body, index, table_name=table_name)
+
+    def filter_rows(self, rows, rows_filter, table_name=None):
+        return rows_filter(build_dataframe(rows, self.get_upload_table(table_name).columns_names))
+
+    def build_upload_chunk_body(self, rows, index, output=None, table_name=None):
+        upload_table = self.get_upload_table(table_name)
+        output = output or get_body_buffer()
+        dataframe = build_dataframe(rows, upload_table.columns_names)
+        write_upload_chunk_body_from_dataframe(output, dataframe, upload_table.dss_columns_types, upload_table.name, index)
+        body_size = finalize_body_buffer(output)
+        return output, body_size
+
+    def upload_session_push_body(self, body, index, table_name=None):
         url = "{}/datasets/{}/uploadSessions/{}".format(self.server_url, self.upload_session_dataset_id, self.upload_session_id)
         headers = self.build_headers(self.upload_session_project_id)
-        data = {
-            "tableName": "{}".format(self.upload_session_table_name),
-            "index": self.upload_session_index,
-            "data": encoded_rows
-        }
-        self.upload_session_index = self.upload_session_index + 1
-        response = self.put(url=url, headers=headers, json=data)
-        assert_response_ok(response, context="adding a chunk during an upload session", generate_verbose_logs=self.generate_verbose_logs)
+        headers["Content-Type"] = "application/json"
+        # The chunk uploads are the calls whose number in flight adapts to the load of the server
+        response = self.put(url=url, headers=headers, data=body, concurrency_limited=True)
+        context = "adding chunk {}{} during an upload session".format(index, " of table {}".format(table_name) if table_name else "")
+        assert_response_ok(response, context=context, generate_verbose_logs=self.generate_verbose_logs)
         return response
 
-    def encode_rows(self, rows):
-        upload_rows = []
-        for row in rows:
-            upload_row = []
-            for header, item_type in zip(self.upload_session_column_headers, self.upload_session_dss_columns_types):
-                item_value = row.get(header)
-                value_type = type(item_value)
-                if item_type == "string":
-                    if type(item_value) != str:
-                        item_value = ""
-                elif item_type == "date":
-                    if value_type != pandas._libs.tslibs.timestamps.Timestamp:
-                        if not validate_date(item_value):
-                            item_value = None
-                    else:
-                        item_value = item_value.strftime(DSS_DATETIME_PATTERN)
-                elif item_type == "boolean":
-                    pass
-                upload_row.append(item_value)
-            upload_rows.append(upload_row)
-        encoded_rows = b64encode(json.dumps(upload_rows, separators=(',', ':')).encode('utf-8')).decode("utf-8")
-        return encoded_rows
+    def encode_rows(self, rows, table_name=None):
+        upload_table = self.get_upload_table(table_name)
+        return encode_rows(rows, upload_table.columns_names, upload_table.dss_columns_types)
 
     def publish_upload_session(self):
         url = "{}/datasets/{}/uploadSessions/{}/publish".format(self.server_url, self.upload_session_dataset_id, self.upload_session_id)
@@ -148,125 +128,45 @@ class MstrSession(object):
         return response
 
     def upload_session_publish_status(self):
-        url = "{}/datasets/{}/uploadSessions/{}/publishStatus".format(self.server_url, self.upload_session_dataset_id, self.upload_session_id)
-        headers = self.build_headers(self.upload_session_project_id)
+        return self.get_publish_status(self.upload_session_project_id, self.upload_session_dataset_id, self.upload_session_id)
+
+    def get_publish_status(self, project_id, dataset_id, upload_session_id):
+        url = "{}/datasets/{}/uploadSessions/{}/publishStatus".format(self.server_url, dataset_id, upload_session_id)
+        headers = self.build_headers(project_id)
         response = self.get(url=url, headers=headers)
-        assert_response_ok(response, context="getting the session's publishing status", can_raise=False, generate_verbose_logs=self.generate_verbose_logs)
+        is_final_error = 400 <= response.status_code < 500 and response.status_code not in PUBLISH_STATUS_TRANSIENT_CLIENT_ERRORS
+        assert_response_ok(response, context="getting the session's publishing status", can_raise=is_final_error, generate_verbose_logs=self.generate_verbose_logs)
         json_response = safe_json_extract(response)
         logger.info("Publishing status is {}".format(json_response))
         return json_response
 
-    def get_project_list(self):
-        url = "{}/projects".format(self.server_url)
-        response = self.get(url=url)
-        assert_response_ok(response, generate_verbose_logs=self.generate_verbose_logs)
-        projects_list = safe_json_extract(response, default=[])
-        return projects_list
-
-    def get_dataset_id(self, project_id, searched_dataset_name, folder_id=None):
-        dataset_id = None
-        match_found = False
-
-        url = "{}/searches/results".format(self.server_url)
-        params = {
-            "name": "{}".format(searched_dataset_name),
-            "pattern": SEARCH_PATTERN_EXACT,
-            "type": OBJECT_TYPE_CUBE_DATASET
-        }
-        if folder_id:
-            params["root"] = folder_id
-            params["getAncestors"] = True
-        response = self.get(
-            url=url,
-            headers=self.build_headers(project_id),
-            params=params
-        )
-        assert_response_ok(response, context="searching for dataset '{}'".format(searched_dataset_name), generate_verbose_logs=self.generate_verbose_logs)
-
-        search_results = safe_json_extract(response)
-        datasets = search_results.get("result", [])
-        logger.info("Found {} datasets".format(len(datasets)))
-        for dataset in datasets:
-            dataset_name = dataset.get("name")
-            if dataset_name == searched_dataset_name:
-                if folder_id:
-                    ancestor_id = self.get_ancestor_id(dataset)
-                    if ancestor_id != folder_id:
-                        continue
-                dataset_id = dataset.get("id")
-                if match_found:
-                    raise Exception("Found more than one dataset named {} on your MicroStrategy instance".format(searched_dataset_name))
-                else:
-                    match_found = True
-
-        return dataset_id
-
-    def get_ancestor_id(self, dataset):
-        ancestor_id = None
-        ancestors = dataset.get("ancestors", [])
-        if ancestors:
-            ancestor = ancestors[-1]
-            ancestor_id = ancestor.get("id")
-        return ancestor_id
-
-    def get_projects(self):
-        url = "{}/projects".format(self.server_url)
-        response = self.get(
-            url=url
-        )
-        search_result = safe_json_extract(response)
-        return search_result
-
-    def get_project_id(self, project_name):
-        projects_list = self.get_project_list()
-        project_id = None
-        for project in projects_list:
-            if project["name"] == project_name:
-                project_id = project["id"]
-                return project_id
-
-        if not project_id:
-            raise ValueError("Project '{}' could not be found on this server.".format(project_name))
-
-    def get_shared_folders(self, project_id):
-        if not project_id:
-            return []
-        url = "{}/folders/preDefined/7".format(self.server_url)
-        response = self.get(
-            url=url,
-            headers=self.build_headers(project_id)
-        )
-        search_result = safe_json_extract(response)
-        return search_result
-
-    def get_folder(self, project_id, parent_folder_id):
-        if not project_id:
-            return []
-        url = "{}/folders/{}".format(self.server_url, parent_folder_id)
-        response = self.get(
-            url=url,
-            headers=self.build_headers(project_id)
-        )
-        search_result = safe_json_extract(response)
-        return search_result
-
     def create_dataset(self, project_id, dataset_name, table_name, columns_names, columns_types, folder_id=None):
-        json = self.build_dataset_create_json(dataset_name, table_name, columns_names, columns_types, [], folder_id=folder_id)
+        upload_table = UploadTable(table_name, columns_names, columns_types)
+        return self.create_multi_table_dataset(project_id, dataset_name, [upload_table], folder_id=folder_id)
+
+    def create_multi_table_dataset(self, project_id, dataset_name, upload_tables, folder_id=None):
+        json = self.build_dataset_create_json(dataset_name, upload_tables, folder_id=folder_id)
         url = "{}/datasets".format(self.server_url)
         headers = self.build_headers(project_id)
         response = self.post(url=url, headers=headers, json=json)
         assert_response_ok(response, generate_verbose_logs=self.generate_verbose_logs)
         json_response = safe_json_extract(response)
         datatset_id = json_response.get("datasetId")
+        self.invalidate_dataset_id(project_id)
+        if folder_id:
+            self.metadata_cache.invalidate(self.build_cache_key("folders", project_id, folder_id))
+        if datatset_id:
+            self.metadata_cache.set(self.build_dataset_id_cache_key(project_id, dataset_name, folder_id), datatset_id)
         return datatset_id
 
-    def build_dataset_create_json(self, project_name, table_name, columns_names, columns_types, rows, folder_id=None):
-        table_dictionary = self.build_table_update_json(table_name, columns_names, columns_types, rows)
-
-        attributes, metrics = self.build_attributes_and_metrics(table_name, columns_names, columns_types)
+    def build_dataset_create_json(self, project_name, upload_tables, folder_id=None):
+        tables = [
+            self.build_table_update_json(upload_table.name, upload_table.columns_names, upload_table.dss_columns_types, []) for upload_table in upload_tables
+        ]
+        attributes, metrics = self.build_attributes_and_metrics(upload_tables)
         dataset_dictionary = {
             "name": project_name,
-            "tables": [table_dictionary],
+            "tables": tables,
             "attributes": attributes,
             "metrics": metrics
         }
@@ -274,15 +174,24 @@ class MstrSession(object):
             dataset_dictionary["folderId"] = folder_id
         return dataset_dictionary
 
-    def build_attributes_and_metrics(self, table_name, columns_names, columns_types):
-        attributes = []
+    def build_attributes_and_metrics(self, upload_tables):
+        # Columns found in several tables are the keys joining them: one attribute, with one expression per table
+        tables_count_per_column = {}
+        for upload_table in upload_tables:
+            for column_name in set(upload_table.columns_names):
+                tables_count_per_column[column_name] = tables_count_per_column.get(column_name, 0) + 1
+        attributes = OrderedDict()
         metrics = []
-        for column_name, column_type in zip(columns_names, columns_types):
-            if convert_type(column_type) in ['INTEGER', 'DOUBLE']:
-                metrics.append(self.build_metric(table_name, column_name))
-            else:
-                attributes.append(self.build_attribute(table_name, column_name))
-        return attributes, metrics
+        for upload_table in upload_tables:
+            for column_name, column_type in zip(upload_table.columns_names, upload_table.dss_columns_types):
+                is_key = tables_count_per_column[column_name] > 1
+                if convert_type(column_type) in ['INTEGER', 'DOUBLE'] and not is_key:
+                    metrics.append(self.build_metric(upload_table.name, column_name))
+                elif column_name in attributes:
+                    attributes[column_name]["attributeForms"][0]["expressions"].append(self.build_expression(upload_table.name, column_name))
+                else:
+                    attributes[column_name] = self.build_attribute(upload_table.name, column_name)
+        return list(attributes.values()), metrics
 
     def build_attribute(self, table_name, column_name):
         return {
@@ -290,9 +199,7 @@ class MstrSession(object):
             "attributeForms": [
                 {
                     "category": "ID",
-                    "expressions": [{
-                        "formula": "{}.{}".format(table_name, column_name)
-                    }]
+                    "expressions": [self.build_expression(table_name, column_name)]
                 }
             ]
         }
@@ -301,9 +208,12 @@ class MstrSession(object):
         return {
             "name": column_name,
             "dataType": "number",
-            "expressions": [{
-                "formula": "{}.{}".format(table_name, column_name)
-            }]
+            "expressions": [self.build_expression(table_name, column_name)]
+        }
+
+    def build_expression(self, table_name, column_name):
+        return {
+            "formula": "{}.{}".format(table_name, column_name)
         }
 
     def build_table_update_json(self, table_name, columns_names, columns_types, rows):
@@ -313,14 +223,6 @@ class MstrSession(object):
             "data": convert_rows_to_data(rows, columns_types)
         }
 
-    def build_headers(self, project_id, update_policy=None):
-        headers = {
-            "X-MSTR-ProjectID": project_id,
-        }
-        if update_policy:
-            headers["updatePolicy"] = update_policy
-        return headers
-
     def get_column_header(self, columns_names, columns_types):
         mstr_columns = []
         for column_name, column_type in zip(columns_names, columns_types):
@@ -332,6 +234,29 @@ class MstrSession(object):
         return mstr_columns
 
 
+class UploadTable(object):
+    """
+    One table of a cube and of its upload session: the columns sent, and the index of its next data chunk.
+    """
+
+    def __init__(self, name, columns_names, dss_columns_types, next_index=1):
+        self.name = name
+        self.columns_names = list(columns_names)
+        self.dss_columns_types = list(dss_columns_types)
+        self.next_index = next_index
+        self.lock = threading.Lock()
+
+    def reserve_index(self):
+        with self.lock:
+            index = self.next_index
+            self.next_index += 1
+            return index
+
+
+def get_columns_names(schema):
+    return [column.get("name") for column in schema.get("columns", [])]
+
+
 def convert_name(dss_name):
     mstr_name = dss_name
     return mstr_name
@@ -358,82 +283,3 @@ def convert_type(dss_type):
     DEFAULT_TYPE = "STRING"
     mstr_type = DSS_TO_MSTR_TYPES.get(dss_type, DEFAULT_TYPE)
     return mstr_type
-
-
-def convert_rows_to_data(rows, columns_types):
-    output_rows = []
-    for row in rows:
-        mstr_row = {}
-        for item_key, item_type in zip(row, columns_types):
-            item_value = row.get(item_key)
-            value_type = type(item_value)
-            if item_type == "string":
-                if type(item_value) != str:
-                    item_value = ""
-            elif item_type == "date":
-                if value_type != pandas._libs.tslibs.timestamps.Timestamp:
-                    if not validate_date(item_value):
-                        item_value = None
-                else:
-                    item_value = item_value.strftime(DSS_DATETIME_PATTERN)
-            elif item_type == "boolean":
-                pass
-            mstr_row[item_key] = item_value
-        output_rows.append(mstr_row)
-    encoded_rows = b64encode(json.dumps(output_rows, separators=(',', ':')).encode('utf-8')).decode("utf-8")
-    return encoded_rows
-
-
-def assert_response_ok(response, context=None, can_raise=True, generate_verbose_logs=False):
-    error_message = ""
-    error_context = " while {} ".format(context) if context else ""
-    if not isinstance(response, requests.models.Response):
-        error_message = "Did not return a valide response"
-    else:
-        status_code = response.status_code
-        if status_code >= 400:
-            error_message = "Error {}{}".format(status_code, error_context)
-            json_content = ""
-            message = ""
-            json_content = safe_json_extract(response, default={})
-            message = json_content.get("message")
-            content = response.content
-            if message:
-                error_message += ". " + message
-            elif json_content:
-                error_message += ". " + json_content
-            logger.error(error_message)
-            logger.error(content)
-    if error_message and can_raise:
-        if generate_verbose_logs:
-            logger.error("last requests url={}, body={}".format(response.request.url, response.request.body))
-        raise Exception(error_message)
-    return error_message
-
-
-def safe_json_extract(response, default=None):
-    json = default
-    try:
-        json = response.json()
-    except Exception as error_message:
-        logging.error("Error '{}' while decoding json".format(error_message))
-    return json
-
-
-def parse_server_url(raw_url):
-    return raw_url.strip("/")
-
-
-def validate_date(date_text):
-    try:
-        parse(date_text)
-    except Exception:
-        return False
-    return True
-
-
-def get_base_url(config, plugin_config):
-    microstrategy_api = config.get("microstrategy_api", {})
-    override_url = microstrategy_api.get("override_url")
-    base_url = plugin_config.get("base_url", None)
-    return override_url or base_url
@@ -0,0 +1,59 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+STATE_DIRECTORY_ENVIRONMENT_VARIABLE = "MSTR_PLUGIN_STATE_DIR"
+DEFAULT_STATE_DIRECTORY = os.path.join("~", ".dss-plugin-microstrategy")
+
+
+def get_state_directory(*sub_directories):
+    base_directory = os.environ.get(STATE_DIRECTORY_ENVIRONMENT_VARIABLE) or os.path.expanduser(DEFAULT_STATE_DIRECTORY)
+    state_directory = os.path.join(base_directory, *sub_directories)
+    if not os.path.isdir(state_directory):
+        os.makedirs(state_directory, mode=0o700, exist_ok=True)
+    return state_directory
+
+
+def build_state_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+
+def load_json_state(file_path, default=None):
+    if not os.path.isfile(file_path):
+        return default
+    try:
+        with open(file_path, "r") as state_file:
+            return json.load(state_file)
+    except Exception as error_message:
+        logger.warning("Ignoring unreadable state file {}: {}".format(file_path, error_message))
+        return default
+
+
+def save_json_state(file_path, content):
+    write_state_file(file_path, json.dumps(content, sort_keys=True).encode("utf-8"))
+
+
+def write_state_file(file_path, content):
+    # Written next to the target then renamed, so that concurrent readers never see a partial file
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=".tmp-")
+    try:
+        with os.fdopen(file_descriptor, "wb") as state_file:
+            state_file.write(content)
+        os.chmod(temporary_path, 0o600)
+        os.replace(temporary_path, file_path)
+    except Exception:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def delete_state_file(file_path):
+    if os.path.isfile(file_path):
+        os.remove(file_path)
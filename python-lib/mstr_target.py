@@ -0,0 +1,40 @@
+import os
+import time
+import logging
+from mstr_state import get_state_directory, build_state_key, load_json_state, save_json_state, delete_state_file
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+class TargetFingerprint(object):
+    """
+    Remembers the dataset id of a target cube and the fingerprint of the schema last exported to it.
+    While both are unchanged, an export can skip the dataset search and the schema replacing call,
+    and open its upload session straight away.
+    """
+
+    def __init__(self, target_key_parts, schema_fingerprint):
+        self.schema_fingerprint = schema_fingerprint
+        self.state_path = os.path.join(get_state_directory("targets"), "{}.json".format(build_state_key(*target_key_parts)))
+        self.state = load_json_state(self.state_path, default={})
+
+    def get_known_dataset_id(self):
+        if not self.state.get("dataset_id"):
+            return None
+        if self.state.get("schema_fingerprint") != self.schema_fingerprint:
+            logger.info("Schema changed since the last export to this dataset")
+            return None
+        return self.state.get("dataset_id")
+
+    def save(self, dataset_id):
+        self.state = {"dataset_id": dataset_id, "schema_fingerprint": self.schema_fingerprint, "updated": time.time()}
+        try:
+            save_json_state(self.state_path, self.state)
+        except Exception as error_message:
+            logger.warning("Could not save the target dataset state: {}".format(error_message))
+
+    def forget(self):
+        self.state = {}
+        delete_state_file(self.state_path)
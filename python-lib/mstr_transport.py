@@ -0,0 +1,310 @@
+import time
+import random
+import logging
+import requests
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+from mstr_metrics import ExportMetrics
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 30
+DEFAULT_READ_TIMEOUT = 300
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_NON_IDEMPOTENT_MAX_RETRIES = 2
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_MAX_BACKOFF = 30
+IDEMPOTENT_METHODS = ["GET", "HEAD", "OPTIONS", "PUT", "DELETE"]
+RETRYABLE_STATUS_CODES = [408, 429, 500, 502, 503, 504]
+# Answers guaranteeing that the server did not act on the request, safe to retry whatever the method
+NOT_PROCESSED_STATUS_CODES = [429, 503]
+THROTTLING_STATUS_CODES = [429, 503]
+DEFAULT_LATENCY_TOLERANCE = 2.0
+DEFAULT_DECREASE_FACTOR = 0.5
+DEFAULT_LATENCY_DECREASE_FACTOR = 0.8
+LATENCY_SMOOTHING = 0.2
+BASELINE_LATENCY_DRIFT = 0.01
+# Under this latency, variations are noise rather than a sign of overload
+MIN_BASELINE_LATENCY = 0.05
+
+
+class MstrTransport(object):
+    """
+    Persistent HTTP transport shared by the MicroStrategy API clients.
+    Connections are kept alive and pooled, so that consecutive calls to the same server skip the TCP and TLS handshakes.
+    The time spent in each call, retries included, is added to the "http" phase of the metrics, or to the given phase.
+    Calls made with concurrency_limited, such as the chunk uploads, wait for a slot of the concurrency limiter, if any.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT, retry_policy=None, metrics=None,
+                 concurrency_limiter=None):
+        self.pool_size = max(1, int(pool_size or DEFAULT_POOL_SIZE))
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.concurrency_limiter = concurrency_limiter
+        self.metrics = metrics or ExportMetrics()
+        self.statistics_lock = threading.Lock()
+        self.statistics = {"requests": 0, "retries": 0, "reauthentications": 0}
+        self.timeout = (connect_timeout or DEFAULT_CONNECT_TIMEOUT, read_timeout or DEFAULT_READ_TIMEOUT)
+        self.session = requests.Session()
+        # Auth cookies are set explicitly by MstrAuth, the jar must not leak them between users sharing this transport
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.session.headers["Connection"] = "keep-alive"
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, timeout=None, idempotent=None, auth=None, data=None, phase="http", concurrency_limited=False, **kwargs):
+        with self.metrics.timer(phase):
+            return self.send_with_retries(method, url, timeout=timeout, idempotent=idempotent, auth=auth, data=data, concurrency_limited=concurrency_limited, **kwargs)
+
+    def send_with_retries(self, method, url, timeout=None, idempotent=None, auth=None, data=None, concurrency_limited=False, **kwargs):
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        body_position = data.tell() if hasattr(data, "seek") else None
+        reauthenticated = False
+        attempt = 0
+        while True:
+            if body_position is not None:
+                data.seek(body_position)
+            self.increment_statistic("requests")
+            try:
+                response = self.send(method, url, concurrency_limited, timeout=timeout or self.timeout, auth=auth, data=data, **kwargs)
+            except requests.exceptions.RequestException as error:
+                if not self.retry_policy.should_retry(attempt, idempotent, error=error):
+                    raise
+                self.wait_before_retry(method, url, attempt, "{}".format(error))
+                attempt += 1
+                continue
+            if response.status_code == 401 and not reauthenticated and hasattr(auth, "refresh"):
+                # Expired session token: log in again once, then replay the call
+                logger.warning("{} {} returned 401, authenticating again".format(method, url))
+                auth.refresh(response.request.headers.get("X-MSTR-AuthToken"))
+                self.increment_statistic("reauthentications")
+                reauthenticated = True
+                continue
+            if not self.retry_policy.should_retry(attempt, idempotent, response=response):
+                return response
+            self.wait_before_retry(method, url, attempt, "status {}".format(response.status_code), retry_after=get_retry_after(response))
+            attempt += 1
+
+    def send(self, method, url, concurrency_limited, **kwargs):
+        if not (concurrency_limited and self.concurrency_limiter):
+            return self.session.request(method, url, **kwargs)
+        payload_size = get_payload_size(kwargs.get("data"))
+        ticket = self.concurrency_limiter.acquire()
+        request_start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.Timeout:
+            self.concurrency_limiter.release(ticket, is_throttled=True)
+            raise
+        except Exception:
+            self.concurrency_limiter.release(ticket)
+            raise
+        is_throttled = response.status_code in THROTTLING_STATUS_CODES
+        retry_after = get_retry_after(response) if is_throttled else None
+        self.concurrency_limiter.release(
+            ticket,
+            latency=time.perf_counter() - request_start,
+            payload_size=payload_size,
+            is_throttled=is_throttled,
+            retry_after=min(retry_after, self.retry_policy.max_backoff) if retry_after is not None else None
+        )
+        with self.statistics_lock:
+            self.statistics.update(self.concurrency_limiter.get_statistics())
+        return response
+
+    def wait_before_retry(self, method, url, attempt, reason, retry_after=None):
+        delay = self.retry_policy.get_backoff(attempt, retry_after=retry_after)
+        self.increment_statistic("retries")
+        logger.warning("{} {} failed ({}), retry {} in {:.1f}s".format(method, url, reason, attempt + 1, delay))
+        time.sleep(delay)
+
+    def increment_statistic(self, name):
+        with self.statistics_lock:
+            self.statistics[name] += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with full jitter. Idempotent calls (GET, PUT of an indexed chunk...) are retried
+    on connection errors and on transient server errors. Other calls are only retried when the server
+    cannot have processed them: failed connections, 429 and 503 answers.
+    """
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, non_idempotent_max_retries=DEFAULT_NON_IDEMPOTENT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR, max_backoff=DEFAULT_MAX_BACKOFF):
+        self.max_retries = max_retries
+        self.non_idempotent_max_retries = min(non_idempotent_max_retries, max_retries)
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+    def should_retry(self, attempt, idempotent, response=None, error=None):
+        max_retries = self.max_retries if idempotent else self.non_idempotent_max_retries
+        if attempt >= max_retries:
+            return False
+        if error is not None:
+            if isinstance(error, requests.exceptions.ConnectTimeout):
+                return True
+            if idempotent:
+                return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+            return False
+        if idempotent:
+            return response.status_code in RETRYABLE_STATUS_CODES
+        return response.status_code in NOT_PROCESSED_STATUS_CODES
+
+    def get_backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
+
+
+class AdaptiveConcurrencyLimiter(object):
+    """
+    Number of concurrent requests adjusted to what the server sustains, AIMD style:
+    the limit grows by one after a full round of successful requests. It is cut by decrease_factor when the server
+    throttles (429, 503, timeouts), and by latency_decrease_factor when the latency grows past latency_tolerance times its usual value.
+    The usual latency is kept per payload size, within a factor of two, since larger chunks take longer on a healthy server.
+    The throttled request itself waits as long as the Retry-After header asks, and the limit does not grow again before then.
+    """
+
+    def __init__(self, max_limit, min_limit=1, initial_limit=None, latency_tolerance=DEFAULT_LATENCY_TOLERANCE,
+                 decrease_factor=DEFAULT_DECREASE_FACTOR, latency_decrease_factor=DEFAULT_LATENCY_DECREASE_FACTOR):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial_limit or self.max_limit)))
+        self.lowest_limit = int(self.limit)
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.latency_decrease_factor = latency_decrease_factor
+        self.in_flight = 0
+        self.increase_after = 0.0
+        # Payload size class -> (smoothed latency, baseline latency)
+        self.latency_histories = {}
+        self.sent_requests = 0
+        self.decrease_ticket = 0
+        self.decreases = 0
+        self.increases = 0
+        self.throttled_requests = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        # Returns the ticket of the request, to give back to release
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            self.sent_requests += 1
+            return self.sent_requests
+
+    def release(self, ticket=None, latency=None, payload_size=None, is_throttled=False, retry_after=None):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if retry_after:
+                self.increase_after = max(self.increase_after, now + retry_after)
+            if is_throttled:
+                self.throttled_requests += 1
+                self.decrease(ticket, self.decrease_factor, "throttled by the server")
+            elif latency is not None:
+                self.record_latency(ticket, now, latency, payload_size)
+            self.condition.notify_all()
+
+    def record_latency(self, ticket, now, latency, payload_size=None):
+        size_class = int(payload_size).bit_length() if payload_size else 0
+        smoothed_latency, baseline_latency = self.latency_histories.get(size_class, (latency, None))
+        smoothed_latency = (1 - LATENCY_SMOOTHING) * smoothed_latency + LATENCY_SMOOTHING * latency
+        # The fastest recent latency, drifting slowly so that a lasting change of the server becomes the new norm
+        if baseline_latency is None or smoothed_latency < baseline_latency:
+            baseline_latency = smoothed_latency
+        else:
+            baseline_latency = (1 - BASELINE_LATENCY_DRIFT) * baseline_latency + BASELINE_LATENCY_DRIFT * smoothed_latency
+        self.latency_histories[size_class] = (smoothed_latency, baseline_latency)
+        if smoothed_latency > self.latency_tolerance * max(baseline_latency, MIN_BASELINE_LATENCY):
+            self.decrease(ticket, self.latency_decrease_factor, "latency of {:.2f}s instead of {:.2f}s".format(smoothed_latency, baseline_latency))
+        elif self.limit < self.max_limit and now >= self.increase_after:
+            previous_limit = int(self.limit)
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            if int(self.limit) > previous_limit:
+                self.increases += 1
+                logger.info("Concurrent requests limit raised to {}".format(int(self.limit)))
+
+    def decrease(self, ticket, factor, reason):
+        # The answers to the requests sent before the last decrease do not count, they reflect the previous limit
+        if ticket is not None and ticket <= self.decrease_ticket:
+            return
+        self.decrease_ticket = self.sent_requests
+        previous_limit = int(self.limit)
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        if int(self.limit) < previous_limit:
+            self.decreases += 1
+            self.lowest_limit = min(self.lowest_limit, int(self.limit))
+            logger.warning("Concurrent requests limit lowered to {} ({})".format(int(self.limit), reason))
+
+    def get_statistics(self):
+        with self.condition:
+            return {
+                "concurrency_limit": int(self.limit),
+                "lowest_concurrency_limit": self.lowest_limit,
+                "concurrency_decreases": self.decreases,
+                "concurrency_increases": self.increases,
+                "throttled_requests": self.throttled_requests
+            }
+
+
+def get_payload_size(data):
+    # Bytes left to send, without consuming a file or buffer body
+    if data is None:
+        return None
+    try:
+        return requests.utils.super_len(data)
+    except Exception:
+        return None
+
+
+def get_retry_after(response):
+    retry_after = response.headers.get("Retry-After")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(retry_after)
+        return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+
+shared_transport = None
+
+
+def get_shared_transport():
+    global shared_transport
+    if shared_transport is None:
+        shared_transport = MstrTransport()
+    return shared_transport
@@ -0,0 +1,255 @@
+import io
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from mstr_metrics import ExportMetrics
+
+
+logging.basicConfig(level=logging.INFO, format='dss-plugin-microstrategy %(levelname)s - %(message)s')
+logger = logging.getLogger()
+
+
+DEFAULT_MAX_CONCURRENT_UPLOADS = 4
+DEFAULT_CHUNK_TARGET_SIZE_MB = 10
+DEFAULT_CHUNK_MIN_ROWS = 100
+DEFAULT_CHUNK_MAX_ROWS = 100000
+DEFAULT_CHUNK_INITIAL_ROWS = 5000
+CHUNK_SAMPLE_ROWS = 100
+
+
+class ChunkUploader(object):
+    """
+    Pushes chunks of an upload session from a bounded pool of worker threads,
+    so that the caller can keep buffering rows while previous chunks are in flight.
+    Chunk indexes are assigned in submission order, on the caller's thread.
+    Chunks of the different tables of a multi-table upload session can be pushed from several threads.
+    """
+
+    def __init__(self, session, max_workers=DEFAULT_MAX_CONCURRENT_UPLOADS, max_pending_chunks=None, chunk_sizer=None, rows_filter=None, checkpoint=None, metrics=None,
+                 memory_budget=None, executor=None):
+        self.session = session
+        self.metrics = metrics or ExportMetrics()
+        self.memory_budget = memory_budget
+        self.chunk_sizer = chunk_sizer
+        self.rows_filter = rows_filter
+        self.checkpoint = checkpoint
+        self.max_workers = max(1, int(max_workers or 1))
+        self.max_pending_chunks = max_pending_chunks or 2 * self.max_workers
+        # A shared executor caps the uploads of several uploaders together, it is shut down by its owner
+        self.owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=self.max_workers)
+        self.pending_slots = threading.BoundedSemaphore(self.max_pending_chunks)
+        self.futures = []
+        self.futures_lock = threading.Lock()
+        self.error = None
+        self.pushed_chunks = 0
+        logger.info("Uploading chunks with {} concurrent workers".format(self.max_workers))
+
+    def push_rows(self, rows, index=None, table_name=None, chunk_sizer=None):
+        self.raise_on_error()
+        chunk_sizer = chunk_sizer or self.chunk_sizer
+        if index is None and chunk_sizer and not chunk_sizer.is_calibrated():
+            # The first chunk was cut before any size was known, it is split along the size measured on a sample
+            chunk_sizer.calibrate(rows, lambda sample: self.session.build_upload_chunk_body(sample, 0, output=io.BytesIO(), table_name=table_name)[1])
+            chunk_rows = chunk_sizer.chunk_rows
+            if len(rows) > chunk_rows:
+                for chunk_start in range(0, len(rows), chunk_rows):
+                    self.push_rows(slice_chunk(rows, chunk_start, chunk_start + chunk_rows), table_name=table_name, chunk_sizer=chunk_sizer)
+                return
+        input_rows_count = len(rows)
+        if self.rows_filter is not None:
+            # Filtered before an index is taken, so that a chunk left without rows is not sent at all
+            rows = self.session.filter_rows(rows, self.rows_filter, table_name=table_name)
+            if not len(rows):
+                if self.checkpoint:
+                    self.checkpoint.skip_rows(input_rows_count)
+                return
+        if index is None:
+            index = self.session.upload_session_next_index(table_name)
+        if self.checkpoint:
+            self.checkpoint.register_chunk(index, input_rows_count)
+        reservation = self.reserve_memory(rows)
+        try:
+            # The rows are passed in a list, so that the worker drops them once they are encoded
+            self.submit(self._push_rows, [rows], index, table_name, chunk_sizer, reservation)
+        except Exception:
+            if reservation:
+                reservation.release()
+            raise
+        self.pushed_chunks += 1
+
+    def push_empty_chunk(self, table_name=None):
+        # For an upload session without any data chunk. It is not checkpointed, a resumed export sends its own
+        self.raise_on_error()
+        self.submit(self._push_empty_chunk, self.session.upload_session_next_index(table_name), table_name)
+        self.pushed_chunks += 1
+
+    def reserve_memory(self, rows):
+        # Blocks the reader until the uploads leave room for this chunk in the memory budget
+        if not self.memory_budget:
+            return None
+        with self.metrics.timer("backpressure"):
+            return self.memory_budget.reserve(rows)
+
+    def resend_chunk(self, index):
+        # Pushes a chunk body previously saved by the checkpoint, without encoding it again
+        self.raise_on_error()
+        self.submit(self._resend_chunk, index)
+        self.pushed_chunks += 1
+
+    def submit(self, function, *args):
+        # Blocks the reader when too many chunks are waiting for a worker
+        with self.metrics.timer("backpressure"):
+            self.pending_slots.acquire()
+        try:
+            future = self.executor.submit(self._run, function, *args)
+        except Exception:
+            self.pending_slots.release()
+            raise
+        with self.futures_lock:
+            self.futures.append(future)
+            self.futures = [future for future in self.futures if not future.done()]
+
+    def _run(self, function, *args):
+        try:
+            return function(*args)
+        except Exception as error:
+            self.error = self.error or error
+            raise
+        finally:
+            self.pending_slots.release()
+
+    def _push_rows(self, chunk, index, table_name, chunk_sizer, reservation):
+        try:
+            if self.checkpoint:
+                return self._push_checkpointed_rows(chunk, index, chunk_sizer, reservation)
+            spill_file = self.memory_budget.open_spill_file() if self.memory_budget else None
+            try:
+                body, body_size = self.encode_chunk(chunk, index, table_name, chunk_sizer, output=spill_file)
+                if reservation:
+                    # Only the body is left in memory, unless it went to disk
+                    reservation.shrink(0 if spill_file else body_size)
+                return self.push_body(body, body_size, index, table_name=table_name)
+            finally:
+                if spill_file:
+                    spill_file.close()
+        finally:
+            if reservation:
+                reservation.release()
+
+    def _push_checkpointed_rows(self, chunk, index, chunk_sizer, reservation):
+        with self.checkpoint.open_chunk_file(index) as body:
+            body, body_size = self.encode_chunk(chunk, index, None, chunk_sizer, output=body)
+            if reservation:
+                reservation.release()
+            self.checkpoint.set_chunk_written(index)
+            response = self.push_body(body, body_size, index)
+        self.checkpoint.acknowledge_chunk(index)
+        return response
+
+    def encode_chunk(self, chunk, index, table_name, chunk_sizer, output=None):
+        rows = chunk.pop()
+        with self.metrics.timer("encode"):
+            body, body_size = self.session.build_upload_chunk_body(rows, index, output=output, table_name=table_name)
+        self.record_chunk_size(chunk_sizer, len(rows), body_size)
+        return body, body_size
+
+    def _push_empty_chunk(self, index, table_name):
+        body, body_size = self.session.build_upload_chunk_body([], index, table_name=table_name)
+        return self.push_body(body, body_size, index, table_name=table_name)
+
+    def _resend_chunk(self, index):
+        with self.checkpoint.open_chunk_file(index, mode="rb") as body:
+            response = self.push_body(body, os.fstat(body.fileno()).st_size, index)
+        self.checkpoint.acknowledge_chunk(index)
+        return response
+
+    def push_body(self, body, body_size, index, table_name=None):
+        push_start = time.perf_counter()
+        response = self.session.upload_session_push_body(body, index, table_name=table_name)
+        self.metrics.record_chunk(time.perf_counter() - push_start, body_size)
+        return response
+
+    def record_chunk_size(self, chunk_sizer, rows_count, body_size):
+        if chunk_sizer:
+            chunk_sizer.record(rows_count, body_size)
+
+    def raise_on_error(self):
+        if self.error:
+            raise self.error
+
+    def wait(self):
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.futures = []
+            self.shutdown()
+        self.raise_on_error()
+
+    def abort(self):
+        for future in self.futures:
+            future.cancel()
+        self.shutdown()
+
+    def shutdown(self):
+        if self.owns_executor:
+            self.executor.shutdown(wait=True)
+
+
+class ChunkSizer(object):
+    """
+    Picks the number of rows per chunk so that each encoded payload lands close to a target size,
+    whatever the width of the schema. The first estimate of the bytes per row comes from an encoded sample of the first rows,
+    it is then refined after every encoded chunk.
+    """
+
+    def __init__(self, target_size=DEFAULT_CHUNK_TARGET_SIZE_MB * 1024 * 1024, min_rows=DEFAULT_CHUNK_MIN_ROWS, max_rows=DEFAULT_CHUNK_MAX_ROWS, initial_rows=DEFAULT_CHUNK_INITIAL_ROWS):
+        self.target_size = target_size
+        self.min_rows = max(1, int(min_rows))
+        self.max_rows = max(self.min_rows, int(max_rows))
+        self.bytes_per_row = None
+        self.lock = threading.Lock()
+        self.chunk_rows = self.clamp(initial_rows)
+
+    def clamp(self, rows_count):
+        return min(self.max_rows, max(self.min_rows, int(rows_count)))
+
+    def is_calibrated(self):
+        return self.bytes_per_row is not None
+
+    def calibrate(self, rows, measure_payload_size):
+        # measure_payload_size encodes a few rows and returns the size of their payload
+        if self.is_calibrated() or not len(rows):
+            return
+        sample = slice_chunk(rows, 0, CHUNK_SAMPLE_ROWS)
+        self.record(len(sample), measure_payload_size(sample))
+
+    def record(self, rows_count, payload_size):
+        if not rows_count:
+            return
+        with self.lock:
+            measured_bytes_per_row = float(payload_size) / rows_count
+            if self.bytes_per_row is None:
+                self.bytes_per_row = measured_bytes_per_row
+            else:
+                self.bytes_per_row = 0.7 * self.bytes_per_row + 0.3 * measured_bytes_per_row
+            chunk_rows = self.clamp(self.target_size / max(self.bytes_per_row, 1.0))
+            if chunk_rows != self.chunk_rows:
+                logger.info("Chunk size set to {} rows ({:.0f} bytes per row)".format(chunk_rows, self.bytes_per_row))
+            self.chunk_rows = chunk_rows
+
+
+def slice_chunk(chunk, chunk_start, chunk_end):
+    if isinstance(chunk, list):
+        return chunk[chunk_start:chunk_end]
+    return chunk.iloc[chunk_start:chunk_end]
+
+
+def get_chunk_sizer(config):
+    target_size_mb = config.get("chunk_target_size_mb") or DEFAULT_CHUNK_TARGET_SIZE_MB
+    min_rows = config.get("chunk_min_rows") or DEFAULT_CHUNK_MIN_ROWS
+    max_rows = config.get("chunk_max_rows") or DEFAULT_CHUNK_MAX_ROWS
+    return ChunkSizer(target_size=target_size_mb * 1024 * 1024, min_rows=min_rows, max_rows=max_rows)
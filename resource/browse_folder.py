@@ -1,5 +1,6 @@
 import json
-from mstr_session import MstrSession, get_base_url
+from mstr_client import get_shared_client, get_base_url
+from mstr_folders import FolderTreeIndex, DEFAULT_SEARCH_WAIT
 
 
 def build_select_choices(choices=None):
@@ -26,7 +27,7 @@ def do(payload, config, plugin_config, inputs):
     password = config.get("microstrategy_api", {}).get("password", '')
 
     if parameter_name == "selected_project_id":
-        session = MstrSession(base_url, username, password)
+        session = get_shared_client(base_url, username, password)
         projects = session.get_projects()
         choices = []
         for project in projects:
@@ -43,23 +44,31 @@ def do(payload, config, plugin_config, inputs):
         saved_structure = json.loads(config.get("selected_folder_id", "{}"))
         selected_folder_name = saved_structure.get("names", [])
         selected_folder_id = saved_structure.get("ids", [])
-        session = MstrSession(base_url, username, password)
+        session = get_shared_client(base_url, username, password)
         if project_name:
             selected_project_id = session.get_project_id(project_name)
-        if not selected_folder_id:
-            folders = session.get_shared_folders(selected_project_id)
-        else:
-            folders = session.get_folder(selected_project_id, selected_folder_id[-1])
+        folder_index = FolderTreeIndex(session, selected_project_id)
+        if selected_folder_id:
             choices = [{"label": "/".join(selected_folder_name), "value": config.get("selected_folder_id", "[]")}]
-        for folder in folders:
-            if folder.get("type") == 8:
-                path_ids = selected_folder_id + ["{}".format(folder.get("id"))]
-                path_names = selected_folder_name + ["{}".format(folder.get("name"))]
-                full_path = selected_folder_name + [folder.get("name")]
+        folder_search = config.get("folder_search")
+        if folder_search:
+            # Jump straight to any indexed folder whose name matches, once the indexing is done or out of time
+            folder_index.wait(timeout=DEFAULT_SEARCH_WAIT)
+            for path_ids, path_names in folder_index.search(folder_search):
                 choices.append({
-                    "label": "/".join(full_path),
+                    "label": "/".join(path_names),
                     "value": "{}".format(json.dumps({"names": path_names, "ids": path_ids}))
                 })
+            if not choices:
+                return build_select_choices("No folder matching '{}'".format(folder_search))
+            return build_select_choices(choices)
+        for folder_id, folder_name in folder_index.get_subfolders(selected_folder_id, selected_folder_name):
+            path_ids = selected_folder_id + [folder_id]
+            path_names = selected_folder_name + [folder_name]
+            choices.append({
+                "label": "/".join(path_names),
+                "value": "{}".format(json.dumps({"names": path_names, "ids": path_ids}))
+            })
         if len(selected_folder_id) > 0:
             choices.append({
                 "label": "🔙 {}".format("/".join(selected_folder_name[:-1])),
@@ -0,0 +1,110 @@
+import re
+import json
+import base64
+import threading
+import requests
+from mstr_cache import MetadataCache
+from mstr_session import MstrSession
+
+
+SERVER_URL = "http://server/MicroStrategyLibrary/api"
+
+
+class FakeTokenManager(object):
+    def get_token(self, server_url, username, password, transport=None):
+        return "token", {}
+
+
+class FakeMstrApi(object):
+    """
+    In-memory stand-in for the Library REST API calls of the upload sessions, plugged into MstrSession instances.
+    Datasets are created, replaced, filled by chunks and published instantly. Chunks pushed to the datasets
+    named in failing_dataset_names get an error 500. Every call is appended to events, in order.
+    """
+
+    def __init__(self, failing_dataset_names=None):
+        self.failing_dataset_names = failing_dataset_names or []
+        self.lock = threading.Lock()
+        self.datasets = {}
+        self.upload_sessions = {}
+        self.events = []
+
+    def build_session(self):
+        session = MstrSession(SERVER_URL, "user", "password", metadata_cache=MetadataCache(), token_manager=FakeTokenManager())
+        session.get = lambda url=None, params=None, **kwargs: self.handle("GET", url, params=params)
+        session.post = lambda url=None, json=None, **kwargs: self.handle("POST", url, json_body=json)
+        session.patch = lambda url=None, json=None, **kwargs: self.handle("PATCH", url, json_body=json)
+        session.put = lambda url=None, data=None, **kwargs: self.handle("PUT", url, data=data)
+        return session
+
+    def add_dataset(self, dataset_name, tables_names):
+        with self.lock:
+            dataset_id = "D{}".format(len(self.datasets) + 1)
+            self.datasets[dataset_id] = {"name": dataset_name, "tables": list(tables_names)}
+        return dataset_id
+
+    def get_dataset_id(self, dataset_name):
+        return next((dataset_id for dataset_id, dataset in self.datasets.items() if dataset["name"] == dataset_name), None)
+
+    def get_received_rows(self, dataset_name, table_name=None):
+        dataset_id = self.get_dataset_id(dataset_name)
+        return sum(
+            rows_count for upload_session in self.upload_sessions.values() if upload_session["dataset_id"] == dataset_id
+            for chunk_table_name, index, rows_count in upload_session["chunks"] if table_name is None or chunk_table_name == table_name
+        )
+
+    def get_events(self, event_type):
+        return [event[1:] for event in self.events if event[0] == event_type]
+
+    def handle(self, method, url, params=None, json_body=None, data=None):
+        path = url[len(SERVER_URL):]
+        with self.lock:
+            if method == "GET" and path == "/projects":
+                return build_response(200, [{"id": "P1", "name": "Project"}])
+            if method == "GET" and path == "/searches/results":
+                datasets = [{"id": dataset_id, "name": dataset["name"]} for dataset_id, dataset in self.datasets.items() if dataset["name"] == params["name"]]
+                return build_response(200, {"result": datasets})
+            if method == "POST" and path == "/datasets":
+                dataset_id = "D{}".format(len(self.datasets) + 1)
+                self.datasets[dataset_id] = {"name": json_body["name"], "tables": [table["name"] for table in json_body["tables"]]}
+                self.events.append(("create", json_body["name"]))
+                return build_response(200, {"datasetId": dataset_id})
+            match = re.match(r"/datasets/(\w+)(?:/tables/(\w+)|/uploadSessions(?:/(\w+)(/publish|/publishStatus)?)?)$", path)
+            if not match or match.group(1) not in self.datasets:
+                return build_response(404, {"message": "Unknown object {}".format(path)})
+            dataset_id, table_name, upload_session_id, action = match.groups()
+            dataset_name = self.datasets[dataset_id]["name"]
+            if method == "PATCH" and table_name:
+                self.events.append(("replace", dataset_name, table_name))
+                return build_response(200, {})
+            if method == "POST" and not upload_session_id:
+                upload_session_id = "S{}".format(len(self.upload_sessions) + 1)
+                self.upload_sessions[upload_session_id] = {"dataset_id": dataset_id, "chunks": [], "published": False}
+                self.events.append(("open", dataset_name))
+                return build_response(200, {"uploadSessionId": upload_session_id})
+            upload_session = self.upload_sessions.get(upload_session_id)
+            if upload_session is None or upload_session["dataset_id"] != dataset_id:
+                return build_response(404, {"message": "Unknown upload session"})
+            if method == "PUT":
+                if dataset_name in self.failing_dataset_names:
+                    return build_response(500, {"message": "Injected error"})
+                chunk = json.loads(data if isinstance(data, bytes) else data.read())
+                rows_count = len(json.loads(base64.b64decode(chunk["data"])))
+                upload_session["chunks"].append((chunk["tableName"], chunk["index"], rows_count))
+                self.events.append(("chunk", dataset_name, chunk["tableName"], chunk["index"]))
+                return build_response(200, {})
+            if method == "POST" and action == "/publish":
+                upload_session["published"] = True
+                self.events.append(("publish", dataset_name))
+                return build_response(200, {})
+            if method == "GET" and action == "/publishStatus":
+                return build_response(200, {"status": 1 if upload_session["published"] else 0})
+        return build_response(404, {"message": "Unknown endpoint {} {}".format(method, path)})
+
+
+def build_response(status_code, json_body):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(json_body).encode("utf-8")
+    response.request = requests.Request("GET", SERVER_URL).prepare()
+    return response
@@ -0,0 +1,73 @@
+import os
+import json
+import pytest
+import mstr_auth
+from mstr_auth import TokenManager, build_token_key
+
+
+SERVER_URL = "http://server/MicroStrategyLibrary/api"
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # Records the logins and logouts instead of calling a Library server
+    calls = {"logins": [], "logouts": []}
+
+    def request_auth_token(server_url, username, password, transport=None):
+        if password == "wrong password":
+            raise Exception("Error 401 while requesting auth token")
+        calls["logins"].append(password)
+        return "token-{}".format(len(calls["logins"])), {"JSESSIONID": "cookie"}
+
+    def logout(server_url, auth_token, cookies, transport=None):
+        calls["logouts"].append(auth_token)
+
+    monkeypatch.setattr(mstr_auth, "request_auth_token", request_auth_token)
+    monkeypatch.setattr(mstr_auth, "logout", logout)
+    monkeypatch.setattr(mstr_auth, "extend_session", lambda server_url, auth_token, cookies, transport=None: True)
+    return calls
+
+
+def test_token_is_reused_across_managers(server, tmp_path):
+    assert TokenManager(directory=str(tmp_path)).get_token(SERVER_URL, "user", "password") == ("token-1", {"JSESSIONID": "cookie"})
+    assert TokenManager(directory=str(tmp_path)).get_token(SERVER_URL, "user", "password") == ("token-1", {"JSESSIONID": "cookie"})
+    assert server["logins"] == ["password"]
+
+
+def test_token_file_holds_no_password(server, tmp_path):
+    TokenManager(directory=str(tmp_path)).get_token(SERVER_URL, "user", "secret password")
+    token_path = os.path.join(str(tmp_path), "{}.json".format(build_token_key(SERVER_URL, "user")))
+    with open(token_path, "rb") as token_file:
+        content = token_file.read()
+    assert b"secret password" not in content
+    assert set(json.loads(content.decode("utf-8"))) >= {"auth_token", "password_salt", "password_verifier"}
+    assert os.stat(token_path).st_mode & 0o777 == 0o600
+
+
+def test_token_key_ignores_the_password():
+    assert build_token_key(SERVER_URL, "user") == build_token_key(SERVER_URL + "/", "user")
+    assert build_token_key(SERVER_URL, "user") != build_token_key(SERVER_URL, "other user")
+
+
+def test_other_password_retires_the_token(server, tmp_path):
+    TokenManager(directory=str(tmp_path)).get_token(SERVER_URL, "user", "old password")
+    auth_token, cookies = TokenManager(directory=str(tmp_path)).get_token(SERVER_URL, "user", "new password")
+    assert auth_token == "token-2"
+    assert server["logins"] == ["old password", "new password"]
+    assert server["logouts"] == ["token-1"]
+
+
+def test_wrong_password_keeps_the_token(server, tmp_path):
+    TokenManager(directory=str(tmp_path)).get_token(SERVER_URL, "user", "password")
+    with pytest.raises(Exception):
+        TokenManager(directory=str(tmp_path)).get_token(SERVER_URL, "user", "wrong password")
+    assert TokenManager(directory=str(tmp_path)).get_token(SERVER_URL, "user", "password")[0] == "token-1"
+    assert server["logouts"] == []
+
+
+def test_renewed_token_needs_the_same_password(server):
+    token_manager = TokenManager()
+    token_manager.get_token(SERVER_URL, "user", "password")
+    token_manager.renew_token(SERVER_URL, "user", "password", "token-1")
+    assert token_manager.renew_token(SERVER_URL, "user", "password", "token-1") == ("token-2", {"JSESSIONID": "cookie"})
+    assert token_manager.renew_token(SERVER_URL, "user", "other password", "token-1")[0] == "token-3"
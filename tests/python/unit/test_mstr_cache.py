@@ -0,0 +1,55 @@
+import mstr_cache
+from mstr_cache import MetadataCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(mstr_cache.time, "time", clock.time)
+    cache = MetadataCache(ttl=60)
+    cache.set(["server", "user", "projects"], ["P1"])
+    cache.set(["server", "user", "dataset_id", "P1", "cube"], "D1", ttl=600)
+    clock.now += 61
+    assert cache.get(["server", "user", "projects"]) is None
+    assert cache.get(["server", "user", "dataset_id", "P1", "cube"]) == "D1"
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = MetadataCache(max_entries=2)
+    cache.set(["server", "user", "first"], 1)
+    cache.set(["server", "user", "second"], 2)
+    assert cache.get(["server", "user", "first"]) == 1
+    cache.set(["server", "user", "third"], 3)
+    assert cache.get(["server", "user", "second"]) is None
+    assert cache.get(["server", "user", "first"]) == 1
+    assert cache.get(["server", "user", "third"]) == 3
+
+
+def test_invalidation_covers_the_keys_under_a_prefix():
+    cache = MetadataCache()
+    cache.set(["server", "user", "dataset_id", "P1", "", "cube"], "D1")
+    cache.set(["server", "user", "dataset_id", "P10", "", "cube"], "D2")
+    assert cache.invalidate(["server", "user", "dataset_id", "P1"])
+    assert cache.get(["server", "user", "dataset_id", "P1", "", "cube"]) is None
+    assert cache.get(["server", "user", "dataset_id", "P10", "", "cube"]) == "D2"
+    assert not cache.invalidate(["server", "user", "dataset_id", "P1"])
+
+
+def test_entries_are_shared_through_the_cache_file(tmp_path):
+    file_path = str(tmp_path / "metadata_cache.json")
+    first_cache = MetadataCache(file_path=file_path)
+    second_cache = MetadataCache(file_path=file_path)
+    first_cache.set(["server", "user", "projects"], [{"id": "P1"}])
+    second_cache.set(["server", "user", "folders", "P1"], ["F1"])
+    third_cache = MetadataCache(file_path=file_path)
+    assert third_cache.get(["server", "user", "projects"]) == [{"id": "P1"}]
+    assert third_cache.get(["server", "user", "folders", "P1"]) == ["F1"]
+    second_cache.invalidate(["server", "user", "projects"])
+    assert MetadataCache(file_path=file_path).get(["server", "user", "projects"]) is None
@@ -0,0 +1,75 @@
+import os
+import pytest
+from mstr_checkpoint import UploadCheckpoint, CHUNK_REGISTERED, CHUNK_WRITTEN, CHUNK_ACKNOWLEDGED
+
+
+TARGET_KEY_PARTS = ["server", "user", "project", "cube"]
+
+
+@pytest.fixture(autouse=True)
+def state_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv("MSTR_PLUGIN_STATE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def write_chunk(checkpoint, index, rows_count):
+    checkpoint.register_chunk(index, rows_count)
+    with checkpoint.open_chunk_file(index) as body:
+        body.write(b"chunk body")
+    checkpoint.set_chunk_written(index)
+
+
+def start_checkpoint():
+    checkpoint = UploadCheckpoint(TARGET_KEY_PARTS, "fingerprint")
+    checkpoint.start("P1", "D1", "S1", "replace")
+    return checkpoint
+
+
+def test_chunks_are_reloaded_from_the_log():
+    checkpoint = start_checkpoint()
+    write_chunk(checkpoint, 1, 100)
+    checkpoint.acknowledge_chunk(1)
+    write_chunk(checkpoint, 2, 100)
+    checkpoint.register_chunk(3, 50)
+    reloaded_checkpoint = UploadCheckpoint(TARGET_KEY_PARTS, "fingerprint")
+    assert reloaded_checkpoint.get_resumable_manifest("D1")["upload_session_id"] == "S1"
+    assert reloaded_checkpoint.get_chunks() == [(1, 100, CHUNK_ACKNOWLEDGED), (2, 100, CHUNK_WRITTEN), (3, 50, CHUNK_REGISTERED)]
+
+
+def test_incomplete_last_log_line_is_ignored():
+    checkpoint = start_checkpoint()
+    write_chunk(checkpoint, 1, 100)
+    checkpoint.close_log()
+    with open(checkpoint.log_path, "a") as log_file:
+        log_file.write('{"index": 1, "sta')
+    assert UploadCheckpoint(TARGET_KEY_PARTS, "fingerprint").get_chunks() == [(1, 100, CHUNK_WRITTEN)]
+
+
+def test_only_the_last_acknowledged_body_is_kept():
+    checkpoint = start_checkpoint()
+    for index in [1, 2, 3]:
+        write_chunk(checkpoint, index, 100)
+    checkpoint.acknowledge_chunk(2)
+    checkpoint.acknowledge_chunk(1)
+    checkpoint.acknowledge_chunk(3)
+    assert [os.path.isfile(checkpoint.get_chunk_path(index)) for index in [1, 2, 3]] == [False, False, True]
+
+
+def test_new_upload_session_sends_acknowledged_chunks_again():
+    checkpoint = start_checkpoint()
+    for index in [1, 2]:
+        write_chunk(checkpoint, index, 100)
+        checkpoint.acknowledge_chunk(index)
+    reloaded_checkpoint = UploadCheckpoint(TARGET_KEY_PARTS, "fingerprint")
+    reloaded_checkpoint.set_upload_session_id("S2")
+    # The body of the first chunk is gone, its rows are encoded again
+    assert reloaded_checkpoint.get_chunks() == [(1, 100, CHUNK_REGISTERED), (2, 100, CHUNK_WRITTEN)]
+    assert UploadCheckpoint(TARGET_KEY_PARTS, "fingerprint").get_resumable_manifest("D1")["upload_session_id"] == "S2"
+
+
+def test_schema_change_starts_over():
+    checkpoint = start_checkpoint()
+    write_chunk(checkpoint, 1, 100)
+    assert UploadCheckpoint(TARGET_KEY_PARTS, "other fingerprint").get_resumable_manifest("D1") is None
+    checkpoint.clear()
+    assert UploadCheckpoint(TARGET_KEY_PARTS, "fingerprint").get_resumable_manifest("D1") is None
@@ -0,0 +1,73 @@
+import json
+import pytest
+import requests
+from mstr_cache import MetadataCache
+from mstr_client import MstrClient, MstrResponseError, assert_response_ok
+
+
+class FakeTokenManager(object):
+    def get_token(self, server_url, username, password, transport=None):
+        return "token", {}
+
+
+def build_response(status_code, json_body):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(json_body).encode("utf-8")
+    response.request = requests.Request("GET", "http://server/api/searches/results").prepare()
+    return response
+
+
+def build_client(dataset_ids):
+    # Each search finds the next dataset id of the list
+    client = MstrClient("http://server/MicroStrategyLibrary/api", "user", "password", metadata_cache=MetadataCache(), token_manager=FakeTokenManager())
+    client.build_headers = lambda project_id: {}
+    client.searches = 0
+
+    def get(url=None, headers=None, params=None, timeout=None):
+        client.searches += 1
+        return build_response(200, {"result": [{"name": "cube", "id": dataset_ids.pop(0)}]})
+    client.get = get
+    return client
+
+
+def test_response_error_keeps_the_status_code():
+    with pytest.raises(MstrResponseError) as error:
+        assert_response_ok(build_response(404, {"message": "Object not found"}))
+    assert error.value.status_code == 404
+
+
+def test_unknown_cached_dataset_id_is_searched_again():
+    client = build_client(["D1", "D2"])
+    client.get_dataset_id("P1", "cube")
+    used_dataset_ids = []
+
+    def replace_dataset(dataset_id):
+        used_dataset_ids.append(dataset_id)
+        if dataset_id == "D1":
+            raise MstrResponseError("Error 404", status_code=404)
+        return dataset_id
+    assert client.run_on_dataset("P1", "cube", replace_dataset) == "D2"
+    assert used_dataset_ids == ["D1", "D2"]
+    assert client.get_cached_dataset_id("P1", "cube") == "D2"
+
+
+def test_other_errors_are_not_retried():
+    client = build_client(["D1", "D2"])
+    client.get_dataset_id("P1", "cube")
+
+    def replace_dataset(dataset_id):
+        raise MstrResponseError("Error 500", status_code=500)
+    with pytest.raises(MstrResponseError):
+        client.run_on_dataset("P1", "cube", replace_dataset)
+    assert client.searches == 1
+
+
+def test_searched_dataset_id_is_not_retried():
+    client = build_client(["D1", "D2"])
+
+    def replace_dataset(dataset_id):
+        raise MstrResponseError("Error 404", status_code=404)
+    with pytest.raises(MstrResponseError):
+        client.run_on_dataset("P1", "cube", replace_dataset)
+    assert client.searches == 1
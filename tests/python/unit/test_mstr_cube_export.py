@@ -0,0 +1,60 @@
+import pytest
+from fake_mstr_api import FakeMstrApi
+from mstr_cube_export import MultiTableExport
+from mstr_uploader import ChunkSizer
+
+
+def build_export(api, dataset_name="sales"):
+    export = MultiTableExport(api.build_session(), "P1", dataset_name, max_concurrent_uploads=2)
+    export.add_table("facts", ["id", "amount"], ["bigint", "double"], ChunkSizer(min_rows=10, max_rows=10, initial_rows=10))
+    export.add_table("customers", ["id", "name"], ["bigint", "string"], ChunkSizer(min_rows=10, max_rows=10, initial_rows=10))
+    return export
+
+
+def test_tables_are_sent_in_one_upload_session():
+    api = FakeMstrApi()
+    export = build_export(api)
+    export.open()
+    export.export_tables({
+        "facts": iter([(index, index * 1.5) for index in range(25)]),
+        "customers": iter([(index, "customer {}".format(index)) for index in range(4)])
+    })
+    assert export.close() == {"facts": 25, "customers": 4}
+    assert api.get_events("create") == [("sales",)]
+    assert api.datasets[export.dataset_id]["tables"] == ["facts", "customers"]
+    assert len(api.upload_sessions) == 1
+    assert api.get_received_rows("sales", "facts") == 25
+    assert api.get_received_rows("sales", "customers") == 4
+    assert sorted(index for table_name, index, rows_count in api.upload_sessions["S1"]["chunks"] if table_name == "facts") == [1, 2, 3]
+    assert api.get_events("publish") == [("sales",)]
+
+
+def test_existing_cube_tables_are_replaced_before_the_upload():
+    api = FakeMstrApi()
+    api.add_dataset("sales", ["facts", "customers"])
+    export = build_export(api)
+    export.open()
+    export.export_tables({"facts": iter([]), "customers": iter([(1, "customer")])})
+    export.close()
+    assert api.get_events("create") == []
+    assert api.events[:3] == [("replace", "sales", "facts"), ("replace", "sales", "customers"), ("open", "sales")]
+    # An empty table still gets one chunk
+    assert ("facts", 1, 0) in api.upload_sessions["S1"]["chunks"]
+
+
+def test_failing_table_stops_the_export():
+    def failing_rows():
+        yield (1, 1.0)
+        raise ValueError("Input dataset could not be read")
+    api = FakeMstrApi()
+    export = build_export(api)
+    export.open()
+    with pytest.raises(ValueError, match="could not be read"):
+        export.export_tables({"facts": failing_rows(), "customers": iter([(1, "customer")])})
+    assert api.get_events("publish") == []
+
+
+def test_table_cannot_be_added_twice():
+    export = build_export(FakeMstrApi())
+    with pytest.raises(ValueError):
+        export.add_table("facts", ["id"], ["bigint"], ChunkSizer())
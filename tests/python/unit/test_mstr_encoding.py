@@ -0,0 +1,61 @@
+import io
+import json
+import numpy
+import pandas
+import pytest
+import mstr_json
+from base64 import b64decode
+from mstr_encoding import encode_rows, convert_rows_to_data, write_upload_chunk_body_from_dataframe
+
+
+LARGE_ID = 2 ** 53 + 1
+
+
+def decode(encoded_rows):
+    return json.loads(b64decode(encoded_rows))
+
+
+@pytest.fixture(params=["json", "orjson"])
+def json_backend(request):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    previous_backend = mstr_json.json_backend
+    yield mstr_json.set_json_backend(request.param)
+    mstr_json.json_backend = previous_backend
+
+
+def test_large_integer_next_to_a_null_is_kept(json_backend):
+    rows = [(LARGE_ID, "a"), (None, "b"), (3, None)]
+    assert decode(encode_rows(rows, ["id", "name"], ["bigint", "string"])) == [[LARGE_ID, "a"], [None, "b"], [3, ""]]
+
+
+def test_large_integer_next_to_a_null_is_kept_in_dict_rows(json_backend):
+    rows = [{"id": LARGE_ID}, {"id": None}]
+    assert decode(convert_rows_to_data(rows, ["bigint"])) == [{"id": LARGE_ID}, {"id": None}]
+
+
+def test_empty_chunk(json_backend):
+    assert decode(encode_rows([], ["id"], ["bigint"])) == []
+
+
+def test_dataframe_chunk_body(json_backend):
+    dataframe = pandas.DataFrame({
+        "id": [1, 2, 3],
+        "price": [1.5, numpy.nan, 3.0],
+        "flag": [True, False, True],
+        "name": ["a", None, "c"]
+    })
+    output = write_upload_chunk_body_from_dataframe(io.BytesIO(), dataframe, ["bigint", "double", "boolean", "string"], "dss_data", 4)
+    body = json.loads(output.getvalue())
+    assert body["tableName"] == "dss_data"
+    assert body["index"] == 4
+    assert decode(body["data"]) == [[1, 1.5, True, "a"], [2, None, False, ""], [3, 3.0, True, "c"]]
+
+
+def test_nullable_extension_columns(json_backend):
+    dataframe = pandas.DataFrame({
+        "id": pandas.array([LARGE_ID, None], dtype="Int64"),
+        "flag": pandas.array([True, None], dtype="boolean")
+    })
+    output = write_upload_chunk_body_from_dataframe(io.BytesIO(), dataframe, ["bigint", "boolean"], "dss_data", 1)
+    assert decode(json.loads(output.getvalue())["data"]) == [[LARGE_ID, True], [None, None]]
@@ -0,0 +1,101 @@
+import io
+import tempfile
+import pytest
+import requests
+from fake_mstr_api import FakeMstrApi
+from mstr_fanout import BodyReader, FanOutSession, FanOutTarget, TARGET_STATUS_FAILED, TARGET_STATUS_PUBLISHED
+from mstr_publish import PublishMonitor
+
+
+COLUMNS_NAMES = ["id", "label"]
+COLUMNS_TYPES = ["bigint", "string"]
+
+
+def open_fan_out(api, targets_names):
+    session = api.build_session()
+    dataset_id = session.create_dataset("P1", "main", "dss_data", COLUMNS_NAMES, COLUMNS_TYPES)
+    session.open_upload_session("P1", dataset_id, "dss_data", {"columns": [{"name": "id"}, {"name": "label"}]}, COLUMNS_TYPES)
+    targets = [FanOutTarget(api.build_session(), None, target_name, project_id="P2") for target_name in targets_names]
+    fan_out = FanOutSession(session, targets, max_workers=2)
+    fan_out.open_targets("dss_data", COLUMNS_NAMES, COLUMNS_TYPES)
+    return fan_out
+
+
+def push_chunks(fan_out, chunks_count, rows_per_chunk=3):
+    for chunk_index in range(chunks_count):
+        index = fan_out.upload_session_next_index()
+        rows = [(chunk_index * rows_per_chunk + row_index, "row") for row_index in range(rows_per_chunk)]
+        body, body_size = fan_out.build_upload_chunk_body(rows, index)
+        fan_out.upload_session_push_body(body, index)
+
+
+def test_every_target_gets_the_same_chunks():
+    api = FakeMstrApi()
+    fan_out = open_fan_out(api, ["copy 1", "copy 2"])
+    push_chunks(fan_out, 4)
+    PublishMonitor(fan_out.session).publish().wait()
+    fan_out.publish_targets()
+    fan_out.wait_for_targets()
+    fan_out.raise_on_failure()
+    fan_out.close()
+    for dataset_name in ["main", "copy 1", "copy 2"]:
+        assert api.get_received_rows(dataset_name) == 12
+    assert sorted(api.get_events("publish")) == [("copy 1",), ("copy 2",), ("main",)]
+    assert [report["status"] for report in fan_out.log_summary()] == [TARGET_STATUS_PUBLISHED, TARGET_STATUS_PUBLISHED]
+
+
+def test_failing_target_is_left_out():
+    api = FakeMstrApi(failing_dataset_names=["copy 2"])
+    fan_out = open_fan_out(api, ["copy 1", "copy 2"])
+    push_chunks(fan_out, 4)
+    fan_out.publish_targets()
+    fan_out.wait_for_targets()
+    fan_out.close()
+    assert api.get_received_rows("main") == 12
+    assert api.get_received_rows("copy 1") == 12
+    assert api.get_events("publish") == [("copy 1",)]
+    failed_target = fan_out.targets[1]
+    assert failed_target.status == TARGET_STATUS_FAILED
+    # Only the first chunk was attempted on the failed target
+    assert failed_target.chunks == 0
+    with pytest.raises(Exception, match="1 of 2 additional datasets: 'copy 2'"):
+        fan_out.raise_on_failure()
+
+
+def test_target_failing_to_open_does_not_stop_the_others():
+    api = FakeMstrApi()
+    session = api.build_session()
+    dataset_id = session.create_dataset("P1", "main", "dss_data", COLUMNS_NAMES, COLUMNS_TYPES)
+    session.open_upload_session("P1", dataset_id, "dss_data", {"columns": [{"name": "id"}, {"name": "label"}]}, COLUMNS_TYPES)
+    targets = [FanOutTarget(api.build_session(), "Project", "copy 1"), FanOutTarget(api.build_session(), "Unknown project", "copy 2")]
+    fan_out = FanOutSession(session, targets, max_workers=2)
+    fan_out.open_targets("dss_data", COLUMNS_NAMES, COLUMNS_TYPES)
+    assert targets[1].status == TARGET_STATUS_FAILED
+    push_chunks(fan_out, 2)
+    fan_out.close()
+    assert api.get_received_rows("copy 1") == 6
+    assert api.get_dataset_id("copy 2") is None
+
+
+def test_readers_share_a_spilled_body():
+    with tempfile.TemporaryFile() as body:
+        body.write(b"0123456789")
+        body.seek(2)
+        first_reader = BodyReader(body)
+        second_reader = BodyReader(body)
+        assert first_reader.read(4) == b"0123"
+        assert second_reader.read(6) == b"012345"
+        assert first_reader.read() == b"456789"
+        assert body.tell() == 2
+        assert requests.utils.super_len(second_reader) == 4
+
+
+def test_in_memory_body_is_released():
+    body = io.BytesIO(b"0123456789")
+    reader = BodyReader(body)
+    reader.seek(3)
+    assert reader.read(2) == b"34"
+    assert reader.tell() == 5
+    reader.close()
+    body.write(b"a longer body")
+    assert body.getvalue() == b"a longer body"
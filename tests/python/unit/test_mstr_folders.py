@@ -0,0 +1,98 @@
+import time
+import threading
+import mstr_folders
+from mstr_cache import MetadataCache
+from mstr_folders import FolderTreeIndex
+
+
+class FakeFolderSession(object):
+    # Shared reports tree with `fanout` subfolders per folder down to `depth` levels, ids like "F.0.1"
+    def __init__(self, fanout=3, depth=3, latency=0.0, failing_folder_ids=None):
+        self.fanout = fanout
+        self.depth = depth
+        self.latency = latency
+        self.failing_folder_ids = failing_folder_ids or []
+        self.metadata_cache = MetadataCache()
+        self.requested_folder_ids = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def build_cache_key(self, *key_parts):
+        return ["http://server", "user"] + list(key_parts)
+
+    def get_shared_folders(self, project_id, use_cache=True):
+        return self.get_folder(project_id, "F", use_cache=use_cache)
+
+    def get_folder(self, project_id, parent_folder_id, use_cache=True):
+        self.requested_folder_ids.append(parent_folder_id)
+        if parent_folder_id != "F":
+            self.release.wait()
+        time.sleep(self.latency)
+        if parent_folder_id in self.failing_folder_ids:
+            return {"code": "ERR001"}
+        if parent_folder_id.count(".") >= self.depth:
+            return []
+        subfolders = [{"id": "{}.{}".format(parent_folder_id, index), "name": "Folder {}.{}".format(parent_folder_id, index), "type": 8} for index in range(self.fanout)]
+        return subfolders + [{"id": "{}.R".format(parent_folder_id), "name": "A report", "type": 3}]
+
+
+def count_folders(fanout, depth):
+    return sum(fanout ** level for level in range(1, depth + 1))
+
+
+def test_root_level_is_answered_before_the_tree_is_indexed():
+    session = FakeFolderSession()
+    session.release.clear()
+    folder_index = FolderTreeIndex(session, "P1")
+    assert [folder_id for folder_id, folder_name in folder_index.get_subfolders()] == ["F.0", "F.1", "F.2"]
+    assert folder_index.search("F.0.1") == []
+    session.release.set()
+    folder_index.wait()
+    assert folder_index.search("F.0.1", limit=1) == [(["F.0", "F.0.1"], ["Folder F.0", "Folder F.0.1"])]
+    assert len(folder_index.folders) - 1 == count_folders(3, 3)
+
+
+def test_indexed_tree_is_reused_from_the_cache():
+    session = FakeFolderSession()
+    FolderTreeIndex(session, "P4", background=False)
+    requests_count = len(session.requested_folder_ids)
+    folder_index = FolderTreeIndex(session, "P4")
+    assert folder_index.get_subfolders(["F.1"]) == [("F.1.0", "Folder F.1.0"), ("F.1.1", "Folder F.1.1"), ("F.1.2", "Folder F.1.2")]
+    assert len(session.requested_folder_ids) == requests_count
+    assert mstr_folders.indexing_threads.get(tuple(folder_index.cache_key)) is None
+
+
+def test_indexing_stops_after_the_time_budget_and_resumes():
+    session = FakeFolderSession(fanout=4, depth=4, latency=0.01)
+    folder_index = FolderTreeIndex(session, "P2", max_workers=2, time_budget=0.05, background=False)
+    assert 0 < len(folder_index.folders) - 1 < count_folders(4, 4)
+    folder_index = FolderTreeIndex(session, "P2", max_workers=8, time_budget=30, background=False)
+    assert len(folder_index.folders) - 1 == count_folders(4, 4)
+
+
+def test_unreadable_folder_is_not_fetched_again():
+    session = FakeFolderSession(failing_folder_ids=["F.1"])
+    folder_index = FolderTreeIndex(session, "P3", background=False)
+    assert session.requested_folder_ids.count("F.1") == 1
+    assert len(folder_index.folders) - 1 == count_folders(3, 3) - count_folders(3, 2)
+
+
+def test_tree_indexed_by_another_callback_is_searched():
+    session = FakeFolderSession()
+    session.release.clear()
+    FolderTreeIndex(session, "P5")
+    folder_index = FolderTreeIndex(session, "P5")
+    session.release.set()
+    folder_index.wait(timeout=10)
+    assert folder_index.search("F.2.1", limit=1) == [(["F.2", "F.2.1"], ["Folder F.2", "Folder F.2.1"])]
+    assert len(folder_index.folders) - 1 == count_folders(3, 3)
+
+
+def test_folder_deeper_than_the_index_keeps_its_path():
+    session = FakeFolderSession(depth=5)
+    folder_index = FolderTreeIndex(session, "P6", max_depth=1, background=False)
+    path_ids = ["F.0", "F.0.1", "F.0.1.2"]
+    path_names = ["Folder F.0", "Folder F.0.1", "Folder F.0.1.2"]
+    assert folder_index.get_subfolders(path_ids, path_names)[0] == ("F.0.1.2.0", "Folder F.0.1.2.0")
+    assert folder_index.folders["F.0.1.2"]["depth"] == 3
+    assert folder_index.get_path("F.0.1.2.0") == (path_ids + ["F.0.1.2.0"], path_names + ["Folder F.0.1.2.0"])
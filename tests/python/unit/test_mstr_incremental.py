@@ -0,0 +1,99 @@
+import pandas
+import pytest
+from mstr_incremental import IncrementalExport, WatermarkFilter, RowHashFilter, EXPORT_MODE_APPEND_WATERMARK, EXPORT_MODE_UPSERT_CHANGED
+from mstr_incremental import confirm_pending_state, discard_pending_state
+
+
+@pytest.fixture(autouse=True)
+def state_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv("MSTR_PLUGIN_STATE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_watermark_filter_parses_every_date_layout():
+    watermark_filter = WatermarkFilter("updated", "date", "2021-01-01")
+    dataframe = pandas.DataFrame({"updated": ["2021-02-01", "2021-03-01T10:00:00.000Z", None, "2021-04-01 10:00:00", "not a date", "2020-12-31"]})
+    filtered_dataframe = watermark_filter.filter(dataframe)
+    assert list(filtered_dataframe.index) == [0, 1, 3]
+    assert watermark_filter.get_watermark() == "2021-04-01T10:00:00+00:00"
+    assert watermark_filter.rows_without_watermark == 2
+
+
+def test_watermark_filter_keeps_every_row_without_threshold():
+    watermark_filter = WatermarkFilter("updated", "date", None)
+    dataframe = pandas.DataFrame({"updated": pandas.to_datetime(["2021-02-01", "2022-01-01"]).tolist() + [None]})
+    assert len(watermark_filter.filter(dataframe)) == 3
+    assert watermark_filter.get_watermark() == "2022-01-01T00:00:00+00:00"
+    assert watermark_filter.rows_without_watermark == 0
+
+
+def test_watermark_filter_numeric():
+    watermark_filter = WatermarkFilter("id", "bigint", 10)
+    filtered_dataframe = watermark_filter.filter(pandas.DataFrame({"id": [5, 11, None, 12]}))
+    assert list(filtered_dataframe["id"]) == [11, 12]
+    assert watermark_filter.get_watermark() == 12
+    assert watermark_filter.rows_without_watermark == 1
+
+
+def test_row_hash_filter_sends_new_and_modified_rows():
+    first_filter = RowHashFilter(["bigint", "string"])
+    first_filter.filter(pandas.DataFrame({"id": [1, 2, 3], "name": ["a", "b", "c"]}))
+    next_filter = RowHashFilter(["bigint", "string"], first_filter.get_hashes())
+    filtered_dataframe = next_filter.filter(pandas.DataFrame({"id": [1, 2, 4], "name": ["a", "B", "d"]}))
+    assert list(filtered_dataframe["id"]) == [2, 4]
+    assert (next_filter.rows_read, next_filter.rows_kept) == (3, 2)
+
+
+def test_row_hash_filter_ignores_the_inferred_dtype():
+    first_filter = RowHashFilter(["bigint"])
+    first_filter.filter(pandas.DataFrame({"id": [1, 2]}))
+    next_filter = RowHashFilter(["bigint"], first_filter.get_hashes())
+    assert len(next_filter.filter(pandas.DataFrame({"id": [1.0, 2.0]}))) == 0
+
+
+def test_watermark_state_is_kept_between_exports():
+    export = IncrementalExport(EXPORT_MODE_APPEND_WATERMARK, ["server", "cube"], ["id", "updated"], ["bigint", "date"], watermark_column="updated")
+    assert export.get_update_policy() == "replace"
+    export.filter_rows(pandas.DataFrame({"id": [1, 2], "updated": ["2021-01-01", "2021-02-01"]}))
+    export.commit()
+    next_export = IncrementalExport(EXPORT_MODE_APPEND_WATERMARK, ["server", "cube"], ["id", "updated"], ["bigint", "date"], watermark_column="updated")
+    assert next_export.get_update_policy() == "add"
+    filtered_dataframe = next_export.filter_rows(pandas.DataFrame({"id": [2, 3], "updated": ["2021-02-01", "2021-03-01"]}))
+    assert list(filtered_dataframe["id"]) == [3]
+
+
+def test_upsert_state_is_reset_by_a_schema_change():
+    export = IncrementalExport(EXPORT_MODE_UPSERT_CHANGED, ["server", "cube"], ["id"], ["bigint"])
+    export.filter_rows(pandas.DataFrame({"id": [1]}))
+    export.commit()
+    assert IncrementalExport(EXPORT_MODE_UPSERT_CHANGED, ["server", "cube"], ["id"], ["bigint"]).get_update_policy() == "upsert"
+    assert IncrementalExport(EXPORT_MODE_UPSERT_CHANGED, ["server", "cube"], ["key"], ["bigint"]).get_update_policy() == "replace"
+
+
+@pytest.mark.parametrize("export_mode", [EXPORT_MODE_APPEND_WATERMARK, EXPORT_MODE_UPSERT_CHANGED])
+def test_pending_state_is_used_once_confirmed(export_mode):
+    export = IncrementalExport(export_mode, ["server", "cube"], ["id"], ["bigint"], watermark_column="id")
+    export.filter_rows(pandas.DataFrame({"id": [1, 2]}))
+    export.commit(pending=True)
+    assert IncrementalExport(export_mode, ["server", "cube"], ["id"], ["bigint"], watermark_column="id").get_update_policy() == "replace"
+    confirm_pending_state(["server", "cube"])
+    next_export = IncrementalExport(export_mode, ["server", "cube"], ["id"], ["bigint"], watermark_column="id")
+    assert next_export.get_update_policy() != "replace"
+    assert list(next_export.filter_rows(pandas.DataFrame({"id": [2, 3]}))["id"]) == [3]
+
+
+def test_discarded_pending_state_keeps_the_last_confirmed_one():
+    export = IncrementalExport(EXPORT_MODE_APPEND_WATERMARK, ["server", "cube"], ["id"], ["bigint"], watermark_column="id")
+    export.filter_rows(pandas.DataFrame({"id": [1]}))
+    export.commit()
+    export.filter_rows(pandas.DataFrame({"id": [2]}))
+    export.commit(pending=True)
+    discard_pending_state(["server", "cube"])
+    confirm_pending_state(["server", "cube"])
+    next_export = IncrementalExport(EXPORT_MODE_APPEND_WATERMARK, ["server", "cube"], ["id"], ["bigint"], watermark_column="id")
+    assert list(next_export.filter_rows(pandas.DataFrame({"id": [1, 2]}))["id"]) == [2]
+
+
+def test_unknown_watermark_column():
+    with pytest.raises(ValueError):
+        IncrementalExport(EXPORT_MODE_APPEND_WATERMARK, ["server", "cube"], ["id"], ["bigint"], watermark_column="updated")
@@ -0,0 +1,72 @@
+import threading
+import pytest
+from mstr_memory import MemoryBudget, estimate_chunk_memory
+
+
+@pytest.fixture(autouse=True)
+def state_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv("MSTR_PLUGIN_STATE_DIR", str(tmp_path))
+    return tmp_path
+
+
+ROWS = [(index, "value {}".format(index)) for index in range(100)]
+
+
+def build_budget(chunks_count, max_workers=1):
+    # A budget leaving room for chunks_count chunks of ROWS in the upload share
+    chunk_memory = estimate_chunk_memory(ROWS)
+    return MemoryBudget(chunks_count * chunk_memory * (max_workers + 1) / float(max_workers) / 1024 / 1024, max_workers)
+
+
+def test_reader_waits_for_a_release():
+    memory_budget = build_budget(1.5)
+    first_reservation = memory_budget.reserve(ROWS)
+    reserved = threading.Event()
+
+    def reserve_second_chunk():
+        memory_budget.reserve(ROWS)
+        reserved.set()
+    thread = threading.Thread(target=reserve_second_chunk)
+    thread.start()
+    assert not reserved.wait(0.2)
+    first_reservation.release()
+    assert reserved.wait(5)
+    thread.join()
+    assert memory_budget.peak_reserved == estimate_chunk_memory(ROWS)
+
+
+def test_chunk_larger_than_the_budget_still_goes_through():
+    memory_budget = build_budget(0.1)
+    reservation = memory_budget.reserve(ROWS)
+    assert memory_budget.reserved == reservation.size
+    reservation.release()
+    assert memory_budget.reserved == 0
+
+
+def test_encoded_chunk_only_keeps_its_body():
+    memory_budget = build_budget(4)
+    reservation = memory_budget.reserve(ROWS)
+    reservation.shrink(1000)
+    assert memory_budget.reserved == 1000
+    reservation.release()
+    assert memory_budget.reserved == 0
+
+
+def test_bodies_spill_to_disk_when_memory_is_tight(state_directory):
+    memory_budget = build_budget(3)
+    assert memory_budget.open_spill_file() is None
+    reservations = [memory_budget.reserve(ROWS) for index in range(2)]
+    spill_file = memory_budget.open_spill_file()
+    assert spill_file is not None
+    spill_file.write(b"body")
+    spill_file.close()
+    assert (state_directory / "spill").is_dir()
+    for reservation in reservations:
+        reservation.release()
+    assert memory_budget.open_spill_file() is None
+
+
+def test_wide_rows_make_smaller_chunks():
+    memory_budget = build_budget(1)
+    wide_rows = [tuple("value {}".format(column) for column in range(50))]
+    assert memory_budget.get_max_rows(wide_rows) < memory_budget.get_max_rows(ROWS)
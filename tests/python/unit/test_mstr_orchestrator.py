@@ -0,0 +1,62 @@
+import pytest
+from fake_mstr_api import FakeMstrApi
+from mstr_orchestrator import CubeRefresh, CubeRefreshOrchestrator, CUBE_STATUS_FAILED, CUBE_STATUS_PUBLISHED
+from mstr_uploader import ChunkSizer
+
+
+COLUMNS_NAMES = ["id", "label"]
+COLUMNS_TYPES = ["bigint", "string"]
+
+
+def build_cube(cube_name, rows_count, get_chunks=None):
+    rows = [(index, "row") for index in range(rows_count)]
+    return CubeRefresh(
+        cube_name, COLUMNS_NAMES, COLUMNS_TYPES, get_chunks or (lambda: [rows[:rows_count // 2], rows[rows_count // 2:]]),
+        chunk_sizer=ChunkSizer(min_rows=4, max_rows=4, initial_rows=4)
+    )
+
+
+def build_orchestrator(api, cubes, max_concurrent_cubes=1):
+    orchestrator = CubeRefreshOrchestrator(api.build_session, "P1", max_concurrent_cubes=max_concurrent_cubes, max_concurrent_uploads=2, max_concurrent_publishes=1)
+    for cube in cubes:
+        orchestrator.add_cube(cube)
+    return orchestrator
+
+
+def test_cubes_are_refreshed_in_order_and_published_after_their_upload():
+    api = FakeMstrApi()
+    orchestrator = build_orchestrator(api, [build_cube("first", 10), build_cube("second", 7), build_cube("third", 0)])
+    reports = orchestrator.run()
+    assert api.get_events("create") == [("first",), ("second",), ("third",)]
+    for cube_name in ["first", "second", "third"]:
+        cube_events = [event for event in api.events if event[1] == cube_name]
+        assert cube_events[-1] == ("publish", cube_name)
+    assert [(report["cube"], report["status"], report["rows"]) for report in reports] == [
+        ("first", CUBE_STATUS_PUBLISHED, 10), ("second", CUBE_STATUS_PUBLISHED, 7), ("third", CUBE_STATUS_PUBLISHED, 0)
+    ]
+    assert api.get_received_rows("first") == 10
+    assert api.get_received_rows("second") == 7
+    orchestrator.raise_on_failure()
+
+
+def test_failing_cubes_do_not_stop_the_others():
+    def failing_chunks():
+        yield [(1, "row")]
+        raise IOError("Input dataset could not be read")
+    api = FakeMstrApi(failing_dataset_names=["rejected"])
+    orchestrator = build_orchestrator(
+        api, [build_cube("unreadable", 0, get_chunks=failing_chunks), build_cube("rejected", 5), build_cube("valid", 5)], max_concurrent_cubes=2
+    )
+    reports = orchestrator.run()
+    assert [report["status"] for report in reports] == [CUBE_STATUS_FAILED, CUBE_STATUS_FAILED, CUBE_STATUS_PUBLISHED]
+    assert "could not be read" in reports[0]["error"]
+    assert "Injected error" in reports[1]["error"]
+    assert api.get_events("publish") == [("valid",)]
+    with pytest.raises(Exception, match="2 of 3 cubes: 'unreadable' .*, 'rejected'"):
+        orchestrator.raise_on_failure()
+
+
+def test_cube_cannot_be_refreshed_twice():
+    orchestrator = build_orchestrator(FakeMstrApi(), [build_cube("first", 1)])
+    with pytest.raises(ValueError):
+        orchestrator.add_cube(build_cube("first", 1))
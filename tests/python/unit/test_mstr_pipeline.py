@@ -0,0 +1,74 @@
+import pandas
+import pytest
+from fake_mstr_api import FakeMstrApi
+from mstr_pipeline import BulkLoadPipeline, bulk_load
+from mstr_uploader import ChunkSizer
+
+
+COLUMNS_NAMES = ["id", "label"]
+COLUMNS_TYPES = ["bigint", "string"]
+
+
+def build_dataframes(rows_counts):
+    dataframes = []
+    first_id = 0
+    for rows_count in rows_counts:
+        dataframes.append(pandas.DataFrame({"id": range(first_id, first_id + rows_count), "label": ["row"] * rows_count}))
+        first_id += rows_count
+    return dataframes
+
+
+def build_chunk_sizer(chunk_rows):
+    return ChunkSizer(min_rows=chunk_rows, max_rows=chunk_rows, initial_rows=chunk_rows)
+
+
+def test_bulk_load_replaces_the_cube_content():
+    api = FakeMstrApi()
+    api.add_dataset("sales", ["dss_data"])
+    metrics = bulk_load(
+        api.build_session(), "P1", "sales", COLUMNS_NAMES, COLUMNS_TYPES, build_dataframes([7, 7, 7]),
+        encode_workers=2, upload_workers=3, chunk_sizer=build_chunk_sizer(5)
+    )
+    assert api.get_events("create") == []
+    assert api.events[:2] == [("replace", "sales", "dss_data"), ("open", "sales")]
+    # Input chunks are cut and merged along the chunk size
+    assert sorted(api.upload_sessions["S1"]["chunks"]) == [("dss_data", index, 5) for index in range(1, 5)] + [("dss_data", 5, 1)]
+    assert api.events[-1] == ("publish", "sales")
+    assert metrics.counters["rows"] == 21
+
+
+def test_bulk_load_creates_a_missing_cube():
+    api = FakeMstrApi()
+    bulk_load(api.build_session(), "P1", "sales", COLUMNS_NAMES, COLUMNS_TYPES, [[(1, "a"), (2, "b")]], chunk_sizer=build_chunk_sizer(5))
+    assert api.get_events("create") == [("sales",)]
+    assert api.get_received_rows("sales") == 2
+
+
+def test_empty_input_sends_one_empty_chunk():
+    api = FakeMstrApi()
+    bulk_load(api.build_session(), "P1", "sales", COLUMNS_NAMES, COLUMNS_TYPES, [], chunk_sizer=build_chunk_sizer(5))
+    assert api.upload_sessions["S1"]["chunks"] == [("dss_data", 1, 0)]
+    assert api.get_events("publish") == [("sales",)]
+
+
+def test_upload_failure_stops_every_stage():
+    api = FakeMstrApi(failing_dataset_names=["sales"])
+    session = api.build_session()
+    dataset_id = session.create_dataset("P1", "sales", "dss_data", COLUMNS_NAMES, COLUMNS_TYPES)
+    session.open_upload_session("P1", dataset_id, "dss_data", {"columns": [{"name": "id"}, {"name": "label"}]}, COLUMNS_TYPES)
+    pipeline = BulkLoadPipeline(session, encode_workers=2, upload_workers=2, queue_size=2, chunk_sizer=build_chunk_sizer(5), table_name="dss_data")
+    with pytest.raises(Exception, match="Injected error"):
+        pipeline.run(build_dataframes([100] * 20))
+    assert pipeline.stopped.is_set()
+    assert pipeline.metrics.counters["chunks_read"] < 400
+    assert not any(thread.is_alive() for thread in pipeline.threads)
+
+
+def test_read_failure_is_raised():
+    def failing_chunks():
+        yield [(1, "a")]
+        raise IOError("Input dataset could not be read")
+    api = FakeMstrApi()
+    with pytest.raises(IOError, match="could not be read"):
+        bulk_load(api.build_session(), "P1", "sales", COLUMNS_NAMES, COLUMNS_TYPES, failing_chunks(), chunk_sizer=build_chunk_sizer(5))
+    assert api.get_events("publish") == []
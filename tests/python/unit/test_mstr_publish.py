@@ -0,0 +1,101 @@
+import json
+import time
+import pytest
+import requests
+from mstr_session import MstrSession
+from mstr_publish import PublishMonitor, PublishTimeout, PendingPublication
+
+
+@pytest.fixture(autouse=True)
+def state_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv("MSTR_PLUGIN_STATE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def build_response(status_code, json_body):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(json_body).encode("utf-8")
+    response.request = requests.Request("GET", "http://server/api/publishStatus").prepare()
+    return response
+
+
+class FakeTokenManager(object):
+    def get_token(self, server_url, username, password, transport=None):
+        return "token", {}
+
+
+def build_session(responses):
+    # Upload session whose publishStatus calls get the given answers in turn
+    session = MstrSession("http://server/MicroStrategyLibrary/api", "user", "password", token_manager=FakeTokenManager())
+    session.upload_session_project_id = "P1"
+    session.upload_session_dataset_id = "D1"
+    session.upload_session_id = "S1"
+    session.publish_upload_session = lambda: None
+    session.build_headers = lambda project_id: {}
+    session.get = lambda url=None, headers=None: responses.pop(0)
+    return session
+
+
+def test_publication_completes():
+    session = build_session([build_response(200, {"status": 0}), build_response(200, {"status": 1})])
+    status = PublishMonitor(session, initial_poll_interval=0.01).start().wait()
+    assert status == {"status": 1}
+
+
+@pytest.mark.parametrize("status_code", [403, 404])
+def test_client_error_stops_the_polling(status_code):
+    session = build_session([build_response(status_code, {"code": "ERR004", "message": "Upload session not found"})])
+    monitor = PublishMonitor(session, timeout=60, initial_poll_interval=0.01).start()
+    with pytest.raises(Exception, match="Error {}".format(status_code)):
+        monitor.wait()
+
+
+def test_throttled_status_call_is_polled_again():
+    session = build_session([build_response(429, {"message": "Too many requests"}), build_response(200, {"status": "Completed"})])
+    assert PublishMonitor(session, initial_poll_interval=0.01).start().wait() == {"status": "Completed"}
+
+
+def test_failed_publication():
+    session = build_session([build_response(200, {"status": "Failed"})])
+    with pytest.raises(Exception, match="failed"):
+        PublishMonitor(session, initial_poll_interval=0.01).start().wait()
+
+
+def test_publication_timeout():
+    session = build_session([build_response(200, {"status": 0}) for poll_index in range(100)])
+    start_time = time.time()
+    with pytest.raises(PublishTimeout):
+        PublishMonitor(session, timeout=0.05, initial_poll_interval=0.01).start().wait()
+    assert time.time() - start_time < 5
+
+
+def test_done_callback_gets_the_outcome():
+    session = build_session([build_response(200, {"status": 0}), build_response(200, {"status": 1})])
+    outcomes = []
+    monitor = PublishMonitor(session, initial_poll_interval=0.01).start()
+    monitor.add_done_callback(lambda finished_monitor: outcomes.append(finished_monitor.is_completed()))
+    monitor.wait()
+    monitor.add_done_callback(lambda finished_monitor: outcomes.append(finished_monitor.status))
+    assert outcomes == [True, {"status": 1}]
+
+
+def test_followed_publication_is_not_requested_again():
+    session = build_session([build_response(200, {"status": "Failed"})])
+    session.publish_upload_session = None
+    monitor = PublishMonitor(session, initial_poll_interval=0.01, project_id="P2", dataset_id="D2", upload_session_id="S2").follow()
+    with pytest.raises(Exception, match="failed"):
+        monitor.wait()
+    assert not monitor.is_completed()
+
+
+def test_pending_publication_record():
+    session = build_session([])
+    monitor = PublishMonitor(session).follow()
+    pending_publication = PendingPublication(["server", "user", "P1", None, "cube"])
+    assert pending_publication.load() is None
+    pending_publication.save(monitor, schema_fingerprint="fingerprint")
+    pending = PendingPublication(["server", "user", "P1", None, "cube"]).load()
+    assert (pending["dataset_id"], pending["upload_session_id"], pending["schema_fingerprint"]) == ("D1", "S1", "fingerprint")
+    pending_publication.forget()
+    assert pending_publication.load() is None
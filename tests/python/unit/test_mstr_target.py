@@ -0,0 +1,31 @@
+import pytest
+from mstr_target import TargetFingerprint
+
+
+TARGET_KEY_PARTS = ["http://server", "user", "P1", None, "cube"]
+
+
+@pytest.fixture(autouse=True)
+def state_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv("MSTR_PLUGIN_STATE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_dataset_id_is_known_while_the_schema_is_unchanged():
+    assert TargetFingerprint(TARGET_KEY_PARTS, "schema").get_known_dataset_id() is None
+    TargetFingerprint(TARGET_KEY_PARTS, "schema").save("D1")
+    assert TargetFingerprint(TARGET_KEY_PARTS, "schema").get_known_dataset_id() == "D1"
+    assert TargetFingerprint(TARGET_KEY_PARTS, "changed schema").get_known_dataset_id() is None
+
+
+def test_fingerprints_are_kept_per_target():
+    TargetFingerprint(TARGET_KEY_PARTS, "schema").save("D1")
+    assert TargetFingerprint(TARGET_KEY_PARTS[:-1] + ["other cube"], "schema").get_known_dataset_id() is None
+
+
+def test_forgotten_target_is_searched_again():
+    TargetFingerprint(TARGET_KEY_PARTS, "schema").save("D1")
+    target_fingerprint = TargetFingerprint(TARGET_KEY_PARTS, "schema")
+    target_fingerprint.forget()
+    assert target_fingerprint.get_known_dataset_id() is None
+    assert TargetFingerprint(TARGET_KEY_PARTS, "schema").get_known_dataset_id() is None
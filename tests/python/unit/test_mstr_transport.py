@@ -0,0 +1,187 @@
+import io
+import pytest
+import requests
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+import mstr_transport
+from mstr_transport import MstrTransport, RetryPolicy, AdaptiveConcurrencyLimiter, get_retry_after
+
+
+class FakeRequestsSession(object):
+    # Stands for requests.Session: answers each call with the next queued response, or raises the next queued error
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        data = kwargs.get("data")
+        self.calls.append({"method": method, "url": url, "body": data.read() if hasattr(data, "read") else data, "kwargs": kwargs})
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def close(self):
+        pass
+
+
+class FakeAuth(object):
+    def __init__(self):
+        self.refreshed_tokens = []
+
+    def refresh(self, token):
+        self.refreshed_tokens.append(token)
+
+
+def build_response(status_code, headers=None, token="token"):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response.request = requests.Request("GET", "http://server/api", headers={"X-MSTR-AuthToken": token}).prepare()
+    return response
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    recorded_sleeps = []
+    monkeypatch.setattr(mstr_transport.time, "sleep", recorded_sleeps.append)
+    return recorded_sleeps
+
+
+def build_transport(outcomes, **policy_kwargs):
+    transport = MstrTransport(retry_policy=RetryPolicy(**policy_kwargs))
+    transport.session = FakeRequestsSession(outcomes)
+    return transport
+
+
+def test_idempotent_call_is_retried_on_server_errors(sleeps):
+    transport = build_transport([build_response(502), build_response(500), build_response(200)])
+    assert transport.get("http://server/api").status_code == 200
+    assert len(transport.session.calls) == 3
+    assert transport.statistics["retries"] == 2
+    assert len(sleeps) == 2
+
+
+def test_idempotent_call_gives_up_after_max_retries(sleeps):
+    transport = build_transport([build_response(503)] * 3, max_retries=2)
+    assert transport.get("http://server/api").status_code == 503
+    assert len(transport.session.calls) == 3
+
+
+def test_non_idempotent_call_is_not_retried_on_errors_the_server_may_have_processed(sleeps):
+    transport = build_transport([build_response(500)])
+    assert transport.post("http://server/api").status_code == 500
+    assert len(transport.session.calls) == 1
+    assert not sleeps
+
+
+def test_non_idempotent_call_is_retried_when_not_processed(sleeps):
+    transport = build_transport([build_response(429), build_response(503), build_response(503), build_response(200)], non_idempotent_max_retries=2)
+    assert transport.post("http://server/api").status_code == 503
+    assert len(transport.session.calls) == 3
+
+
+def test_read_timeout_is_only_retried_for_idempotent_calls(sleeps):
+    transport = build_transport([requests.exceptions.ReadTimeout(), build_response(200)])
+    assert transport.put("http://server/api").status_code == 200
+    transport = build_transport([requests.exceptions.ReadTimeout()])
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        transport.post("http://server/api")
+
+
+def test_connect_timeout_is_retried_for_every_call(sleeps):
+    transport = build_transport([requests.exceptions.ConnectTimeout(), build_response(200)])
+    assert transport.post("http://server/api").status_code == 200
+
+
+def test_retry_after_sets_the_delay(sleeps):
+    transport = build_transport([build_response(503, {"Retry-After": "7"}), build_response(200)])
+    transport.get("http://server/api")
+    assert sleeps == [7.0]
+
+
+def test_retry_after_is_capped(sleeps):
+    transport = build_transport([build_response(429, {"Retry-After": "3600"}), build_response(200)], max_backoff=30)
+    transport.get("http://server/api")
+    assert sleeps == [30]
+
+
+def test_body_is_rewound_before_each_attempt(sleeps):
+    transport = build_transport([build_response(503), build_response(200)])
+    body = io.BytesIO(b"header chunk body")
+    body.seek(len(b"header "))
+    transport.put("http://server/api", data=body)
+    assert [call["body"] for call in transport.session.calls] == [b"chunk body", b"chunk body"]
+
+
+def test_expired_token_is_refreshed_once(sleeps):
+    auth = FakeAuth()
+    transport = build_transport([build_response(401, token="expired"), build_response(200)])
+    assert transport.get("http://server/api", auth=auth).status_code == 200
+    assert auth.refreshed_tokens == ["expired"]
+    assert transport.statistics["reauthentications"] == 1
+    assert not sleeps
+
+
+def test_second_401_is_returned(sleeps):
+    auth = FakeAuth()
+    transport = build_transport([build_response(401), build_response(401)])
+    assert transport.get("http://server/api", auth=auth).status_code == 401
+    assert len(auth.refreshed_tokens) == 1
+    assert len(transport.session.calls) == 2
+
+
+def test_backoff_stays_under_its_cap():
+    retry_policy = RetryPolicy(backoff_factor=1, max_backoff=4)
+    assert all(0 <= retry_policy.get_backoff(attempt) <= 4 for attempt in range(10))
+    assert retry_policy.get_backoff(0, retry_after=2) >= 2
+
+
+def test_get_retry_after():
+    assert get_retry_after(build_response(503)) is None
+    assert get_retry_after(build_response(503, {"Retry-After": "5"})) == 5.0
+    assert get_retry_after(build_response(503, {"Retry-After": "-5"})) == 0.0
+    assert get_retry_after(build_response(503, {"Retry-After": "soon"})) is None
+    retry_date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+    assert 50 < get_retry_after(build_response(503, {"Retry-After": retry_date})) <= 60
+    past_date = format_datetime(datetime.now(timezone.utc) - timedelta(seconds=60), usegmt=True)
+    assert get_retry_after(build_response(503, {"Retry-After": past_date})) == 0.0
+
+
+def upload(limiter, latency, payload_size):
+    limiter.release(limiter.acquire(), latency=latency, payload_size=payload_size)
+
+
+def test_larger_chunks_do_not_lower_the_concurrency_limit():
+    # The chunk sizer grows the payloads from 250 KB to 5 MB, which a healthy server answers 20 times slower
+    limiter = AdaptiveConcurrencyLimiter(8)
+    for chunk_index in range(8):
+        upload(limiter, 0.1, 250000)
+    for chunk_index in range(60):
+        upload(limiter, 2.0, 5000000)
+    assert limiter.get_statistics()["lowest_concurrency_limit"] == 8
+
+
+def test_slower_answers_for_the_same_payload_size_lower_the_concurrency_limit():
+    limiter = AdaptiveConcurrencyLimiter(8)
+    for chunk_index in range(8):
+        upload(limiter, 0.1, 5000000)
+    for chunk_index in range(10):
+        upload(limiter, 2.0, 5000000)
+    assert limiter.get_statistics()["concurrency_limit"] < 8
+
+
+def test_millisecond_latencies_do_not_lower_the_concurrency_limit():
+    limiter = AdaptiveConcurrencyLimiter(8)
+    for chunk_index in range(8):
+        upload(limiter, 0.002, 100000)
+    for chunk_index in range(10):
+        upload(limiter, 0.02, 100000)
+    assert limiter.get_statistics()["concurrency_decreases"] == 0
+
+
+def test_limited_upload_reports_its_payload_size(sleeps):
+    transport = build_transport([build_response(200)])
+    transport.concurrency_limiter = AdaptiveConcurrencyLimiter(4)
+    transport.put("http://server/api", data=io.BytesIO(b"x" * 3000), concurrency_limited=True)
+    assert list(transport.concurrency_limiter.latency_histories) == [(3000).bit_length()]
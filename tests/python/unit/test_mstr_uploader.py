@@ -0,0 +1,88 @@
+import io
+import threading
+import pytest
+from mstr_uploader import ChunkUploader, ChunkSizer
+from mstr_checkpoint import UploadCheckpoint, CHUNK_ACKNOWLEDGED
+
+
+ROW_SIZE = 1000
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.next_index = 0
+        self.pushed_chunks = {}
+        self.lock = threading.Lock()
+
+    def upload_session_next_index(self, table_name=None):
+        with self.lock:
+            self.next_index += 1
+            return self.next_index
+
+    def filter_rows(self, rows, rows_filter, table_name=None):
+        return rows_filter(rows)
+
+    def build_upload_chunk_body(self, rows, index, output=None, table_name=None):
+        output = output or io.BytesIO()
+        output.write(b"x" * (ROW_SIZE * len(rows)))
+        output.seek(0)
+        return output, ROW_SIZE * len(rows)
+
+    def upload_session_push_body(self, body, index, table_name=None):
+        with self.lock:
+            self.pushed_chunks[index] = len(body.read())
+
+
+@pytest.fixture
+def checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setenv("MSTR_PLUGIN_STATE_DIR", str(tmp_path))
+    upload_checkpoint = UploadCheckpoint(["server", "user", "P1", None, "cube"], "fingerprint")
+    upload_checkpoint.start("P1", "D1", "S1", "add")
+    return upload_checkpoint
+
+
+def keep_new_rows(rows):
+    return [row for row in rows if row[0] > 10]
+
+
+def test_first_chunk_is_sized_from_a_sample():
+    chunk_sizer = ChunkSizer(target_size=50 * ROW_SIZE, min_rows=1, initial_rows=5000)
+    assert not chunk_sizer.is_calibrated()
+    chunk_sizer.calibrate([("row",)] * 5000, lambda sample: ROW_SIZE * len(sample))
+    assert chunk_sizer.is_calibrated()
+    assert chunk_sizer.chunk_rows == 50
+
+
+def test_first_chunk_is_split_before_upload():
+    session = FakeSession()
+    chunk_sizer = ChunkSizer(target_size=50 * ROW_SIZE, min_rows=1, initial_rows=5000)
+    uploader = ChunkUploader(session, max_workers=4, chunk_sizer=chunk_sizer)
+    uploader.push_rows([("row",)] * 5000)
+    uploader.wait()
+    assert len(session.pushed_chunks) == 100
+    assert max(session.pushed_chunks.values()) == 50 * ROW_SIZE
+    assert sum(session.pushed_chunks.values()) == 5000 * ROW_SIZE
+
+
+def test_chunks_left_empty_by_the_filter_are_not_sent(checkpoint):
+    session = FakeSession()
+    uploader = ChunkUploader(session, rows_filter=keep_new_rows, checkpoint=checkpoint)
+    uploader.push_rows([(1,), (2,)])
+    uploader.push_rows([(11,), (3,)])
+    uploader.push_rows([(4,)])
+    uploader.wait()
+    assert session.pushed_chunks == {1: ROW_SIZE}
+    assert uploader.pushed_chunks == 1
+    # The input rows of the skipped chunk are replayed with the next chunk on resume
+    assert checkpoint.get_chunks() == [(1, 4, CHUNK_ACKNOWLEDGED)]
+
+
+def test_empty_chunk_is_not_checkpointed(checkpoint):
+    session = FakeSession()
+    uploader = ChunkUploader(session, rows_filter=keep_new_rows, checkpoint=checkpoint)
+    uploader.push_rows([(1,)])
+    assert uploader.pushed_chunks == 0
+    uploader.push_empty_chunk()
+    uploader.wait()
+    assert session.pushed_chunks == {1: 0}
+    assert checkpoint.get_chunks() == []